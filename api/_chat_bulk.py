@@ -0,0 +1,298 @@
+"""
+Gravação em massa no chat_history e importação de conversas em JSONL.
+Arquivos com _ no início não se tornam endpoints.
+
+save_chat_message grava uma linha por chamada; para restaurar backup ou
+encher um banco de teste de carga isso leva horas. Aqui:
+
+- bulk_insert_chat_messages grava muitas mensagens de uma vez: INSERT com
+  vários VALUES (execute_values) para lotes pequenos e COPY FROM STDIN a
+  partir de BULK_COPY_MIN_ROWS linhas; depois recalcula session_stats só
+  das sessões que mudaram
+- import_transcripts lê o JSONL inteiro primeiro, ordena todas as mensagens
+  por created_at e só então grava, em lotes: assim os ids novos de
+  chat_history seguem created_at no arquivo todo, não só dentro de um lote.
+  Sessão que já tem no banco mensagem mais nova que a mais antiga importada
+  é recusada (os ids dela sairiam fora de ordem); com --replace o histórico
+  antigo é apagado antes e isso não acontece
+
+    python api/_chat_bulk.py import backup.jsonl [--replace] [--no-style] [--batch 50000]
+
+Cada linha do JSONL é uma conversa:
+
+    {"session_id": "...", "conversation_id": "...", "title": "...",
+     "messages": [{"role": "user", "content": "...", "created_at": "2025-01-01T10:00:00"}, ...]}
+
+ou uma mensagem solta ({"session_id", "role", "content", "created_at"}).
+Também aceita as mensagens no formato de /api/conversations/:id
+({"sender", "text", "timestamp"}). Mensagem sem created_at fica 1µs depois
+da anterior; se ainda não houve nenhuma com horário, 1µs antes da próxima.
+As mensagens novas não avisam o canal ao vivo.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extras import execute_values
+
+from _db import db_cursor
+from _migrations import ensure_schema
+from _session_stats import refresh_session_stats
+from _writing_style import rebuild_writing_style
+
+# A partir de quantas linhas vale mais COPY do que INSERT ... VALUES
+BULK_COPY_MIN_ROWS = 5000
+BULK_VALUES_PAGE_SIZE = 1000
+# Mensagens por transação na importação
+BULK_IMPORT_BATCH_MESSAGES = 50000
+
+CHAT_ROLES = ('user', 'assistant', 'admin', 'matteo_admin')
+# Remetente do front-end -> papel no chat_history (inverso de message_sender)
+ROLES_BY_SENDER = {'user': 'user', 'pablo': 'admin', 'matteo': 'assistant', 'bot': 'assistant'}
+
+_COPY_CHAT_HISTORY_SQL = "COPY chat_history (session_id, role, content, created_at) FROM STDIN WITH (FORMAT csv)"
+
+CONVERSATION_IMPORT_SQL = """
+    INSERT INTO conversations AS c (id, session_id, title, last_message, created_at, updated_at)
+    VALUES %s
+    ON CONFLICT (session_id) DO UPDATE SET
+        title = CASE WHEN c.title = 'Nova conversa' THEN EXCLUDED.title ELSE c.title END,
+        last_message = CASE WHEN EXCLUDED.updated_at >= c.updated_at THEN EXCLUDED.last_message ELSE c.last_message END,
+        created_at = LEAST(c.created_at, EXCLUDED.created_at),
+        updated_at = GREATEST(c.updated_at, EXCLUDED.updated_at)
+"""
+
+
+class TranscriptError(ValueError):
+    pass
+
+
+def bulk_insert_chat_messages(cur, rows, copy_min_rows=BULK_COPY_MIN_ROWS):
+    """
+    Grava [(session_id, role, content, created_at), ...] na ordem dada (os
+    ids crescem nessa ordem) e recalcula session_stats das sessões tocadas,
+    na transação de quem chamou. Retorna quantas mensagens gravou.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    if len(rows) < copy_min_rows:
+        execute_values(
+            cur,
+            "INSERT INTO chat_history (session_id, role, content, created_at) VALUES %s",
+            rows,
+            page_size=BULK_VALUES_PAGE_SIZE,
+        )
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for session_id, role, content, created_at in rows:
+            writer.writerow((session_id, role, content, created_at.isoformat()))
+        buffer.seek(0)
+        cur.copy_expert(_COPY_CHAT_HISTORY_SQL, buffer)
+
+    refresh_session_stats(cur, session_ids={row[0] for row in rows})
+    return len(rows)
+
+
+def parse_timestamp(value):
+    """created_at do JSONL -> datetime sem fuso (em UTC se vier com fuso), ou None"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+    parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_transcript(data):
+    """
+    Uma linha do JSONL -> (session_id, dados da conversa, [(role, content, created_at), ...])
+    com as mensagens em ordem de created_at. Levanta TranscriptError se a linha não serve.
+    """
+    if not isinstance(data, dict):
+        raise TranscriptError("linha não é um objeto JSON")
+    session_id = data.get('session_id') or data.get('sessionId')
+    if not session_id:
+        raise TranscriptError("sem session_id")
+    raw_messages = data.get('messages')
+    if raw_messages is None:
+        raw_messages = [data]  # Mensagem solta
+
+    parsed = []
+    for position, message in enumerate(raw_messages):
+        if not isinstance(message, dict):
+            raise TranscriptError(f"mensagem {position} não é um objeto")
+        role = message.get('role') or ROLES_BY_SENDER.get(message.get('sender'))
+        if role not in CHAT_ROLES:
+            raise TranscriptError(f"mensagem {position} com papel inválido: {role or message.get('sender')!r}")
+        content = message.get('content', message.get('text'))
+        if not isinstance(content, str) or not content:
+            raise TranscriptError(f"mensagem {position} sem texto")
+        try:
+            created_at = parse_timestamp(message.get('created_at', message.get('timestamp')))
+        except ValueError:
+            raise TranscriptError(f"mensagem {position} com created_at inválido")
+        parsed.append((created_at, role, content))
+
+    # Sem horário: 1µs depois da anterior; antes da primeira com horário, 1µs antes da próxima
+    previous = parse_timestamp(data.get('created_at') or data.get('createdAt')) if 'messages' in data else None
+    if previous is None:
+        following = next((created_at for created_at, _, _ in parsed if created_at is not None), None)
+        if following is None:
+            following = datetime.now(timezone.utc).replace(tzinfo=None)
+        leading = next((i for i, (created_at, _, _) in enumerate(parsed) if created_at is not None), len(parsed))
+        previous = following - timedelta(microseconds=leading + 1)
+    messages = []
+    for position, (created_at, role, content) in enumerate(parsed):
+        if created_at is None:
+            created_at = previous + timedelta(microseconds=1)
+        previous = created_at
+        messages.append((created_at, position, role, content))
+
+    # Estável: mensagens com o mesmo created_at ficam na ordem do arquivo
+    messages.sort(key=lambda item: item[:2])
+    # Numa mensagem solta, "id" é o da mensagem, não o da conversa
+    conversation_id = data.get('conversation_id') or (data.get('id') if 'messages' in data else None)
+    conversation = {'id': conversation_id, 'title': data.get('title')}
+    return session_id, conversation, [(role, content, created_at) for created_at, _, role, content in messages]
+
+
+def _conversation_rows(conversations):
+    """{session_id: conversa acumulada no lote} -> linhas de CONVERSATION_IMPORT_SQL"""
+    rows = []
+    for session_id, conv in conversations.items():
+        last_message = conv['last_message']
+        rows.append((
+            conv['id'] or f"conv_{session_id}_{int(conv['created_at'].replace(tzinfo=timezone.utc).timestamp())}",
+            session_id,
+            (conv['title'] or 'Nova conversa')[:255],
+            last_message[:50] + ('...' if len(last_message) > 50 else ''),
+            conv['created_at'],
+            conv['updated_at'],
+        ))
+    return rows
+
+
+def _newer_existing_sessions(cur, first_imported):
+    """Sessões que já têm mensagem mais nova que a mais antiga importada delas"""
+    sessions = sorted(first_imported)
+    cur.execute("""
+        SELECT i.session_id FROM unnest(%s::text[], %s::timestamp[]) AS i(session_id, first_at)
+        WHERE EXISTS (
+            SELECT 1 FROM chat_history h WHERE h.session_id = i.session_id AND h.created_at > i.first_at
+        )
+    """, (sessions, [first_imported[session_id] for session_id in sessions]))
+    return {row[0] for row in cur.fetchall()}
+
+
+def import_transcripts(lines, replace=False, rebuild_style=True, batch_messages=BULK_IMPORT_BATCH_MESSAGES):
+    """
+    Importa conversas em JSONL (um iterável de linhas). Lê tudo antes de
+    gravar (o arquivo inteiro fica em memória) para ordenar todas as
+    mensagens por created_at, depois grava em lotes de batch_messages
+    mensagens, um commit por lote. replace=True apaga antes o histórico das
+    sessões importadas (restaurar backup sem duplicar); sem replace, sessão
+    com mensagem no banco mais nova que as importadas é ignorada.
+    Retorna {'messages', 'sessions', 'skipped'}.
+    """
+    ensure_schema()
+    skipped = 0
+    messages = []  # [(created_at, sequência, linha de bulk_insert_chat_messages)]
+    conversations = {}
+    lines_by_session = {}
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            session_id, conversation, transcript = parse_transcript(json.loads(line))
+        except (ValueError, TranscriptError) as e:
+            skipped += 1
+            print(f"⚠️ Linha {line_number} ignorada: {e}")
+            continue
+        if not transcript:
+            continue
+
+        for role, content, created_at in transcript:
+            messages.append((created_at, len(messages), (session_id, role, content, created_at)))
+
+        first, last = transcript[0], transcript[-1]
+        conv = conversations.setdefault(session_id, {
+            'id': None, 'title': None, 'created_at': first[2], 'updated_at': last[2], 'last_message': last[1],
+        })
+        conv['id'] = conv['id'] or conversation['id']
+        conv['title'] = conv['title'] or conversation['title']
+        conv['created_at'] = min(conv['created_at'], first[2])
+        if last[2] >= conv['updated_at']:
+            conv['updated_at'], conv['last_message'] = last[2], last[1]
+        lines_by_session[session_id] = lines_by_session.get(session_id, 0) + 1
+
+    if not replace and conversations:
+        with db_cursor() as cur:
+            rejected = _newer_existing_sessions(
+                cur, {session_id: conv['created_at'] for session_id, conv in conversations.items()}
+            )
+        for session_id in sorted(rejected):
+            print(f"⚠️ Sessão {session_id} ignorada: já tem mensagens mais novas que as importadas (use --replace)")
+            skipped += lines_by_session[session_id]
+            del conversations[session_id]
+        if rejected:
+            messages = [item for item in messages if item[2][0] not in rejected]
+
+    # Estável: mensagens com o mesmo created_at ficam na ordem do arquivo
+    messages.sort(key=lambda item: item[:2])
+    rows = [row for _, _, row in messages]
+    total = 0
+    for start in range(0, len(rows), batch_messages):
+        with db_cursor() as cur:
+            if replace and start == 0:
+                sessions = sorted(conversations)
+                cur.execute("DELETE FROM chat_history WHERE session_id = ANY(%s)", (sessions,))
+                cur.execute("DELETE FROM user_writing_style WHERE session_id = ANY(%s)", (sessions,))
+            total += bulk_insert_chat_messages(cur, rows[start:start + batch_messages])
+            if start + batch_messages >= len(rows):
+                execute_values(cur, CONVERSATION_IMPORT_SQL, _conversation_rows(conversations),
+                               page_size=BULK_VALUES_PAGE_SIZE)
+        if start + batch_messages < len(rows):
+            print(f"📥 {total} mensagens importadas...")
+
+    style_sessions = sorted({row[0] for row in rows if row[1] == 'user'})
+    if rebuild_style and style_sessions:
+        with db_cursor() as cur:
+            for session_id in style_sessions:
+                rebuild_writing_style(cur, session_id)
+
+    return {'messages': total, 'sessions': len(conversations), 'skipped': skipped}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python api/_chat_bulk.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help='importa conversas em JSONL para chat_history e conversations')
+    importer.add_argument('path', help="arquivo .jsonl ('-' lê da entrada padrão)")
+    importer.add_argument('--replace', action='store_true', help='apaga antes o histórico das sessões importadas')
+    importer.add_argument('--no-style', action='store_true', help='não recalcula o estilo de escrita')
+    importer.add_argument('--batch', type=int, default=BULK_IMPORT_BATCH_MESSAGES, help='mensagens por transação')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8')
+    try:
+        result = import_transcripts(source, replace=args.replace, rebuild_style=not args.no_style,
+                                    batch_messages=max(1, args.batch))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"✅ {result['messages']} mensagens de {result['sessions']} sessões importadas"
+          + (f" ({result['skipped']} linhas ignoradas)" if result['skipped'] else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,120 @@
+"""
+Carregador do contexto do chat em uma única ida ao banco.
+Arquivos com _ no início não se tornam endpoints.
+
+Antes o prompt do Matteo era montado com ~7 consultas separadas
+(histórico, modo grupo, intimidade, resumo, estilo, respostas recentes e
+memórias). Aqui tudo vem de uma consulta só, num snapshot tipado. Com a
+mensagem atual, a busca das memórias relevantes (_memory_search.py) roda
+logo em seguida na mesma conexão e transação.
+"""
+from dataclasses import dataclass, field
+from typing import Optional
+
+from _db import db_cursor
+from _memory_search import select_prompt_memories
+
+CHAT_CONTEXT_QUERY = """
+    WITH history AS (
+        SELECT id, role, content, created_at FROM chat_history
+        WHERE session_id = %(session_id)s
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(history_limit)s
+    ),
+    recent_responses AS (
+        SELECT id, content, created_at FROM chat_history
+        WHERE session_id = %(session_id)s AND role = 'assistant'
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(responses_limit)s
+    ),
+    top_memories AS (
+        SELECT id, memory, ROW_NUMBER() OVER (
+            ORDER BY importance DESC, last_used DESC NULLS LAST, created_at DESC
+        ) AS position
+        FROM gehh_memories
+        ORDER BY position
+        LIMIT %(memories_limit)s
+    )
+    SELECT
+        (SELECT COALESCE(json_agg(json_build_object('role', role, 'content', content)
+                                  ORDER BY created_at, id), '[]'::json)
+         FROM history) AS history,
+        COALESCE((SELECT admin_present FROM session_stats
+                  WHERE session_id = %(session_id)s), FALSE) AS group_mode_active,
+        COALESCE((SELECT user_messages FROM session_stats
+                  WHERE session_id = %(session_id)s), 0) AS user_message_count,
+        (SELECT summary FROM conversation_summaries
+         WHERE session_id = %(session_id)s
+         ORDER BY created_at DESC LIMIT 1) AS summary,
+        (SELECT row_to_json(s) FROM user_writing_style s
+         WHERE s.session_id = %(session_id)s) AS writing_style,
+        (SELECT COALESCE(json_agg(content ORDER BY created_at DESC, id DESC), '[]'::json)
+         FROM recent_responses) AS recent_responses,
+        (SELECT COALESCE(json_agg(json_build_object('id', id, 'memory', memory) ORDER BY position), '[]'::json)
+         FROM top_memories) AS memories
+"""
+
+
+def intimacy_level_from_count(user_message_count):
+    """Converte a quantidade de mensagens da Gehh no nível de intimidade (1-5)"""
+    if user_message_count < 10: return 1
+    if user_message_count < 30: return 2
+    if user_message_count < 100: return 3
+    if user_message_count < 300: return 4
+    return 5
+
+
+@dataclass
+class ChatContext:
+    """Snapshot de tudo que o prompt do Matteo precisa sobre uma sessão"""
+    session_id: str
+    history: list = field(default_factory=list)  # [{'role', 'content'}] em ordem cronológica
+    group_mode_active: bool = False  # Pablo já mandou mensagem nesta sessão
+    user_message_count: int = 0
+    summary: Optional[str] = None
+    writing_style: Optional[dict] = None
+    recent_responses: list = field(default_factory=list)  # mais recente primeiro
+    memories: list = field(default_factory=list)  # [{'id', 'memory'}] as mais importantes (ou as do prompt, com message)
+    used_memory_ids: list = field(default_factory=list)  # escolhidas pela busca, para mark_memories_used na rodada
+
+    @property
+    def intimacy_level(self):
+        return intimacy_level_from_count(self.user_message_count)
+
+
+def load_chat_context(session_id, history_limit=30, responses_limit=5, memories_limit=10, message=None):
+    """
+    Busca o contexto completo da sessão em uma consulta. Com message, troca
+    as memórias mais importantes pelas escolhidas por select_prompt_memories
+    (relevantes para a mensagem e as últimas falas), no mesmo cursor.
+    Em caso de erro retorna um snapshot vazio.
+    """
+    try:
+        with db_cursor(dict_rows=True) as cur:
+            cur.execute(CHAT_CONTEXT_QUERY, {
+                'session_id': session_id,
+                'history_limit': history_limit,
+                'responses_limit': responses_limit,
+                'memories_limit': memories_limit,
+            })
+            row = cur.fetchone()
+            context = ChatContext(
+                session_id=session_id,
+                history=row['history'] or [],
+                group_mode_active=bool(row['group_mode_active']),
+                user_message_count=row['user_message_count'] or 0,
+                summary=row['summary'],
+                writing_style=row['writing_style'],
+                recent_responses=row['recent_responses'] or [],
+                memories=row['memories'] or [],
+            )
+            if message is not None:
+                recent_user_messages = [m['content'] for m in context.history if m['role'] in ('user', 'admin')][-3:]
+                context.memories, context.used_memory_ids = select_prompt_memories(
+                    cur, message, recent_user_messages, fallback_memories=context.memories
+                )
+    except Exception as e:
+        print(f"Erro load_chat_context: {e}")
+        return ChatContext(session_id=session_id)
+
+    return context
@@ -0,0 +1,95 @@
+"""
+Gravação de uma rodada do chat numa transação só.
+Arquivos com _ no início não se tornam endpoints.
+
+Antes cada rodada de /api/chat gravava a mensagem da Gehh logo que chegava
+e, depois da resposta, fazia save_chat_message, get_conversation_by_id /
+get_conversation_by_session_id, update_conversation (às vezes duas vezes),
+get_conversation_message_count e create_conversation, cada um na sua
+conexão e com o seu commit. A mensagem de quem falou continua sendo salva
+sozinha antes do modelo (insert_chat_message), para não se perder se o
+modelo falhar e aparecer logo em /api/live. Depois da resposta, um comando
+só grava as mensagens do Matteo (ferramentas + resposta), soma
+session_stats, cria ou atualiza a conversa da sessão (ON CONFLICT
+(session_id)) e avisa o canal ao vivo; o estilo de escrita e o job de
+aprendizado (learn=True, ver _learning.py) entram na mesma transação:
+
+    conversation_id, ids = save_chat_turn(session_id, [('assistant', resposta)],
+                                          conversation_id, title=titulo, last_message=preview,
+                                          learn=True)
+"""
+from _db import db_cursor
+from _learning import enqueue_learning_job
+from _memory_search import mark_memories_used
+from _session_stats import CHAT_MESSAGES_CTE, CHAT_NOTIFY_SQL, chat_messages_params
+from _writing_style import update_writing_style
+
+# Título novo só entra em conversa nova (até 2 mensagens) ou com título genérico/curto.
+# O session_stats lido aqui é o de antes do comando (mesmo snapshot), por isso soma as mensagens da rodada.
+CHAT_TURN_SQL = f"""
+    WITH {CHAT_MESSAGES_CTE},
+    conversation AS (
+        INSERT INTO conversations AS c (id, session_id, title, last_message, created_at, updated_at)
+        SELECT %(conversation_id)s, %(session_id)s, %(title)s, %(last_message)s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        -- Um id que já é de outra sessão não pode derrubar a rodada: as mensagens ficam, a conversa não muda
+        WHERE NOT EXISTS (
+            SELECT 1 FROM conversations WHERE id = %(conversation_id)s AND session_id <> %(session_id)s
+        )
+        ON CONFLICT (session_id) DO UPDATE SET
+            last_message = EXCLUDED.last_message,
+            title = CASE
+                WHEN COALESCE((SELECT total_messages FROM session_stats WHERE session_id = EXCLUDED.session_id), 0)
+                     + (SELECT COUNT(*) FROM message) <= 2
+                  OR c.title = 'Nova conversa' OR LENGTH(c.title) < 10
+                THEN EXCLUDED.title ELSE c.title
+            END,
+            updated_at = EXCLUDED.updated_at
+        RETURNING c.id
+    )
+    SELECT id,
+           -- Se o id pedido era de outra sessão, devolve a conversa que a sessão já tem (ou NULL)
+           COALESCE(
+               (SELECT id FROM conversation),
+               (SELECT id FROM conversations WHERE session_id = %(session_id)s)
+           ) AS conversation_id,
+           {CHAT_NOTIFY_SQL}
+    FROM message
+    ORDER BY id
+"""
+
+
+def persist_chat_turn(cur, session_id, messages, conversation_id, title, last_message):
+    """
+    Grava [(role, content), ...] em ordem e cria/atualiza a conversa da
+    sessão, num comando só, na transação de quem chamou. Retorna
+    (id da conversa da sessão ou None se ela não tem uma, ids das mensagens).
+    """
+    params = chat_messages_params(session_id, messages)
+    params.update(conversation_id=conversation_id, title=title, last_message=last_message)
+    cur.execute(CHAT_TURN_SQL, params)
+    rows = cur.fetchall()
+    ids = [row['id'] if isinstance(row, dict) else row[0] for row in rows]
+    saved_conversation_id = None
+    if rows:
+        saved_conversation_id = rows[0]['conversation_id'] if isinstance(rows[0], dict) else rows[0][1]
+    return saved_conversation_id, ids
+
+
+def save_chat_turn(session_id, messages, conversation_id, title, last_message, learn=False,
+                   used_memory_ids=()):
+    """
+    persist_chat_turn + estilo de escrita das mensagens da Gehh (+ job de
+    aprendizado da sessão, se learn, e last_used das memórias que a busca
+    pôs no prompt), com um commit só. Levanta exceção se o banco falhar
+    (nada da rodada fica gravado).
+    """
+    with db_cursor() as cur:
+        result = persist_chat_turn(cur, session_id, messages, conversation_id, title, last_message)
+        for role, content in messages:
+            if role == 'user':
+                update_writing_style(cur, session_id, content)
+        mark_memories_used(cur, used_memory_ids)
+        if learn:
+            # Comando separado: a marca d'água precisa enxergar as mensagens que acabaram de entrar
+            enqueue_learning_job(cur, session_id)
+    return result
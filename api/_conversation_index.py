@@ -0,0 +1,237 @@
+"""
+Listagem das conversas do Matteo numa consulta só.
+Arquivos com _ no início não se tornam endpoints.
+
+Antes a lista fazia uma ida ao banco por conversa (contagem de mensagens
+em chat.py, todas as mensagens no admin de conversations.py). Aqui a
+contagem vem de session_stats e as mensagens de um LEFT JOIN LATERAL que
+usa o índice (session_id, id) de chat_history:
+
+    items, next_cursor = list_conversations(cur, limit=20, messages='preview')
+
+messages:
+- 'none': só os dados da conversa e messageCount
+- 'preview': as últimas CONVERSATION_PREVIEW_MESSAGES mensagens
+- 'full': todas as mensagens
+
+A paginação é por keyset em (updated_at, id), do mais recente para o mais
+antigo; o cursor é opaco (mesmo formato do mural).
+
+As mensagens de uma conversa (GET /api/conversations/:id) saem de
+list_messages, paginadas pelo id de chat_history: after_id para buscar só
+o que chegou depois da última mensagem que o cliente já tem, before_id
+para carregar as mais antigas. conversation_etag muda quando chega, sai
+mensagem ou a conversa é editada, então o polling recebe 304 enquanto nada
+muda.
+"""
+import base64
+import json
+from datetime import datetime
+
+CONVERSATION_DEFAULT_PAGE_SIZE = 20
+CONVERSATION_MAX_PAGE_SIZE = 100
+CONVERSATION_PREVIEW_MESSAGES = 3
+MESSAGE_DEFAULT_PAGE_SIZE = 100
+MESSAGE_MAX_PAGE_SIZE = 500
+
+MESSAGES_NONE = 'none'
+MESSAGES_PREVIEW = 'preview'
+MESSAGES_FULL = 'full'
+MESSAGES_MODES = (MESSAGES_NONE, MESSAGES_PREVIEW, MESSAGES_FULL)
+
+CONVERSATION_LIST_QUERY = """
+    SELECT c.id, c.session_id, c.title, c.last_message, c.created_at, c.updated_at,
+           COALESCE(s.total_messages, 0) AS message_count,
+           GREATEST(c.updated_at, s.updated_at) AS last_activity
+           {messages_column}
+    FROM conversations c
+    LEFT JOIN session_stats s ON s.session_id = c.session_id
+    {messages_join}
+    {where}
+    ORDER BY c.updated_at DESC, c.id DESC
+    LIMIT %(limit)s
+"""
+
+# LIMIT NULL = sem limite (modo 'full')
+_MESSAGES_JOIN = """
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object('id', h.id, 'role', h.role, 'content', h.content, 'created_at', h.created_at)
+                        ORDER BY h.id) AS messages
+        FROM (
+            SELECT role, content, created_at, id FROM chat_history
+            WHERE session_id = c.session_id
+            ORDER BY id DESC
+            LIMIT %(messages_limit)s
+        ) h
+    ) m ON TRUE
+"""
+
+# Páginas de mensagens pelo id de chat_history (list_messages)
+MESSAGES_AFTER_QUERY = """
+    SELECT id, role, content, created_at FROM chat_history
+    WHERE session_id = %(session_id)s AND id > %(after_id)s
+    ORDER BY id
+    LIMIT %(limit)s
+"""
+
+MESSAGES_BEFORE_QUERY = """
+    SELECT id, role, content, created_at FROM chat_history
+    WHERE session_id = %(session_id)s AND id < %(before_id)s
+    ORDER BY id DESC
+    LIMIT %(limit)s
+"""
+
+CONVERSATION_HEADER_QUERY = """
+    SELECT c.id, c.session_id, c.title, c.last_message, c.created_at, c.updated_at,
+           COALESCE(s.total_messages, 0) AS message_count,
+           COALESCE(s.last_message_id, 0) AS last_message_id
+    FROM conversations c
+    LEFT JOIN session_stats s ON s.session_id = c.session_id
+    WHERE c.id = %s
+"""
+
+_SENDERS = {'admin': 'pablo', 'matteo_admin': 'matteo', 'user': 'user'}
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def message_sender(role):
+    """Papel no chat_history -> remetente que o front-end entende"""
+    return _SENDERS.get(role, 'bot')
+
+
+def format_messages(messages):
+    """Mensagens do banco -> formato do front-end (id = chat_history.id, estável entre requisições)"""
+    return [
+        {
+            'id': m['id'],
+            'text': m['content'],
+            'sender': message_sender(m['role']),
+            'timestamp': _isoformat(m['created_at']),
+        }
+        for m in messages
+    ]
+
+
+def _isoformat(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def encode_conversation_cursor(row):
+    """Cursor opaco com a chave de ordenação (updated_at, id) do último item da página"""
+    key = json.dumps([_isoformat(row['updated_at']), row['id']])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_conversation_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(updated_at), str(conversation_id)
+    except Exception:
+        raise InvalidCursorError("Cursor inválido")
+
+
+def list_conversations(cur, limit=CONVERSATION_DEFAULT_PAGE_SIZE, cursor=None, messages=MESSAGES_NONE,
+                       preview_messages=CONVERSATION_PREVIEW_MESSAGES, skip_empty=False):
+    """
+    Uma página de conversas, da atualizada mais recentemente para a mais
+    antiga, com messageCount e (opcional) as mensagens. Retorna
+    (itens, próximo_cursor). cur precisa ser um RealDictCursor.
+    """
+    if messages not in MESSAGES_MODES:
+        raise ValueError(f"messages deve ser um de {', '.join(MESSAGES_MODES)}")
+
+    conditions = []
+    params = {
+        'limit': limit + 1,  # Um a mais para saber se tem próxima página
+        'messages_limit': preview_messages if messages == MESSAGES_PREVIEW else None,
+    }
+    if cursor:
+        params['cursor_updated_at'], params['cursor_id'] = decode_conversation_cursor(cursor)
+        conditions.append("(c.updated_at, c.id) < (%(cursor_updated_at)s, %(cursor_id)s)")
+    if skip_empty:
+        conditions.append("s.total_messages > 0")
+
+    with_messages = messages != MESSAGES_NONE
+    cur.execute(CONVERSATION_LIST_QUERY.format(
+        messages_column=", COALESCE(m.messages, '[]'::json) AS messages" if with_messages else "",
+        messages_join=_MESSAGES_JOIN if with_messages else "",
+        where=f"WHERE {' AND '.join(conditions)}" if conditions else "",
+    ), params)
+    rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for row in rows:
+        item = {
+            'id': row['id'],
+            'sessionId': row['session_id'],
+            'title': row['title'],
+            'lastMessage': row['last_message'] or 'Nova conversa',
+            'createdAt': _isoformat(row['created_at']),
+            'updatedAt': _isoformat(row['updated_at']),
+            'lastActivity': _isoformat(row['last_activity'] or row['updated_at']),
+            'messageCount': row['message_count'],
+        }
+        if with_messages:
+            # As mensagens do json_agg vêm com created_at em texto ISO
+            item['messages'] = format_messages(row['messages'])
+        items.append(item)
+
+    next_cursor = encode_conversation_cursor(rows[-1]) if has_more else None
+    return items, next_cursor
+
+
+def get_conversation_header(cur, conversation_id):
+    """Retorna (dados da conversa com messageCount e lastMessageId, ETag), ou (None, None) se não existe"""
+    cur.execute(CONVERSATION_HEADER_QUERY, (conversation_id,))
+    row = cur.fetchone()
+    if not row:
+        return None, None
+    conversation = {
+        'id': row['id'],
+        'sessionId': row['session_id'],
+        'title': row['title'],
+        'lastMessage': row['last_message'] or 'Nova conversa',
+        'createdAt': _isoformat(row['created_at']),
+        'updatedAt': _isoformat(row['updated_at']),
+        'messageCount': row['message_count'],
+        'lastMessageId': row['last_message_id'],
+    }
+    return conversation, conversation_etag(row)
+
+
+def conversation_etag(row):
+    """Muda com mensagem nova (last_message_id), apagada (contagem) ou conversa editada (updated_at)"""
+    updated_at = row['updated_at'].timestamp() if hasattr(row['updated_at'], 'timestamp') else row['updated_at']
+    return f'W/"conv-{row["last_message_id"]}-{row["message_count"]}-{updated_at}"'
+
+
+def list_messages(cur, session_id, after_id=None, before_id=None, limit=None):
+    """
+    Mensagens da sessão em ordem cronológica (pelo id de chat_history).
+    - after_id: só as mais novas que ele (as primeiras `limit` delas)
+    - before_id: as `limit` imediatamente anteriores a ele
+    - nenhum: desde o começo (limit=None = todas)
+    Retorna (mensagens, has_more): has_more diz se ficou mensagem de fora
+    na direção pedida (mais novas com after_id, mais antigas com before_id).
+    """
+    params = {'session_id': session_id, 'limit': limit + 1 if limit else None}
+    if before_id is not None:
+        params['before_id'] = before_id
+        cur.execute(MESSAGES_BEFORE_QUERY, params)
+        rows = cur.fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = list(reversed(rows[:limit] if limit else rows))
+    else:
+        params['after_id'] = after_id or 0
+        cur.execute(MESSAGES_AFTER_QUERY, params)
+        rows = cur.fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit else rows
+    return format_messages(rows), has_more
@@ -1,102 +1,289 @@
 """
 Módulo de conexão com o banco de dados PostgreSQL para Vercel.
 Arquivos com _ no início não se tornam endpoints.
+
+Todas as funções do api/ pegam conexões daqui. As conexões ficam num pool
+no nível do módulo, então uma instância "quente" da Vercel reaproveita as
+conexões entre requisições em vez de abrir um handshake TCP+TLS+auth novo
+a cada consulta.
 """
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import threading
+import time
+from contextlib import contextmanager
+
+from _session_stats import insert_chat_message
+from _writing_style import update_writing_style
+
+# Tentar importar psycopg2
+try:
+    import psycopg2
+    import psycopg2.extensions
+    from psycopg2.extras import RealDictCursor
+    DB_AVAILABLE = True
+except ImportError:
+    DB_AVAILABLE = False
+    print("psycopg2 não disponível")
 
 # A Vercel usa POSTGRES_URL ou DATABASE_URL
 POSTGRES_URL = os.environ.get("POSTGRES_URL") or os.environ.get("DATABASE_URL")
 
+# ============== CONFIGURAÇÕES DO POOL ==============
+
+# Máximo de conexões ociosas guardadas por instância
+DB_POOL_MAX_IDLE_CONNECTIONS = int(os.environ.get("DB_POOL_MAX_IDLE_CONNECTIONS", 4))
+# Conexões ociosas há mais tempo que isso são fechadas (segundos)
+DB_POOL_MAX_IDLE_SECONDS = float(os.environ.get("DB_POOL_MAX_IDLE_SECONDS", 300))
+# Conexões ociosas há mais tempo que isso passam por um "SELECT 1" antes de voltar pro uso
+DB_POOL_HEALTHCHECK_AFTER_SECONDS = float(os.environ.get("DB_POOL_HEALTHCHECK_AFTER_SECONDS", 30))
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", 5))
+
+
+class ConnectionPool:
+    """Pool simples de conexões com health check, expiração por ociosidade e reconexão"""
+
+    def __init__(self, dsn, max_idle_connections, max_idle_seconds, healthcheck_after_seconds):
+        self.dsn = dsn
+        self.max_idle_connections = max_idle_connections
+        self.max_idle_seconds = max_idle_seconds
+        self.healthcheck_after_seconds = healthcheck_after_seconds
+        self._idle = []  # [(conexão, momento em que voltou pro pool)]
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            self.dsn,
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
+        )
+        self.stats['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        self.stats['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Pega uma conexão saudável do pool (ou abre uma nova)"""
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                return self._connect()
+
+            conn, returned_at = item
+            idle_for = time.monotonic() - returned_at
+            if conn.closed or idle_for > self.max_idle_seconds:
+                self._discard(conn)
+                continue
+            if idle_for > self.healthcheck_after_seconds and not self._is_healthy(conn):
+                print("⚠️ Conexão do pool quebrada, reconectando")
+                self._discard(conn)
+                continue
+
+            self.stats['reused'] += 1
+            return conn
+
+    def putconn(self, conn):
+        """Devolve a conexão pro pool, descartando se estiver quebrada"""
+        if conn.closed:
+            self.stats['discarded'] += 1
+            return
+        try:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Transação esquecida aberta (ex: função que retornou sem commit)
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_idle_connections:
+                self._idle.append((conn, time.monotonic()))
+                return
+        self._discard(conn)
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+class PooledConnection:
+    """
+    Conexão emprestada do pool. Funciona igual a uma conexão do psycopg2,
+    mas close() devolve a conexão pro pool em vez de fechá-la.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(raw, name)
+
+    @property
+    def closed(self):
+        return 1 if self._raw is None else self._raw.closed
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.putconn(raw)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    def __del__(self):
+        # Conexões esquecidas sem close() (ex: return no meio da função) voltam pro pool
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Retorna o pool do módulo, criando na primeira chamada"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    POSTGRES_URL,
+                    max_idle_connections=DB_POOL_MAX_IDLE_CONNECTIONS,
+                    max_idle_seconds=DB_POOL_MAX_IDLE_SECONDS,
+                    healthcheck_after_seconds=DB_POOL_HEALTHCHECK_AFTER_SECONDS,
+                )
+    return _pool
+
 
 def get_db_connection():
-    """Retorna uma conexão com o banco de dados PostgreSQL"""
-    if not POSTGRES_URL:
-        raise Exception("POSTGRES_URL não configurada.")
-    
-    conn = psycopg2.connect(POSTGRES_URL)
+    """Retorna uma conexão do pool (ou None se o banco não estiver configurado)"""
+    if not POSTGRES_URL or not DB_AVAILABLE:
+        return None
+    pool = get_pool()
+    return PooledConnection(pool, pool.getconn())
+
+
+def open_listen_connection():
+    """
+    Abre uma conexão fora do pool, em autocommit, para LISTEN (ver live.py).
+    O LISTEN fica preso à sessão do Postgres, então essa conexão nunca volta
+    pro pool: quem abriu fecha. Retorna None se o banco não estiver configurado.
+    """
+    if not POSTGRES_URL or not DB_AVAILABLE:
+        return None
+    conn = psycopg2.connect(
+        POSTGRES_URL,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3,
+    )
+    conn.autocommit = True
     return conn
 
 
-def init_db():
-    """Inicializa o banco de dados criando as tabelas se não existirem"""
+@contextmanager
+def db_cursor(dict_rows=False):
+    """
+    Context manager que empresta uma conexão, entrega um cursor e faz
+    commit no final (ou rollback se der erro). Levanta exceção se o banco
+    não estiver configurado.
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise Exception("POSTGRES_URL não configurada.")
+    cur = conn.cursor(cursor_factory=RealDictCursor) if dict_rows else conn.cursor()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Tabela de feedback
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS feedback (
-                id VARCHAR(36) PRIMARY KEY,
-                author VARCHAR(255) NOT NULL,
-                message TEXT NOT NULL,
-                created_at TIMESTAMP NOT NULL,
-                updated_at TIMESTAMP
-            );
-        """)
-        
-        # Tabela de histórico de conversas do chatbot
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id SERIAL PRIMARY KEY,
-                session_id VARCHAR(255) NOT NULL,
-                role VARCHAR(20) NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        
-        # Índice para buscar por session_id
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_chat_history_session 
-            ON chat_history(session_id);
-        """)
-        
+        yield cur
         conn.commit()
-        cur.close()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
         conn.close()
-        return True
-    except Exception as e:
-        print(f"ERRO ao inicializar o banco de dados: {e}")
-        return False
 
 
-def get_chat_history(session_id: str, limit: int = 20):
-    """Busca o histórico de conversa de uma sessão"""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cur.execute("""
-            SELECT role, content FROM chat_history 
-            WHERE session_id = %s 
-            ORDER BY created_at DESC 
-            LIMIT %s
-        """, (session_id, limit))
-        
-        # Inverter para ordem cronológica
-        history = list(reversed(cur.fetchall()))
-        
-        cur.close()
-        conn.close()
-        
-        return [{"role": h["role"], "content": h["content"]} for h in history]
-    except Exception as e:
-        print(f"Erro ao buscar histórico: {e}")
-        return []
+def run_query(sql, params=None, fetch=None, dict_rows=False):
+    """
+    Executa uma única consulta numa conexão do pool e faz commit.
+    fetch: None, 'one' ou 'all'. Se a conexão reaproveitada tiver caído
+    (broken pipe, servidor reiniciou), tenta de novo uma vez numa conexão nova.
+    """
+    for attempt in range(2):
+        try:
+            with db_cursor(dict_rows=dict_rows) as cur:
+                cur.execute(sql, params)
+                if fetch == 'one':
+                    return cur.fetchone()
+                if fetch == 'all':
+                    return cur.fetchall()
+                return cur.rowcount
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if attempt == 1:
+                raise
+            print(f"⚠️ Conexão caiu durante a consulta, tentando de novo: {e}")
+
+
+def init_db():
+    """Garante que o schema do banco está atualizado (ver _migrations.py)"""
+    from _migrations import ensure_schema
+    return ensure_schema()
 
 
 def save_chat_message(session_id: str, role: str, content: str):
-    """Salva uma mensagem no histórico"""
+    """Salva uma mensagem no histórico (e atualiza os contadores da sessão)"""
     try:
         conn = get_db_connection()
+        if not conn:
+            return False
         cur = conn.cursor()
         
-        cur.execute("""
-            INSERT INTO chat_history (session_id, role, content)
-            VALUES (%s, %s, %s)
-        """, (session_id, role, content))
+        insert_chat_message(cur, session_id, role, content)
+        if role == 'user':
+            update_writing_style(cur, session_id, content)
         
         conn.commit()
         cur.close()
@@ -105,38 +292,3 @@ def save_chat_message(session_id: str, role: str, content: str):
     except Exception as e:
         print(f"Erro ao salvar mensagem: {e}")
         return False
-
-
-def cleanup_old_chat_history(session_id: str, keep_last: int = 20):
-    """Remove mensagens antigas mantendo apenas as últimas N"""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Conta quantas mensagens existem
-        cur.execute("""
-            SELECT COUNT(*) FROM chat_history WHERE session_id = %s
-        """, (session_id,))
-        
-        count = cur.fetchone()[0]
-        
-        if count > keep_last:
-            # Remove as mais antigas
-            cur.execute("""
-                DELETE FROM chat_history 
-                WHERE session_id = %s 
-                AND id NOT IN (
-                    SELECT id FROM chat_history 
-                    WHERE session_id = %s 
-                    ORDER BY created_at DESC 
-                    LIMIT %s
-                )
-            """, (session_id, session_id, keep_last))
-            
-            conn.commit()
-        
-        cur.close()
-        conn.close()
-    except Exception as e:
-        print(f"Erro ao limpar histórico: {e}")
-
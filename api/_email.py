@@ -1,9 +1,58 @@
 """
 Módulo de envio de e-mail para notificações.
+
+Os e-mails das notificações não seguram mais a resposta: vão para a outbox
+(_outbox.py), e o drain_outbox manda o lote inteiro numa sessão SMTP só:
+
+    with smtp_session() as server:
+        for msg in mensagens:
+            server.sendmail(msg['From'], msg['To'], msg.as_string())
 """
 import os
 import smtplib
+from contextlib import contextmanager
 from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+SMTP_TIMEOUT_SECONDS = 15
+
+
+def email_settings():
+    """(remetente, senha, destinatário) das variáveis de ambiente"""
+    return (
+        os.environ.get('SENDER_EMAIL'),
+        os.environ.get('SENDER_PASSWORD'),
+        os.environ.get('RECEIVER_EMAIL'),
+    )
+
+
+def email_configured():
+    return all(email_settings())
+
+
+def build_email(subject, text, html=None):
+    """Monta a mensagem (texto + HTML opcional) do remetente para o destinatário configurados"""
+    sender, _, receiver = email_settings()
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = receiver
+    msg.attach(MIMEText(text, 'plain', 'utf-8'))
+    if html:
+        msg.attach(MIMEText(html, 'html', 'utf-8'))
+    return msg
+
+
+@contextmanager
+def smtp_session():
+    """Conexão SMTP já com STARTTLS e login, para mandar vários e-mails seguidos"""
+    sender, password, _ = email_settings()
+    server_host = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
+    port = int(os.environ.get('SMTP_PORT', 587))
+    with smtplib.SMTP(server_host, port, timeout=SMTP_TIMEOUT_SECONDS) as server:
+        server.starttls()
+        server.login(sender, password)
+        yield server
 
 
 def send_email_notification(author: str, message: str):
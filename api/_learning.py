@@ -0,0 +1,418 @@
+"""
+Pipeline de aprendizado do Matteo: extração de memórias e resumos de conversa.
+Arquivos com _ no início não se tornam endpoints.
+
+Nada disso roda mais antes da resposta do chat. A rodada salva
+(save_chat_turn com learn=True) grava ou atualiza, na mesma transação, um
+job em learning_jobs com a marca d'água = maior chat_history.id naquele momento:
+
+    enqueue_learning_job(cur, session_id)
+
+Depois de mandar a resposta, o próprio /api/chat chama learn_after_response
+(process_learning_jobs com um orçamento curto); o /api/cron e o /api/worker
+pegam o que ficou para trás. process_learning_jobs pega os jobs em lote e,
+por sessão:
+- extrai memórias quando ela mandou LEARNING_MEMORY_EVERY mensagens desde a
+  última extração (das últimas 10 mensagens)
+- resume a conversa a cada LEARNING_SUMMARY_EVERY mensagens (das últimas 50)
+
+As memórias do lote inteiro são gravadas num INSERT só, já sem repetidas
+(comparando em minúsculas com as que existem). O progresso de cada sessão
+fica em learning_state, então rodar o mesmo job duas vezes não duplica nada.
+A marca d'água só anda quando o modelo respondeu de verdade: modelo fora do
+ar ou resposta sem JSON levanta exceção e o job volta para a fila com backoff.
+"""
+import json
+import os
+import time
+
+from _db import db_cursor
+from _llm import LLM_MODEL, chat_completion, llm_available
+
+LEARNING_MEMORY_EVERY = 5
+LEARNING_MEMORY_WINDOW = 10
+LEARNING_SUMMARY_EVERY = 50
+LEARNING_SUMMARY_WINDOW = 50
+
+LEARNING_BATCH_SIZE = int(os.environ.get("LEARNING_BATCH_SIZE", 5))
+LEARNING_MAX_ATTEMPTS = 3
+LEARNING_BACKOFF_BASE_SECONDS = 60
+# Job preso em "running" há mais que isso (worker morreu no meio) volta para a fila
+LEARNING_CLAIM_TIMEOUT_SECONDS = 10 * 60
+LEARNING_DRAIN_BUDGET_SECONDS = 40
+# Orçamento do aprendizado feito pelo /api/chat depois da resposta (cabe no maxDuration junto com o chat)
+LEARNING_INLINE_BUDGET_SECONDS = 15
+
+# Últimas mensagens da sessão até a marca d'água do job (texto para o modelo)
+CONVERSATION_TEXT_QUERY = """
+    SELECT role, content FROM chat_history
+    WHERE session_id = %s AND id <= %s
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+# Prompt para extrair memórias (REFORÇADO)
+MEMORY_EXTRACTION_PROMPT = """Você é um sistema especializado em extrair informações importantes de conversas.
+
+Analise a conversa abaixo e extraia TODAS as informações relevantes sobre a Gehh, mesmo que pareçam pequenas.
+
+CATEGORIAS DE INFORMAÇÕES:
+1. EMOCIONAL: O que a deixa feliz/triste/irritada, como ela reage a situações
+2. ROTINA: Horários, atividades do dia a dia, hábitos
+3. RELACIONAMENTO: Detalhes sobre o Pablo, momentos especiais, preferências do casal
+4. PREFERÊNCIAS: Comidas, músicas, séries, filmes, lugares, cores, estilos
+5. PESSOAS: Amigos, família, pessoas importantes na vida dela
+6. SONHOS/METAS: Planos futuros, desejos, objetivos
+7. PROBLEMAS: Coisas que a incomodam, dificuldades que ela enfrenta
+8. INTERESSES: Hobbies, coisas que ela gosta de fazer, assuntos que ela curte
+
+IMPORTANTE:
+- Extraia informações específicas e detalhadas
+- Inclua contexto quando relevante
+- Mesmo informações pequenas podem ser importantes
+- Prefira múltiplas memórias específicas a uma memória genérica
+
+CONVERSA:
+{conversation}
+
+Responda APENAS com JSON válido:
+{{"memories": ["memória detalhada 1", "memória detalhada 2", "memória detalhada 3"]}}
+
+Se não tiver nada importante:
+{{"memories": []}}"""
+
+# Prompt para resumir conversas longas (REFORÇADO)
+CONVERSATION_SUMMARY_PROMPT = """Você é um sistema especializado em resumir conversas mantendo TODAS as informações importantes.
+
+Resuma esta conversa entre Matteo e Gehh de forma COMPLETA mas concisa (máximo 250 palavras).
+
+MANTENHA TODOS OS DETALHES IMPORTANTES:
+- Humor e estado emocional da Gehh durante a conversa
+- Assuntos principais discutidos
+- Promessas ou compromissos feitos
+- Informações pessoais reveladas
+- Problemas ou preocupações mencionados
+- Momentos especiais ou engraçados
+- Mudanças de humor ou tópico
+- Contexto emocional (ela estava feliz? triste? estressada?)
+- Qualquer informação que possa ser útil em conversas futuras
+
+SEJA ESPECÍFICO:
+- Não use "ela falou sobre trabalho" → use "ela estava estressada com um projeto no trabalho"
+- Não use "ela mencionou o Pablo" → use "ela estava feliz porque o Pablo fez algo especial"
+- Inclua detalhes que ajudem a entender o contexto completo
+
+CONVERSA:
+{conversation}
+
+RESUMO (seja específico e detalhado):"""
+
+
+# ============== CHAMADAS AO MODELO ==============
+
+# Erros sobem (API fora, modelo indisponível, resposta sem JSON): o worker
+# devolve o job para a fila e tenta de novo depois, sem avançar a marca d'água
+
+class LearningUnavailableError(RuntimeError):
+    pass
+
+
+def extract_memories_from_conversation(conversation_text):
+    """Usa a IA para extrair memórias da conversa"""
+    if not llm_available():
+        raise LearningUnavailableError("Modelo não disponível")
+    
+    response = chat_completion(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": "Você extrai informações importantes de conversas. Responda APENAS em JSON válido."},
+            {"role": "user", "content": MEMORY_EXTRACTION_PROMPT.format(conversation=conversation_text)}
+        ],
+        max_tokens=500,
+        temperature=0.3,
+    )
+    
+    result = response.choices[0].message.content or ""
+    
+    if "{" not in result or "}" not in result:
+        raise ValueError("Resposta da extração sem JSON")
+    json_str = result[result.find("{"):result.rfind("}")+1]
+    memories = json.loads(json_str).get("memories")
+    if not isinstance(memories, list):
+        raise ValueError("Resposta da extração sem a lista de memórias")
+    return memories
+
+
+def summarize_conversation(conversation_text):
+    """Cria um resumo da conversa para contexto infinito"""
+    if not llm_available():
+        raise LearningUnavailableError("Modelo não disponível")
+    
+    response = chat_completion(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": "Você resume conversas de forma concisa mantendo informações importantes."},
+            {"role": "user", "content": CONVERSATION_SUMMARY_PROMPT.format(conversation=conversation_text)}
+        ],
+        max_tokens=300,
+        temperature=0.3,
+    )
+    
+    summary = (response.choices[0].message.content or "").strip()
+    if not summary:
+        raise ValueError("Resumo veio vazio")
+    return summary
+
+
+# ============== FILA ==============
+
+def enqueue_learning_job(cur, session_id):
+    """
+    Marca a sessão para aprendizado até a última mensagem salva. Se já há um
+    job pendente da sessão, só avança a marca d'água (um job por sessão na fila).
+    """
+    cur.execute("""
+        INSERT INTO learning_jobs (session_id, watermark)
+        SELECT %s, COALESCE(MAX(id), 0) FROM chat_history
+        ON CONFLICT (session_id) WHERE status = 'pending'
+        DO UPDATE SET watermark = GREATEST(learning_jobs.watermark, EXCLUDED.watermark)
+    """, (session_id,))
+
+
+def _claim_jobs(limit):
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE learning_jobs j
+            SET status = 'running', attempts = j.attempts + 1, claimed_at = NOW()
+            FROM (
+                SELECT id FROM learning_jobs
+                WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                   OR (status = 'running' AND claimed_at < NOW() - make_interval(secs => %s))
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) batch
+            WHERE j.id = batch.id
+            RETURNING j.id, j.session_id, j.watermark, j.attempts
+        """, (LEARNING_CLAIM_TIMEOUT_SECONDS, limit))
+        return cur.fetchall()
+
+
+def _conversation_text(cur, session_id, watermark, limit):
+    cur.execute(CONVERSATION_TEXT_QUERY, (session_id, watermark, limit))
+    return "\n".join(
+        f"{'Gehh' if role == 'user' else 'Matteo'}: {content}"
+        for role, content in reversed(cur.fetchall())
+    )
+
+
+def _run_job(session_id, watermark):
+    """
+    Faz o trabalho de um job. Retorna (memórias extraídas, novo estado), sem
+    gravar nada ainda: o estado só avança junto com o INSERT das memórias, e
+    só na parte em que o modelo respondeu (erro sobe antes disso).
+    """
+    # Leituras numa transação curta: a conexão não fica presa durante as chamadas ao modelo
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT memories_watermark, summary_watermark FROM learning_state WHERE session_id = %s
+        """, (session_id,))
+        memories_watermark, summary_watermark = cur.fetchone() or (0, 0)
+        cur.execute("""
+            SELECT COUNT(*) FILTER (WHERE id > %s), COUNT(*) FILTER (WHERE id > %s), COUNT(*)
+            FROM chat_history
+            WHERE session_id = %s AND role = 'user' AND id <= %s
+        """, (memories_watermark, summary_watermark, session_id, watermark))
+        since_memories, since_summary, total_user_messages = cur.fetchone()
+
+        memories_conversation = summary_conversation = None
+        if since_memories >= LEARNING_MEMORY_EVERY:
+            memories_conversation = _conversation_text(cur, session_id, watermark, LEARNING_MEMORY_WINDOW)
+        if since_summary >= LEARNING_SUMMARY_EVERY:
+            summary_conversation = _conversation_text(cur, session_id, watermark, LEARNING_SUMMARY_WINDOW)
+
+    memories = []
+    if memories_conversation is not None:
+        memories = [m.strip() for m in extract_memories_from_conversation(memories_conversation)
+                    if isinstance(m, str) and len(m.strip()) > 5]
+        memories_watermark = watermark
+
+    summary = None
+    if summary_conversation is not None:
+        summary = summarize_conversation(summary_conversation)
+        summary_watermark = watermark
+
+    return memories, {
+        'session_id': session_id,
+        'memories_watermark': memories_watermark,
+        'summary_watermark': summary_watermark,
+        'summary': summary,
+        'message_count': total_user_messages,
+    }
+
+
+def save_memories(cur, memories, category='geral', importance=5):
+    """
+    Grava várias memórias num comando só. As que já existem (mesmo texto em
+    minúsculas) só ganham use_count/last_used. Retorna as que eram novas.
+    """
+    if not memories:
+        return []
+    cur.execute("""
+        WITH incoming AS (
+            SELECT DISTINCT ON (LOWER(memory)) memory
+            FROM unnest(%s::text[]) AS memory
+        ),
+        existing AS (
+            UPDATE gehh_memories g
+            SET use_count = COALESCE(g.use_count, 0) + 1, last_used = CURRENT_TIMESTAMP
+            FROM incoming i
+            WHERE LOWER(g.memory) = LOWER(i.memory)
+            RETURNING LOWER(g.memory) AS key
+        )
+        INSERT INTO gehh_memories (memory, category, importance)
+        SELECT memory, %s, %s FROM incoming
+        WHERE LOWER(memory) NOT IN (SELECT key FROM existing)
+        RETURNING memory
+    """, (list(memories), category, importance))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _finish_jobs(job_ids, memories, states):
+    """Memórias do lote, resumos e progresso das sessões numa transação só"""
+    with db_cursor() as cur:
+        for memory in save_memories(cur, memories):
+            print(f"💾 Nova memória: {memory}")
+        for state in states:
+            if state['summary']:
+                cur.execute("""
+                    INSERT INTO conversation_summaries (session_id, summary, message_count)
+                    VALUES (%s, %s, %s)
+                """, (state['session_id'], state['summary'], state['message_count']))
+                print(f"📝 Resumo salvo: {state['summary'][:100]}...")
+            cur.execute("""
+                INSERT INTO learning_state (session_id, memories_watermark, summary_watermark, updated_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (session_id) DO UPDATE
+                SET memories_watermark = GREATEST(learning_state.memories_watermark, EXCLUDED.memories_watermark),
+                    summary_watermark = GREATEST(learning_state.summary_watermark, EXCLUDED.summary_watermark),
+                    updated_at = CURRENT_TIMESTAMP
+            """, (state['session_id'], state['memories_watermark'], state['summary_watermark']))
+        cur.execute("""
+            UPDATE learning_jobs SET status = 'done', finished_at = NOW(), last_error = NULL
+            WHERE id = ANY(%s)
+        """, (job_ids,))
+
+
+def _fail_job(job_id, session_id, watermark, attempts, error):
+    """
+    Devolve o job para a fila com backoff (ou marca 'failed' depois de
+    LEARNING_MAX_ATTEMPTS tentativas). Só pode haver um job pendente por
+    sessão: se chegou mensagem nova enquanto este rodava, a sessão já tem
+    outro, e os dois viram um só (fica a maior marca d'água).
+    """
+    gave_up = attempts >= LEARNING_MAX_ATTEMPTS
+    backoff = LEARNING_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1)
+    try:
+        with db_cursor() as cur:
+            if gave_up:
+                cur.execute("""
+                    UPDATE learning_jobs SET status = 'failed', last_error = %s
+                    WHERE id = %s
+                """, (error, job_id))
+            else:
+                cur.execute("""
+                    INSERT INTO learning_jobs (session_id, watermark, attempts, last_error, next_attempt_at)
+                    VALUES (%s, %s, %s, %s, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (session_id) WHERE status = 'pending'
+                    DO UPDATE SET watermark = GREATEST(learning_jobs.watermark, EXCLUDED.watermark),
+                                  attempts = GREATEST(learning_jobs.attempts, EXCLUDED.attempts),
+                                  last_error = EXCLUDED.last_error,
+                                  next_attempt_at = GREATEST(learning_jobs.next_attempt_at, EXCLUDED.next_attempt_at)
+                """, (session_id, watermark, attempts, error, backoff))
+                cur.execute("DELETE FROM learning_jobs WHERE id = %s", (job_id,))
+    except Exception as e:
+        # O job fica em 'running' e volta para a fila depois de LEARNING_CLAIM_TIMEOUT_SECONDS
+        print(f"❌ Erro ao devolver o job de aprendizado {job_id} para a fila: {e}")
+        return
+    print(f"{'❌' if gave_up else '⚠️'} Job de aprendizado {job_id} falhou (tentativa {attempts}): {error}")
+
+
+def process_learning_jobs(batch_size=LEARNING_BATCH_SIZE, budget_seconds=LEARNING_DRAIN_BUDGET_SECONDS):
+    """Processa os jobs pendentes, lote a lote. Retorna a contagem por resultado."""
+    started = time.monotonic()
+    summary = {'done': 0, 'retry': 0, 'failed': 0}
+
+    while time.monotonic() - started < budget_seconds:
+        jobs = _claim_jobs(batch_size)
+        if not jobs:
+            break
+
+        done_ids, memories, states = [], [], []
+        for job_id, session_id, watermark, attempts in jobs:
+            try:
+                job_memories, state = _run_job(session_id, watermark)
+            except Exception as e:
+                _fail_job(job_id, session_id, watermark, attempts, f"{type(e).__name__}: {e}")
+                summary['failed' if attempts >= LEARNING_MAX_ATTEMPTS else 'retry'] += 1
+                continue
+            done_ids.append(job_id)
+            memories.extend(job_memories)
+            states.append(state)
+
+        if done_ids:
+            try:
+                _finish_jobs(done_ids, memories, states)
+                summary['done'] += len(done_ids)
+            except Exception as e:
+                for job_id, session_id, watermark, attempts in jobs:
+                    if job_id in done_ids:
+                        _fail_job(job_id, session_id, watermark, attempts, f"{type(e).__name__}: {e}")
+                        summary['failed' if attempts >= LEARNING_MAX_ATTEMPTS else 'retry'] += 1
+
+        if len(jobs) < batch_size:
+            break
+
+    return summary
+
+
+def learn_after_response(budget_seconds=LEARNING_INLINE_BUDGET_SECONDS):
+    """
+    Roda os jobs pendentes logo depois da resposta do chat; nunca levanta
+    exceção (o que não terminar fica para o próximo /api/cron ou /api/worker).
+    """
+    try:
+        summary = process_learning_jobs(budget_seconds=budget_seconds)
+        if any(summary.values()):
+            print(f"🧠 Aprendizado: {summary['done']} job(s), {summary['retry']} para tentar de novo, {summary['failed']} desistido(s)")
+        return summary
+    except Exception as e:
+        print(f"⚠️ Erro no aprendizado depois da resposta: {e}")
+        return None
+
+
+def purge_finished_jobs(retention_days=7):
+    """Apaga os jobs concluídos há mais de retention_days (chamado pelo cron)"""
+    with db_cursor() as cur:
+        cur.execute("""
+            DELETE FROM learning_jobs
+            WHERE status = 'done' AND finished_at < NOW() - make_interval(days => %s)
+        """, (retention_days,))
+        return cur.rowcount
+
+
+def cleanup_orphan_conversations():
+    """Remove conversas que não têm mensagens associadas (chamado pelo cron)"""
+    try:
+        with db_cursor() as cur:
+            cur.execute("""
+                DELETE FROM conversations c
+                WHERE NOT EXISTS (SELECT 1 FROM chat_history h WHERE h.session_id = c.session_id)
+            """)
+            deleted_count = cur.rowcount
+        if deleted_count > 0:
+            print(f"✅ {deleted_count} conversa(s) órfã(s) removida(s)")
+        return deleted_count
+    except Exception as e:
+        print(f"Erro cleanup_orphan_conversations: {e}")
+        return 0
@@ -0,0 +1,201 @@
+"""
+Cliente do Mistral (via SDK da OpenAI) com inicialização preguiçosa e circuit breaker.
+Arquivos com _ no início não se tornam endpoints.
+
+O cliente só é criado na primeira chamada real, e a "prontidão" do modelo é
+inferida pelos resultados das chamadas de verdade - nada de requisição de
+teste no import, que custava uma ida ao Mistral em todo cold start.
+
+Estados do circuit breaker (compartilhado por todo o processo):
+- healthy:  última chamada deu certo
+- degraded: houve falhas recentes, mas ainda tentamos
+- open:     falhas demais seguidas; as chamadas são recusadas até o cooldown
+            passar, quando uma chamada de teste é liberada
+"""
+import os
+import threading
+import time
+
+# Tentar importar OpenAI (funciona com Mistral!)
+try:
+    from openai import OpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+    print("openai não disponível")
+
+MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
+MISTRAL_BASE_URL = "https://api.mistral.ai/v1"
+
+# Modelo principal - PIXTRAL LARGE (MELHOR MODELO MULTIMODAL)
+# Opções disponíveis (da melhor para a mais básica):
+#   - "pixtral-large-latest" (MELHOR - multimodal, 128k contexto) ⭐ USANDO
+#   - "mistral-large-latest" (excelente - 32k contexto, estável)
+#   - "mistral-medium-latest" (boa qualidade, balanceado)
+#   - "mistral-small-latest" (rápido, menos tokens)
+LLM_MODEL = os.environ.get("MISTRAL_MODEL", "pixtral-large-latest")
+# Modelo fallback para quando rate limit for atingido (só em emergência)
+FALLBACK_MODEL = "mistral-large-latest"
+
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", 30))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 1))
+
+# Circuit breaker
+LLM_FAILURES_TO_OPEN = int(os.environ.get("LLM_FAILURES_TO_OPEN", 3))
+LLM_OPEN_COOLDOWN_SECONDS = float(os.environ.get("LLM_OPEN_COOLDOWN_SECONDS", 30))
+
+
+class LLMUnavailableError(Exception):
+    """O LLM não pode ser chamado agora (sem chave, sem biblioteca ou circuito aberto)"""
+
+
+def is_rate_limit_error(error):
+    """Identifica erro de rate limit (429) do Mistral"""
+    error_str = str(error)
+    return "429" in error_str or "rate_limit" in error_str.lower() or "RateLimitError" in str(type(error))
+
+
+class CircuitBreaker:
+    HEALTHY = 'healthy'
+    DEGRADED = 'degraded'
+    OPEN = 'open'
+
+    def __init__(self, failures_to_open, cooldown_seconds):
+        self.failures_to_open = failures_to_open
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is not None:
+            return self.OPEN
+        if self.consecutive_failures > 0:
+            return self.DEGRADED
+        return self.HEALTHY
+
+    def cooling_down(self):
+        """Circuito aberto e ainda dentro do cooldown"""
+        opened_at = self.opened_at
+        return opened_at is not None and time.monotonic() - opened_at < self.cooldown_seconds
+
+    def allow_request(self):
+        """Diz se uma chamada pode ser feita agora (com circuito aberto, libera uma de teste após o cooldown)"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown_seconds or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("✅ Mistral respondeu de novo, fechando o circuito")
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.last_error = None
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.consecutive_failures >= self.failures_to_open:
+                if self.opened_at is None:
+                    print(f"❌ Mistral falhou {self.consecutive_failures}x seguidas, abrindo o circuito por {self.cooldown_seconds:.0f}s")
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+        }
+
+
+breaker = CircuitBreaker(LLM_FAILURES_TO_OPEN, LLM_OPEN_COOLDOWN_SECONDS)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def llm_configured():
+    """Biblioteca instalada e chave configurada (não faz nenhuma chamada)"""
+    return OPENAI_AVAILABLE and bool(MISTRAL_API_KEY)
+
+
+def get_llm_client():
+    """Cria o cliente do Mistral na primeira chamada e reaproveita depois"""
+    global _client
+    if not llm_configured():
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=MISTRAL_API_KEY,
+                    base_url=MISTRAL_BASE_URL,
+                    timeout=LLM_TIMEOUT_SECONDS,
+                    max_retries=LLM_MAX_RETRIES,
+                )
+    return _client
+
+
+def llm_available():
+    """O LLM está configurado e o circuito não está aberto (ou já pode testar de novo)"""
+    return llm_configured() and not breaker.cooling_down()
+
+
+def llm_unavailable_reasons():
+    """Lista legível dos motivos pelos quais o LLM não está disponível"""
+    reasons = []
+    if not OPENAI_AVAILABLE:
+        reasons.append("Biblioteca OpenAI não instalada")
+    if not MISTRAL_API_KEY:
+        reasons.append("MISTRAL_API_KEY não configurada")
+    if llm_configured() and breaker.cooling_down():
+        reasons.append(f"Erro ao conectar com Mistral (circuito aberto: {breaker.last_error})")
+    return reasons
+
+
+def chat_completion(**kwargs):
+    """
+    Wrapper de client.chat.completions.create que alimenta o circuit breaker.
+    Levanta LLMUnavailableError se o LLM não puder ser chamado agora.
+    """
+    client = get_llm_client()
+    if client is None:
+        raise LLMUnavailableError(", ".join(llm_unavailable_reasons()))
+    if not breaker.allow_request():
+        raise LLMUnavailableError(f"Circuito aberto após falhas seguidas: {breaker.last_error}")
+
+    try:
+        response = client.chat.completions.create(**kwargs)
+    except Exception as e:
+        # Rate limit não é queda: quem chamou decide se tenta o modelo fallback
+        if not is_rate_limit_error(e):
+            breaker.record_failure(e)
+        raise
+    breaker.record_success()
+    return response
+
+
+def stream_chat_completion(**kwargs):
+    """
+    Versão em streaming de chat_completion: gera os chunks conforme chegam.
+    Erros no meio do stream também contam como falha no circuit breaker.
+    """
+    stream = chat_completion(stream=True, **kwargs)
+    try:
+        for chunk in stream:
+            yield chunk
+    except Exception as e:
+        if not is_rate_limit_error(e):
+            breaker.record_failure(e)
+        raise
@@ -0,0 +1,199 @@
+"""
+Busca nas memórias da Gehh (gehh_memories) com full-text search do Postgres.
+Arquivos com _ no início não se tornam endpoints.
+
+- search_vector: tsvector gerado da memória (config 'portuguese', com stemming)
+  e índice GIN, criados na migração 12
+- pg_trgm (se a extensão existir no banco): casa palavras escritas errado
+  ou pela metade, pelo índice de trigramas
+- Stop words saem da consulta antes de montar o tsquery, e os termos que
+  sobram entram com OR e prefixo ("viag" acha "viagem")
+
+O ranking combina a relevância textual (ts_rank / similaridade de trigramas)
+com a importância e o quão recente a memória foi usada.
+
+select_prompt_memories escolhe o que entra no prompt do Matteo: as memórias
+relevantes para o que a Gehh acabou de dizer, completadas pelas mais
+importantes, até um orçamento de tokens. Roda no cursor de
+load_chat_context (mesma conexão e transação da consulta do contexto), e
+o last_used das escolhidas pela busca é gravado junto com a rodada
+(mark_memories_used dentro de save_chat_turn), não numa ida a mais.
+"""
+import os
+import re
+
+from _db import db_cursor
+
+# Palavras que não ajudam a achar nada (artigos, preposições, pronomes, verbos auxiliares)
+STOPWORDS = frozenset("""
+    a à ao aos as às até com como da das de dela dele deles do dos e é ela elas ele eles em
+    entre era essa essas esse esses esta está estas este estes eu foi for há isso isto já
+    lhe mais mas me mesmo meu minha muito na nas não nem no nos nós num numa o os ou para
+    pela pelas pelo pelos por qual quando que quem se sem ser seu seus só sua suas também
+    te tem tá tô um uma umas uns você vocês vai vou ter tinha sobre sim aí lá aqui
+    gehh geovana matteo coisa coisas alguma algum algo tudo
+""".split())
+
+_WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Quanto do prompt as memórias podem ocupar (estimativa: ~4 caracteres por token)
+MEMORY_TOKEN_BUDGET = int(os.environ.get("MEMORY_TOKEN_BUDGET", 300))
+MEMORY_RELEVANT_CANDIDATES = 20
+
+# Similaridade mínima (0-1) para o pg_trgm considerar que uma palavra casa
+TRIGRAM_THRESHOLD = 0.4
+
+_SCORE_SQL = """
+    ({relevance})
+    * (1 + m.importance / 10.0)
+    * (1 + 1.0 / (1 + EXTRACT(EPOCH FROM NOW() - COALESCE(m.last_used, m.created_at)) / 86400.0 / 30))
+"""
+
+MARK_MEMORIES_USED_SQL = """
+    UPDATE gehh_memories
+    SET last_used = CURRENT_TIMESTAMP, use_count = COALESCE(use_count, 0) + 1
+    WHERE id = ANY(%s)
+"""
+
+
+# Se o pg_trgm está instalado (None = ainda não verificado neste processo)
+_trigram_available = None
+
+
+def query_terms(text):
+    """Palavras relevantes da consulta: minúsculas, sem stop words, sem repetição"""
+    terms = []
+    for word in _WORD_PATTERN.findall((text or "").lower()):
+        if len(word) < 2 or word in STOPWORDS or word.isdigit() or word in terms:
+            continue
+        terms.append(word)
+    return terms
+
+
+def build_tsquery(terms):
+    """Monta o texto do to_tsquery com OR e prefixo: 'viagem:* | praia:*'"""
+    return " | ".join(f"{term}:*" for term in terms)
+
+
+def trigram_available(cur):
+    """Verifica uma vez por processo, no cursor de quem chamou, se o pg_trgm está instalado"""
+    global _trigram_available
+    if _trigram_available is None:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS installed")
+        row = cur.fetchone()
+        _trigram_available = bool(row['installed'] if isinstance(row, dict) else row[0])
+    return _trigram_available
+
+
+def find_memories(cur, query, limit=10):
+    """
+    search_memories no cursor (e transação) de quem chamou: o limiar do
+    pg_trgm e a busca vão num execute só. Erros sobem.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    params = {
+        'tsquery': build_tsquery(terms),
+        'text': " ".join(terms),
+        'limit': limit,
+    }
+    trigram = trigram_available(cur)
+    if trigram:
+        relevance = "ts_rank(m.search_vector, q.query) + 0.1 * word_similarity(%(text)s, m.memory)"
+        match = "m.search_vector @@ q.query OR %(text)s <%% m.memory"
+    else:
+        relevance = "ts_rank(m.search_vector, q.query)"
+        match = "m.search_vector @@ q.query"
+
+    sql = f"""
+        WITH q AS (SELECT to_tsquery('portuguese', %(tsquery)s) AS query)
+        SELECT m.id, m.memory, m.category, m.importance,
+               {_SCORE_SQL.format(relevance=relevance)} AS score
+        FROM gehh_memories m, q
+        WHERE {match}
+        ORDER BY score DESC, m.id DESC
+        LIMIT %(limit)s
+    """
+    if trigram:
+        # Limiar do operador <% vale só para esta transação; mesmo execute da busca
+        params['threshold'] = str(TRIGRAM_THRESHOLD)
+        sql = "SELECT set_config('pg_trgm.word_similarity_threshold', %(threshold)s, true);" + sql
+    cur.execute(sql, params)
+    return [dict(row) for row in cur.fetchall()]
+
+
+def search_memories(query, limit=10):
+    """
+    Busca as memórias mais relevantes para o texto. Retorna dicts com
+    id, memory, category, importance e score (maior = melhor), já ordenados.
+    """
+    try:
+        with db_cursor(dict_rows=True) as cur:
+            return find_memories(cur, query, limit)
+    except Exception as e:
+        print(f"Erro search_memories: {e}")
+        return []
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def mark_memories_used(cur, memory_ids):
+    """Atualiza last_used/use_count de várias memórias num UPDATE só, na transação de quem chamou"""
+    if memory_ids:
+        cur.execute(MARK_MEMORIES_USED_SQL, (sorted(memory_ids),))
+
+
+def select_prompt_memories(cur, message, recent_messages=(), fallback_memories=(), token_budget=MEMORY_TOKEN_BUDGET):
+    """
+    Escolhe as memórias que vão para o prompt: primeiro as relevantes para a
+    mensagem atual e as últimas falas dela, depois as de fallback (as mais
+    importantes), parando no orçamento de tokens. Retorna (dicts com id e
+    memory, ids das escolhidas pela busca): só essas contam como usadas, as
+    de fallback já entram por importância.
+    """
+    query = " ".join([message or "", *recent_messages])
+    try:
+        relevant = find_memories(cur, query, limit=MEMORY_RELEVANT_CANDIDATES)
+    except Exception as e:
+        # Sem a busca, o prompt fica só com as de fallback
+        print(f"Erro search_memories: {e}")
+        relevant = []
+    relevant_ids = {memory['id'] for memory in relevant}
+
+    selected = []
+    seen = set()
+    used_tokens = 0
+    for memory in relevant + list(fallback_memories):
+        if memory['id'] in seen:
+            continue
+        cost = estimate_tokens(memory['memory'])
+        if used_tokens + cost > token_budget:
+            continue  # Uma menor ainda pode caber
+        selected.append(memory)
+        seen.add(memory['id'])
+        used_tokens += cost
+
+    return selected, [memory['id'] for memory in selected if memory['id'] in relevant_ids]
+
+
+def enable_trigram_search(cur):
+    """
+    Passo de migração: instala o pg_trgm e o índice de trigramas se o banco
+    permitir. Sem a extensão (ou sem permissão), a busca usa só o full-text.
+    """
+    cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    if not cur.fetchone():
+        print("ℹ️ pg_trgm não disponível neste Postgres, busca de memórias só com full-text")
+        return
+    cur.execute("SAVEPOINT enable_pg_trgm")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_gehh_memories_trgm ON gehh_memories USING GIN (memory gin_trgm_ops)")
+        cur.execute("RELEASE SAVEPOINT enable_pg_trgm")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT enable_pg_trgm")
+        print(f"⚠️ Não consegui habilitar o pg_trgm ({e}), busca de memórias só com full-text")
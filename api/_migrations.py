@@ -0,0 +1,398 @@
+"""
+Migrações versionadas do banco de dados.
+Arquivos com _ no início não se tornam endpoints.
+
+O schema é criado/atualizado uma vez por cold start (ensure_schema) ou pela
+linha de comando, em vez de rodar CREATE TABLE/ALTER TABLE em toda requisição:
+
+    python api/_migrations.py          # aplica as migrações pendentes
+    python api/_migrations.py status   # mostra a versão atual do banco
+
+Cada migração tem um número de versão, um nome e uma lista de passos (SQL ou
+funções que recebem o cursor). Nunca altere uma migração já publicada:
+adicione uma nova no fim da lista.
+"""
+import sys
+
+from _db import db_cursor
+from _memory_search import enable_trigram_search
+from _mural_stats import rebuild_mural_stats
+from _session_stats import refresh_session_stats
+from _writing_style import rebuild_writing_style
+
+# Chave do advisory lock que serializa migrações de instâncias concorrentes
+MIGRATION_LOCK_KEY = 7_311_2024
+
+MIGRATIONS = [
+    (1, "chat_history", [
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id SERIAL PRIMARY KEY,
+            session_id VARCHAR(255) NOT NULL,
+            role VARCHAR(20) NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history(session_id)",
+    ]),
+    (2, "gehh_memories", [
+        """
+        CREATE TABLE IF NOT EXISTS gehh_memories (
+            id SERIAL PRIMARY KEY,
+            memory TEXT NOT NULL,
+            category VARCHAR(50) DEFAULT 'geral',
+            importance INTEGER DEFAULT 5,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP,
+            use_count INTEGER DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_gehh_memories_importance ON gehh_memories(importance DESC)",
+    ]),
+    (3, "conversation_summaries", [
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            id SERIAL PRIMARY KEY,
+            session_id VARCHAR(255) NOT NULL,
+            summary TEXT NOT NULL,
+            message_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (4, "conversations", [
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id VARCHAR(255) PRIMARY KEY,
+            session_id VARCHAR(255) NOT NULL UNIQUE,
+            title VARCHAR(255) NOT NULL,
+            last_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at DESC)",
+    ]),
+    (5, "user_writing_style", [
+        """
+        CREATE TABLE IF NOT EXISTS user_writing_style (
+            session_id VARCHAR(255) PRIMARY KEY,
+            avg_message_length INTEGER DEFAULT 0,
+            uses_emojis BOOLEAN DEFAULT FALSE,
+            emoji_frequency REAL DEFAULT 0.0,
+            uses_caps BOOLEAN DEFAULT FALSE,
+            caps_frequency REAL DEFAULT 0.0,
+            common_words TEXT,
+            punctuation_style TEXT,
+            formality_level INTEGER DEFAULT 3,
+            slang_usage REAL DEFAULT 0.0,
+            response_pattern TEXT,
+            style_summary TEXT,
+            message_count INTEGER DEFAULT 0,
+            last_analyzed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (6, "feedback", [
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            id VARCHAR(36) PRIMARY KEY,
+            author VARCHAR(255) NOT NULL,
+            message TEXT NOT NULL,
+            mood VARCHAR(20) DEFAULT 'neutral',
+            is_pinned BOOLEAN DEFAULT FALSE,
+            is_letter BOOLEAN DEFAULT FALSE,
+            is_read BOOLEAN DEFAULT FALSE,
+            read_at TIMESTAMP,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP
+        )
+        """,
+        # Bancos criados pela versão antiga do mural não têm essas colunas
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS mood VARCHAR(20) DEFAULT 'neutral'",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS is_pinned BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS is_letter BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS is_read BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS read_at TIMESTAMP",
+    ]),
+    (7, "feedback_replies", [
+        """
+        CREATE TABLE IF NOT EXISTS feedback_replies (
+            id VARCHAR(36) PRIMARY KEY,
+            feedback_id VARCHAR(36) REFERENCES feedback(id) ON DELETE CASCADE,
+            message TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+        """,
+    ]),
+    (8, "achievements", [
+        """
+        CREATE TABLE IF NOT EXISTS achievements (
+            id VARCHAR(36) PRIMARY KEY,
+            user_id VARCHAR(255) DEFAULT 'gehh',
+            achievement_key VARCHAR(50) NOT NULL,
+            unlocked_at TIMESTAMP NOT NULL,
+            UNIQUE(user_id, achievement_key)
+        )
+        """,
+    ]),
+    (9, "mural_stats", [
+        """
+        CREATE TABLE IF NOT EXISTS mural_stats (
+            id VARCHAR(36) PRIMARY KEY,
+            stat_date DATE NOT NULL UNIQUE,
+            mood VARCHAR(20),
+            post_count INTEGER DEFAULT 0
+        )
+        """,
+    ]),
+    (10, "push_subscriptions", [
+        """
+        CREATE TABLE IF NOT EXISTS push_subscriptions (
+            id SERIAL PRIMARY KEY,
+            endpoint TEXT NOT NULL UNIQUE,
+            p256dh TEXT NOT NULL,
+            auth TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (11, "tool_cache", [
+        """
+        CREATE TABLE IF NOT EXISTS tool_cache (
+            cache_key VARCHAR(40) PRIMARY KEY,
+            tool_name VARCHAR(50) NOT NULL,
+            result TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tool_cache_expires ON tool_cache(expires_at)",
+    ]),
+    (12, "gehh_memories_search", [
+        """
+        ALTER TABLE gehh_memories ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('portuguese', memory)) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_gehh_memories_search ON gehh_memories USING GIN (search_vector)",
+        enable_trigram_search,
+    ]),
+    (13, "feedback_feed_indexes", [
+        # Respostas de um post em ordem (listagem do mural)
+        "CREATE INDEX IF NOT EXISTS idx_feedback_replies_feedback ON feedback_replies(feedback_id, created_at)",
+        # Ordem da listagem / keyset pagination
+        "CREATE INDEX IF NOT EXISTS idx_feedback_feed ON feedback(is_pinned DESC, created_at DESC, id DESC)",
+    ]),
+    (14, "mural_stats_rollup", [
+        # A mural_stats da migração 9 nunca foi escrita: vira o rollup por dia e humor
+        "DROP TABLE IF EXISTS mural_stats",
+        """
+        CREATE TABLE mural_stats (
+            stat_date DATE NOT NULL,
+            mood VARCHAR(20) NOT NULL DEFAULT '',
+            post_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (stat_date, mood)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS mural_counters (
+            name VARCHAR(50) PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        rebuild_mural_stats,
+    ]),
+    (15, "notification_outbox", [
+        """
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            channel VARCHAR(20) NOT NULL,
+            payload JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        """,
+        # O worker só olha o que ainda não terminou
+        """
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox(next_attempt_at)
+        WHERE status IN ('pending', 'sending')
+        """,
+    ]),
+    (16, "learning_jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS learning_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            session_id VARCHAR(255) NOT NULL,
+            watermark INTEGER NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        # No máximo um job pendente por sessão (os seguintes só avançam a marca d'água)
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_learning_jobs_pending ON learning_jobs(session_id) WHERE status = 'pending'",
+        """
+        CREATE INDEX IF NOT EXISTS idx_learning_jobs_due ON learning_jobs(next_attempt_at)
+        WHERE status IN ('pending', 'running')
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS learning_state (
+            session_id VARCHAR(255) PRIMARY KEY,
+            memories_watermark INTEGER NOT NULL DEFAULT 0,
+            summary_watermark INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Deduplicação das memórias por texto em minúsculas
+        "CREATE INDEX IF NOT EXISTS idx_gehh_memories_lower ON gehh_memories(LOWER(memory))",
+    ]),
+    (17, "session_stats", [
+        """
+        CREATE TABLE IF NOT EXISTS session_stats (
+            session_id VARCHAR(255) PRIMARY KEY,
+            total_messages INTEGER NOT NULL DEFAULT 0,
+            user_messages INTEGER NOT NULL DEFAULT 0,
+            admin_present BOOLEAN NOT NULL DEFAULT FALSE,
+            last_user_message_at TIMESTAMP,
+            last_assistant_message_at TIMESTAMP,
+            last_message_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Última interação da Gehh (cron das mensagens proativas)
+        "CREATE INDEX IF NOT EXISTS idx_session_stats_last_user ON session_stats(last_user_message_at)",
+        refresh_session_stats,
+    ]),
+    (18, "chat_history_order_indexes", [
+        # Histórico da sessão em ordem (created_at, id): as leituras viram um
+        # scan do índice com LIMIT, sem ordenar todas as mensagens da sessão
+        """
+        CREATE INDEX IF NOT EXISTS idx_chat_history_session_created
+        ON chat_history(session_id, created_at DESC, id DESC)
+        """,
+        # Mesma coisa filtrando por quem falou (respostas recentes, estilo de escrita)
+        """
+        CREATE INDEX IF NOT EXISTS idx_chat_history_session_role_created
+        ON chat_history(session_id, role, created_at DESC, id DESC)
+        """,
+        # Coberto pelo prefixo dos índices acima
+        "DROP INDEX IF EXISTS idx_chat_history_session",
+    ]),
+    (19, "writing_style_model", [
+        # Agregados incrementais do estilo (ver _writing_style.py)
+        "ALTER TABLE user_writing_style ADD COLUMN IF NOT EXISTS model JSONB",
+        rebuild_writing_style,
+    ]),
+    (20, "conversations_keyset_index", [
+        # Paginação da lista de conversas por (updated_at, id)
+        "CREATE INDEX IF NOT EXISTS idx_conversations_updated_id ON conversations(updated_at DESC, id DESC)",
+        "DROP INDEX IF EXISTS idx_conversations_updated",
+    ]),
+    (21, "chat_history_session_id_index", [
+        # Mensagens de uma conversa paginadas pelo id (after_id/before_id)
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_session_id ON chat_history(session_id, id)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Versão já confirmada neste processo (evita ida ao banco depois do cold start)
+_schema_ready = False
+
+
+def _ensure_version_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def get_current_version():
+    """Retorna a maior versão de migração aplicada no banco (0 se nenhuma)"""
+    with db_cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_version')")
+        if cur.fetchone()[0] is None:
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cur.fetchone()[0]
+
+
+def migrate(verbose=False):
+    """Aplica todas as migrações pendentes, cada uma na sua transação. Retorna a lista aplicada."""
+    applied = []
+    with db_cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+        _ensure_version_table(cur)
+
+    for version, name, steps in MIGRATIONS:
+        with db_cursor() as cur:
+            # Lock por migração: outra instância pode ter aplicado enquanto esperávamos
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cur.execute("SELECT 1 FROM schema_version WHERE version = %s", (version,))
+            if cur.fetchone():
+                continue
+
+            for step in steps:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+            cur.execute(
+                "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                (version, name)
+            )
+        applied.append((version, name))
+        if verbose:
+            print(f"✅ Migração {version:03d} aplicada: {name}")
+
+    return applied
+
+
+def ensure_schema():
+    """
+    Garante que o banco está na última versão. Só consulta o banco na
+    primeira chamada do processo; depois disso é um simples if.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return True
+    try:
+        if get_current_version() < LATEST_VERSION:
+            applied = migrate()
+            if applied:
+                print(f"✅ Schema migrado para a versão {LATEST_VERSION} ({len(applied)} migração(ões))")
+        _schema_ready = True
+        return True
+    except Exception as e:
+        print(f"Erro ao migrar o banco: {e}")
+        return False
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    if command == 'status':
+        current = get_current_version()
+        print(f"Versão do banco: {current} (última disponível: {LATEST_VERSION})")
+        for version, name, _ in MIGRATIONS:
+            mark = '✅' if version <= current else '⏳'
+            print(f"  {mark} {version:03d} {name}")
+    elif command == 'migrate':
+        applied = migrate(verbose=True)
+        if not applied:
+            print(f"Nada a fazer, banco já está na versão {LATEST_VERSION}")
+    else:
+        print(f"Comando desconhecido: {command} (use 'migrate' ou 'status')")
+        sys.exit(1)
@@ -0,0 +1,210 @@
+"""
+Estatísticas do mural mantidas incrementalmente.
+Arquivos com _ no início não se tornam endpoints.
+
+Em vez de varrer feedback e feedback_replies a cada GET /api/feedback/stats,
+toda escrita no mural atualiza, na mesma transação:
+- mural_counters: contadores (posts, respostas, não lidas, posts por humor)
+  e a versão das estatísticas, que vira o ETag do endpoint
+- mural_stats: posts por dia e por humor, de onde saem os posts do mês, a
+  sequência de dias seguidos e o histórico de humor (consultas limitadas a
+  poucos meses do rollup, não importa quantos posts existam)
+
+    cur.execute("INSERT INTO feedback ...")
+    record_post_created(cur, created_at, mood)
+    conn.commit()
+
+Se os números saírem do eixo (alguém escreveu no banco por fora), dá pra
+recalcular tudo a partir das tabelas:
+
+    python api/_mural_stats.py rebuild
+"""
+import sys
+from datetime import datetime, timedelta
+
+STREAK_MAX_DAYS = 30
+MOOD_HISTORY_MONTHS = 6
+
+# Humor "sem humor" no rollup (a chave primária não aceita NULL)
+NO_MOOD = ''
+
+
+def _bump(cur, counters=None, days=None):
+    """
+    Soma deltas nos contadores ({nome: delta}) e no rollup diário
+    ({(data, humor): delta}) e avança a versão das estatísticas.
+    """
+    counters = {name: delta for name, delta in (counters or {}).items() if delta}
+    days = {key: delta for key, delta in (days or {}).items() if delta}
+    if not counters and not days:
+        return
+    counters['version'] = 1
+
+    # Ordem fixa das chaves (dias e contadores): duas transações nunca travam as linhas em ordem trocada
+    if days:
+        cur.execute(f"""
+            INSERT INTO mural_stats (stat_date, mood, post_count)
+            VALUES {', '.join(['(%s, %s, %s)'] * len(days))}
+            ON CONFLICT (stat_date, mood) DO UPDATE
+            SET post_count = mural_stats.post_count + EXCLUDED.post_count
+        """, [value for (stat_date, mood), delta in sorted(days.items()) for value in (stat_date, mood, delta)])
+
+    cur.execute(f"""
+        INSERT INTO mural_counters (name, value)
+        VALUES {', '.join(['(%s, %s)'] * len(counters))}
+        ON CONFLICT (name) DO UPDATE SET value = mural_counters.value + EXCLUDED.value
+    """, [value for item in sorted(counters.items()) for value in item])
+
+
+def _mood_counter(mood):
+    return f"mood:{mood}"
+
+
+def record_post_created(cur, created_at, mood, is_read=False):
+    counters = {'total_posts': 1, 'unread_count': 0 if is_read else 1}
+    if mood:
+        counters[_mood_counter(mood)] = 1
+    _bump(cur, counters, {(created_at.date(), mood or NO_MOOD): 1})
+
+
+def record_post_deleted(cur, created_at, mood, is_read, reply_count=0):
+    """Post apagado (as respostas dele saem junto, pelo ON DELETE CASCADE)"""
+    counters = {
+        'total_posts': -1,
+        'unread_count': -1 if is_read is False else 0,
+        'total_replies': -reply_count,
+    }
+    if mood:
+        counters[_mood_counter(mood)] = -1
+    _bump(cur, counters, {(created_at.date(), mood or NO_MOOD): -1})
+
+
+def record_mood_changed(cur, created_at, old_mood, new_mood):
+    if old_mood == new_mood:
+        return
+    counters = {}
+    if old_mood:
+        counters[_mood_counter(old_mood)] = -1
+    if new_mood:
+        counters[_mood_counter(new_mood)] = 1
+    stat_date = created_at.date()
+    _bump(cur, counters, {(stat_date, old_mood or NO_MOOD): -1, (stat_date, new_mood or NO_MOOD): 1})
+
+
+def record_read_changed(cur, was_read, is_read):
+    """Só conta como não lida quem tem is_read = FALSE (igual à contagem antiga)"""
+    _bump(cur, {'unread_count': (is_read is False) - (was_read is False)})
+
+
+def record_replies(cur, delta):
+    _bump(cur, {'total_replies': delta})
+
+
+def get_stats_version(cur):
+    cur.execute("SELECT value FROM mural_counters WHERE name = 'version'")
+    row = cur.fetchone()
+    if not row:
+        return 0
+    return row['value'] if isinstance(row, dict) else row[0]
+
+
+def stats_etag(version, today=None):
+    """Posts do mês e sequência mudam com a data, então ela entra no ETag"""
+    today = today or datetime.now().date()
+    return f'W/"mural-{version}-{today.isoformat()}"'
+
+
+def get_statistics(cur):
+    """Monta as estatísticas do mural a partir dos contadores e do rollup"""
+    today = datetime.now().date()
+
+    cur.execute("SELECT name, value FROM mural_counters")
+    counters = {row['name']: row['value'] for row in cur.fetchall()}
+
+    cur.execute("""
+        SELECT COALESCE(SUM(post_count), 0) AS count FROM mural_stats
+        WHERE stat_date >= %s
+    """, (today.replace(day=1),))
+    posts_this_month = cur.fetchone()['count']
+
+    cur.execute("""
+        SELECT DISTINCT stat_date FROM mural_stats
+        WHERE stat_date > %s AND post_count > 0
+        ORDER BY stat_date DESC
+    """, (today - timedelta(days=STREAK_MAX_DAYS + 1),))
+    dates = [row['stat_date'] for row in cur.fetchall()][:STREAK_MAX_DAYS]
+
+    # Streak atual (só conta se postou hoje ou ontem)
+    current_streak = 0
+    if dates and (dates[0] == today or dates[0] == today - timedelta(days=1)):
+        current_streak = 1
+        for i in range(1, len(dates)):
+            if (dates[i-1] - dates[i]).days == 1:
+                current_streak += 1
+            else:
+                break
+
+    cur.execute("""
+        SELECT DATE_TRUNC('month', stat_date)::timestamp AS month, mood, SUM(post_count) AS count
+        FROM mural_stats
+        WHERE stat_date > CURRENT_DATE - make_interval(months => %s) AND mood <> %s AND post_count > 0
+        GROUP BY 1, 2
+        ORDER BY month
+    """, (MOOD_HISTORY_MONTHS, NO_MOOD))
+    mood_history = [dict(row) for row in cur.fetchall()]
+
+    mood_counts = {
+        name[len(_mood_counter('')):]: value
+        for name, value in counters.items()
+        if name.startswith(_mood_counter('')) and value > 0
+    }
+
+    return {
+        "total_posts": counters.get('total_posts', 0),
+        "posts_this_month": posts_this_month,
+        "most_common_mood": max(mood_counts, key=mood_counts.get) if mood_counts else 'neutral',
+        "current_streak": current_streak,
+        "total_replies": counters.get('total_replies', 0),
+        "unread_count": counters.get('unread_count', 0),
+        "mood_history": mood_history
+    }
+
+
+def rebuild_mural_stats(cur):
+    """
+    Recalcula contadores e rollup a partir de feedback/feedback_replies.
+    Também é o passo de migração que preenche as tabelas pela primeira vez.
+    """
+    # Segura as escritas no mural enquanto recalcula
+    cur.execute("LOCK TABLE feedback, feedback_replies IN SHARE MODE")
+    cur.execute("DELETE FROM mural_stats")
+    cur.execute("DELETE FROM mural_counters WHERE name <> 'version'")
+    cur.execute("""
+        INSERT INTO mural_stats (stat_date, mood, post_count)
+        SELECT DATE(created_at), COALESCE(mood, %s), COUNT(*)
+        FROM feedback
+        GROUP BY 1, 2
+    """, (NO_MOOD,))
+    cur.execute("""
+        INSERT INTO mural_counters (name, value)
+        SELECT 'total_posts', COUNT(*) FROM feedback
+        UNION ALL
+        SELECT 'unread_count', COUNT(*) FROM feedback WHERE is_read = FALSE
+        UNION ALL
+        SELECT 'total_replies', COUNT(*) FROM feedback_replies
+        UNION ALL
+        SELECT 'mood:' || mood, COUNT(*) FROM feedback WHERE mood IS NOT NULL GROUP BY mood
+    """)
+    _bump(cur, {'version': 1})
+
+
+if __name__ == '__main__':
+    from _db import db_cursor
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command != 'rebuild':
+        print("Uso: python api/_mural_stats.py rebuild")
+        sys.exit(1)
+    with db_cursor() as cur:
+        rebuild_mural_stats(cur)
+    print("✅ Estatísticas do mural recalculadas")
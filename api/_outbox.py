@@ -0,0 +1,217 @@
+"""
+Outbox de notificações (e-mail e Web Push).
+Arquivos com _ no início não se tornam endpoints.
+
+As notificações não são mais enviadas durante a requisição: o endpoint grava
+uma linha em notification_outbox na mesma transação do evento (post no
+mural, cutucada, Matteo chamando o Pablo) e responde logo depois do commit.
+
+    enqueue_email(cur, assunto, texto, html)
+    enqueue_push(cur, mensagem)
+    conn.commit()
+    ...                         # manda a resposta
+    deliver_after_response()    # e só depois entrega
+
+Quem enfileirou entrega, depois de já ter respondido (drain_outbox com um
+orçamento curto). O /api/cron (duas vezes por dia) e o /api/worker também
+chamam drain_outbox e pegam o que ficou para trás: falhas, retentativas com
+backoff e funções que morreram no meio. Não depende de cron a cada minuto,
+que nem todo plano da Vercel aceita. O drain pega um lote com FOR UPDATE
+SKIP LOCKED, manda todos os e-mails do lote numa sessão SMTP só e registra
+o resultado de cada linha. Falhas voltam para a fila com backoff
+exponencial até OUTBOX_MAX_ATTEMPTS.
+
+Status: pending -> sending -> sent | failed (pending de novo se for tentar outra vez)
+"""
+import json
+import os
+import time
+
+from _db import db_cursor
+from _email import build_email, email_configured, smtp_session
+from _push import push_configured, send_push_to_all
+
+CHANNEL_EMAIL = 'email'
+CHANNEL_PUSH = 'push'
+
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 20))
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE_SECONDS = 30
+OUTBOX_BACKOFF_MAX_SECONDS = 60 * 60
+# Linha presa em "sending" há mais que isso (worker morreu no meio) volta para a fila
+OUTBOX_CLAIM_TIMEOUT_SECONDS = 5 * 60
+# Tempo máximo de um drain (a função da Vercel tem limite de duração)
+OUTBOX_DRAIN_BUDGET_SECONDS = 45
+OUTBOX_RETENTION_DAYS = 30
+
+# Tempo máximo da entrega feita pelo próprio endpoint, depois da resposta
+OUTBOX_INLINE_BUDGET_SECONDS = 10
+
+
+def enqueue_notification(cur, channel, payload):
+    """Grava a notificação na outbox, na transação de quem chamou"""
+    cur.execute(
+        "INSERT INTO notification_outbox (channel, payload) VALUES (%s, %s)",
+        (channel, json.dumps(payload, ensure_ascii=False))
+    )
+
+
+def enqueue_email(cur, subject, text, html=None):
+    """Retorna False (e não grava nada) se o e-mail não está configurado"""
+    if not email_configured():
+        print("⚠️ Credenciais de email não configuradas")
+        return False
+    enqueue_notification(cur, CHANNEL_EMAIL, {'subject': subject, 'text': text, 'html': html})
+    return True
+
+
+def enqueue_push(cur, data):
+    """Retorna False (e não grava nada) se o push não está configurado"""
+    if not push_configured():
+        print("[PUSH] Push não disponível")
+        return False
+    enqueue_notification(cur, CHANNEL_PUSH, {'data': data})
+    return True
+
+
+def backoff_seconds(attempts):
+    return min(OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+def _claim_batch(limit):
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE notification_outbox o
+            SET status = 'sending', attempts = o.attempts + 1, claimed_at = NOW()
+            FROM (
+                SELECT id FROM notification_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                   OR (status = 'sending' AND claimed_at < NOW() - make_interval(secs => %s))
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) batch
+            WHERE o.id = batch.id
+            RETURNING o.id, o.channel, o.payload, o.attempts
+        """, (OUTBOX_CLAIM_TIMEOUT_SECONDS, limit))
+        return cur.fetchall()
+
+
+def _deliver_emails(items):
+    """Manda os e-mails do lote numa sessão SMTP só. Retorna {id: erro ou None}"""
+    results = {}
+    try:
+        with smtp_session() as server:
+            for item_id, payload in items:
+                try:
+                    msg = build_email(payload['subject'], payload['text'], payload.get('html'))
+                    server.sendmail(msg['From'], msg['To'], msg.as_string())
+                    results[item_id] = None
+                except Exception as e:
+                    results[item_id] = f"{type(e).__name__}: {e}"
+    except Exception as e:
+        # Conexão/login falhou (ou caiu no meio): o que não foi enviado tenta de novo depois
+        for item_id, _ in items:
+            results.setdefault(item_id, f"SMTP: {type(e).__name__}: {e}")
+    return results
+
+
+def _deliver_push(items):
+    results = {}
+    for item_id, payload in items:
+        try:
+            sent, errors = send_push_to_all(payload['data'])
+            # Chegou em pelo menos um aparelho (ou não há nenhum inscrito): não reenviar
+            results[item_id] = "; ".join(errors)[:500] if errors and not sent else None
+        except Exception as e:
+            results[item_id] = f"{type(e).__name__}: {e}"
+    return results
+
+
+_DELIVERERS = {
+    CHANNEL_EMAIL: _deliver_emails,
+    CHANNEL_PUSH: _deliver_push,
+}
+
+
+def _record_results(batch, results, summary):
+    """Grava o resultado de cada linha do lote e soma em summary"""
+    attempts_by_id = {item_id: attempts for item_id, _, _, attempts in batch}
+    sent_ids = [item_id for item_id, error in results.items() if error is None]
+    with db_cursor() as cur:
+        if sent_ids:
+            cur.execute("""
+                UPDATE notification_outbox
+                SET status = 'sent', sent_at = NOW(), last_error = NULL
+                WHERE id = ANY(%s)
+            """, (sent_ids,))
+            summary['sent'] += len(sent_ids)
+        for item_id, error in results.items():
+            if error is None:
+                continue
+            attempts = attempts_by_id[item_id]
+            gave_up = attempts >= OUTBOX_MAX_ATTEMPTS
+            cur.execute("""
+                UPDATE notification_outbox
+                SET status = %s, last_error = %s,
+                    next_attempt_at = NOW() + make_interval(secs => %s)
+                WHERE id = %s
+            """, ('failed' if gave_up else 'pending', error, backoff_seconds(attempts), item_id))
+            summary['failed' if gave_up else 'retry'] += 1
+            print(f"{'❌' if gave_up else '⚠️'} Notificação {item_id} falhou (tentativa {attempts}): {error}")
+
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE, budget_seconds=OUTBOX_DRAIN_BUDGET_SECONDS):
+    """Entrega as notificações pendentes, lote a lote. Retorna a contagem por resultado."""
+    started = time.monotonic()
+    summary = {'sent': 0, 'retry': 0, 'failed': 0}
+
+    while time.monotonic() - started < budget_seconds:
+        batch = _claim_batch(batch_size)
+        if not batch:
+            break
+
+        by_channel = {}
+        for item_id, channel, payload, _ in batch:
+            by_channel.setdefault(channel, []).append((item_id, payload))
+
+        results = {}
+        for channel, items in by_channel.items():
+            deliver = _DELIVERERS.get(channel)
+            if deliver:
+                results.update(deliver(items))
+            else:
+                results.update({item_id: f"canal desconhecido: {channel}" for item_id, _ in items})
+
+        _record_results(batch, results, summary)
+
+        if len(batch) < batch_size:
+            break
+
+    return summary
+
+
+def deliver_after_response(budget_seconds=OUTBOX_INLINE_BUDGET_SECONDS):
+    """
+    Entrega o que está na outbox. Chamado pelo endpoint que acabou de
+    enfileirar, depois de mandar a resposta; nunca levanta exceção (o que
+    não sair agora fica para o próximo /api/cron ou /api/worker).
+    """
+    try:
+        summary = drain_outbox(budget_seconds=budget_seconds)
+        if any(summary.values()):
+            print(f"📬 Outbox: {summary['sent']} enviada(s), {summary['retry']} para tentar de novo, {summary['failed']} desistida(s)")
+        return summary
+    except Exception as e:
+        print(f"⚠️ Erro ao entregar a outbox depois da resposta: {e}")
+        return None
+
+
+def purge_delivered(retention_days=OUTBOX_RETENTION_DAYS):
+    """Apaga as notificações entregues há mais de retention_days (chamado pelo cron)"""
+    with db_cursor() as cur:
+        cur.execute("""
+            DELETE FROM notification_outbox
+            WHERE status = 'sent' AND sent_at < NOW() - make_interval(days => %s)
+        """, (retention_days,))
+        return cur.rowcount
@@ -0,0 +1,148 @@
+"""
+Envio de Web Push para as inscrições salvas em push_subscriptions.
+Arquivos com _ no início não se tornam endpoints.
+
+O envio é em paralelo (pool limitado, timeout por requisição), então um
+fan-out demora o tempo do aparelho mais lento, não a soma de todos:
+- uma requests.Session por origem do serviço de push (FCM, Mozilla, Apple...),
+  reaproveitando as conexões TLS entre envios
+- a chave VAPID é lida uma vez e o cabeçalho assinado fica em cache por
+  origem até perto de expirar (a assinatura vale 12h)
+- inscrições que o serviço responde 404/410 (aparelho desinscrito ou
+  expirado) são apagadas do banco
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from _db import run_query
+
+# Tentar importar pywebpush para notificações
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from py_vapid import Vapid
+    from pywebpush import WebPusher
+    PUSH_AVAILABLE = True
+except ImportError:
+    PUSH_AVAILABLE = False
+
+VAPID_PRIVATE_KEY = os.environ.get("VAPID_PRIVATE_KEY")
+VAPID_CLAIMS = {"sub": "mailto:pablo@example.com"}
+# Validade da assinatura VAPID; renovada quando falta menos que a margem
+VAPID_EXPIRATION_SECONDS = 12 * 60 * 60
+VAPID_RENEW_MARGIN_SECONDS = 60 * 60
+
+PUSH_MAX_WORKERS = 8
+PUSH_TIMEOUT_SECONDS = 10
+# Status do serviço de push que significam "essa inscrição não existe mais"
+PUSH_GONE_STATUSES = (404, 410)
+
+_push_executor = ThreadPoolExecutor(max_workers=PUSH_MAX_WORKERS, thread_name_prefix="push")
+_lock = threading.Lock()
+_vapid = None
+_vapid_headers = {}   # origem -> (expira_em, cabeçalhos)
+_sessions = {}        # origem -> requests.Session
+
+
+def push_configured():
+    return PUSH_AVAILABLE and bool(VAPID_PRIVATE_KEY)
+
+
+def get_push_subscriptions():
+    rows = run_query("SELECT endpoint, p256dh, auth FROM push_subscriptions", fetch='all')
+    return [{"endpoint": endpoint, "keys": {"p256dh": p256dh, "auth": auth}} for endpoint, p256dh, auth in rows]
+
+
+def _origin(endpoint):
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+def _headers_for(origin):
+    """Cabeçalhos VAPID assinados para a origem (o 'aud' do token é a origem)"""
+    global _vapid
+    now = time.time()
+    with _lock:
+        cached = _vapid_headers.get(origin)
+        if cached and cached[0] - now > VAPID_RENEW_MARGIN_SECONDS:
+            return cached[1]
+        if _vapid is None:
+            _vapid = Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+        expires_at = int(now) + VAPID_EXPIRATION_SECONDS
+        headers = _vapid.sign(dict(VAPID_CLAIMS, aud=origin, exp=expires_at))
+        _vapid_headers[origin] = (expires_at, headers)
+        return headers
+
+
+def _session_for(origin):
+    with _lock:
+        session = _sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            session.mount(origin, HTTPAdapter(pool_maxsize=PUSH_MAX_WORKERS))
+            _sessions[origin] = session
+        return session
+
+
+def _send_one(subscription, data):
+    """Retorna o status HTTP da resposta do serviço de push"""
+    origin = _origin(subscription["endpoint"])
+    response = WebPusher(subscription, requests_session=_session_for(origin)).send(
+        data=data,
+        headers=dict(_headers_for(origin)),
+        timeout=PUSH_TIMEOUT_SECONDS
+    )
+    return response.status_code
+
+
+def delete_subscriptions(endpoints):
+    if not endpoints:
+        return 0
+    try:
+        return run_query("DELETE FROM push_subscriptions WHERE endpoint = ANY(%s)", (list(endpoints),))
+    except Exception as e:
+        print(f"[PUSH] Erro apagando inscrições: {e}")
+        return 0
+
+
+def send_push_to_all(data):
+    """
+    Envia data (texto) para todas as inscrições em paralelo.
+    Retorna (enviados, erros), com erros = lista de mensagens.
+    """
+    if not push_configured():
+        return 0, ["push não configurado (pywebpush ou VAPID_PRIVATE_KEY)"]
+
+    subscriptions = get_push_subscriptions()
+    futures = {_push_executor.submit(_send_one, sub, data): sub["endpoint"] for sub in subscriptions}
+    # O timeout de cada requisição já limita; isso é só a rede de segurança
+    wait(futures, timeout=PUSH_TIMEOUT_SECONDS * 2)
+
+    sent = 0
+    errors = []
+    gone = []
+    for future, endpoint in futures.items():
+        if not future.done():
+            errors.append(f"{_origin(endpoint)}: sem resposta")
+            continue
+        try:
+            status = future.result()
+        except Exception as e:
+            errors.append(f"{_origin(endpoint)}: {e}")
+            continue
+        if status in PUSH_GONE_STATUSES:
+            gone.append(endpoint)
+        elif status > 202:
+            errors.append(f"{_origin(endpoint)}: HTTP {status}")
+        else:
+            sent += 1
+
+    if gone:
+        removed = delete_subscriptions(gone)
+        print(f"[PUSH] {removed} inscrição(ões) expirada(s) removida(s)")
+    if errors:
+        print(f"[PUSH] {len(errors)} erro(s): {errors}")
+    return sent, errors
@@ -0,0 +1,107 @@
+"""
+Auditoria dos planos das consultas quentes do chat.
+Arquivos com _ no início não se tornam endpoints.
+
+Roda EXPLAIN em cada consulta que o chat faz por mensagem e falha se alguma
+delas ler chat_history/session_stats com Seq Scan ou precisar de um Sort
+em cima dessas tabelas (ou seja, se o índice não está servindo o
+filtro + ORDER BY ... LIMIT):
+
+    python api/_query_plans.py            # confere todas
+    python api/_query_plans.py -v         # mostra os planos
+
+Em banco pequeno o Postgres prefere Seq Scan mesmo com índice, então a
+auditoria desliga seqscan/sort na transação: se ainda assim aparecer um
+deles, é porque não existe índice que sirva a consulta.
+"""
+import json
+import sys
+
+from _chat_context import CHAT_CONTEXT_QUERY
+from _conversation_index import (
+    _MESSAGES_JOIN, CONVERSATION_LIST_QUERY, MESSAGES_AFTER_QUERY, MESSAGES_BEFORE_QUERY,
+)
+from _learning import CONVERSATION_TEXT_QUERY
+from _session_stats import SESSION_STATS_QUERY
+from chat import CHAT_HISTORY_QUERY
+from cron import LAST_USER_INTERACTION_QUERY
+
+INDEXED_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+
+# (nome, SQL, parâmetros, tabelas que precisam vir de índice)
+# Todo SQL vem da constante do próprio módulo: a auditoria confere o que roda de verdade.
+HOT_QUERIES = [
+    ("_chat_context.load_chat_context", CHAT_CONTEXT_QUERY, {
+        'session_id': 'plan_check', 'history_limit': 30, 'responses_limit': 5, 'memories_limit': 10,
+    }, ('chat_history', 'session_stats')),
+    ("chat.get_chat_history", CHAT_HISTORY_QUERY, ('plan_check', 30), ('chat_history',)),
+    ("_conversation_index.list_messages (after_id)", MESSAGES_AFTER_QUERY, {
+        'session_id': 'plan_check', 'after_id': 0, 'limit': 101,
+    }, ('chat_history',)),
+    ("_conversation_index.list_messages (before_id)", MESSAGES_BEFORE_QUERY, {
+        'session_id': 'plan_check', 'before_id': 1000, 'limit': 101,
+    }, ('chat_history',)),
+    ("_learning._conversation_text", CONVERSATION_TEXT_QUERY, ('plan_check', 1000, 10), ('chat_history',)),
+    ("_conversation_index.list_conversations", CONVERSATION_LIST_QUERY.format(
+        messages_column=", m.messages", messages_join=_MESSAGES_JOIN,
+        where="WHERE (c.updated_at, c.id) < (NOW(), '')",
+    ), {'limit': 21, 'messages_limit': 3}, ('conversations', 'chat_history', 'session_stats')),
+    ("_session_stats.get_session_stats", SESSION_STATS_QUERY, ('plan_check',), ('session_stats',)),
+    ("cron.get_last_user_interaction", LAST_USER_INTERACTION_QUERY, (), ('session_stats',)),
+]
+
+
+def _walk(node, parents=()):
+    yield node, parents
+    for child in node.get('Plans', []):
+        yield from _walk(child, parents + (node,))
+
+
+def plan_problems(plan, tables):
+    """Lista o que está errado no plano (vazia = consulta servida por índice)"""
+    problems = []
+    for node, parents in _walk(plan):
+        relation = node.get('Relation Name')
+        if relation not in tables:
+            continue
+        if node['Node Type'] not in INDEXED_SCANS:
+            problems.append(f"{node['Node Type']} em {relation}")
+        # Sort acima do scan (sem agregação no meio) = o índice não dá a ordem.
+        # Sort acima de um Limit só reordena as poucas linhas que o índice já trouxe.
+        for parent in reversed(parents):
+            if parent['Node Type'] in ('Aggregate', 'WindowAgg', 'CTE Scan', 'Subquery Scan', 'Limit'):
+                break
+            if parent['Node Type'] in ('Sort', 'Incremental Sort'):
+                problems.append(f"{parent['Node Type']} sobre {relation} ({', '.join(parent.get('Sort Key', []))})")
+                break
+    return problems
+
+
+def check_query_plans(cur, verbose=False):
+    """Roda EXPLAIN em HOT_QUERIES. Retorna {nome: [problemas]} só das que falharam."""
+    cur.execute("SET LOCAL enable_seqscan = off")
+    cur.execute("SET LOCAL enable_sort = off")
+    failures = {}
+    for name, sql, params, tables in HOT_QUERIES:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        result = cur.fetchone()[0]
+        plan = (json.loads(result) if isinstance(result, str) else result)[0]['Plan']
+        problems = plan_problems(plan, tables)
+        if problems:
+            failures[name] = problems
+        print(f"{'❌' if problems else '✅'} {name}" + (f": {'; '.join(problems)}" if problems else ""))
+        if verbose:
+            print(json.dumps(plan, indent=2, ensure_ascii=False))
+    return failures
+
+
+if __name__ == '__main__':
+    from _db import db_cursor
+
+    verbose = '-v' in sys.argv[1:]
+    with db_cursor() as cur:
+        failures = check_query_plans(cur, verbose=verbose)
+    if failures:
+        print(f"❌ {len(failures)} consulta(s) sem índice adequado")
+        sys.exit(1)
+    print("✅ Todas as consultas quentes usam índice")
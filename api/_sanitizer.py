@@ -0,0 +1,324 @@
+"""
+Limpeza das respostas do Matteo (markdown, prefixos, frases robóticas, emojis).
+Arquivos com _ no início não se tornam endpoints.
+
+- clean_text(texto): uma passada só pelo texto (markdown, emojis, espaços),
+  com todos os padrões compilados no import
+- _strip_head(texto): prefixos, frases estranhas e genéricas; é uma segunda
+  passada, mas só pelo começo do texto já limpo (cada regra é uma alternância
+  ancorada, compilada no import)
+- sanitize_response(texto): limpa a resposta completa (modo JSON)
+- StreamingSanitizer: aplica os mesmos filtros token a token (modo SSE),
+  segurando só o pedaço que ainda pode mudar (um *ação* ou [link](...)
+  não fechado, espaços no fim, o comecinho da resposta)
+"""
+import re
+
+MIN_RESPONSE_LENGTH = 10
+MAX_RESPONSE_LENGTH = 500
+
+EMPTY_RESPONSE_FALLBACK = "Desculpa princesa, não consegui processar isso agora. Pode repetir?"
+SHORT_RESPONSE_FALLBACK = "Desculpa princesa, não consegui processar isso direito. Pode repetir?"
+
+ACTION_PATTERN = r'\*[^*]+\*'  # *ações entre asteriscos*
+MARKDOWN_LINK_PATTERN = r'\[.*?\]\(.*?\)'
+MARKDOWN_HEADER_PATTERN = r'#{1,6}\s+'
+EMOJI_CHARS = '😀-🙏🌀-🗿🚀-🛿Ⓜ-🉑'
+
+# Tudo que a limpeza mexe, numa alternância só: o texto é percorrido uma vez
+# (markdown sai, só o primeiro emoji fica, espaços viram um espaço só)
+_TOKEN_PATTERN = re.compile(
+    f'(?P<markdown>{ACTION_PATTERN}|{MARKDOWN_LINK_PATTERN}|{MARKDOWN_HEADER_PATTERN})'
+    f'|(?P<emoji>[{EMOJI_CHARS}]+)'
+    r'|(?P<space>\s+)'
+)
+
+# Prefixos comuns que podem aparecer
+PREFIXES_TO_REMOVE = ['matteo:', 'assistant:', 'ai:', 'bot:']
+
+# Frases estranhas que podem aparecer (só dentro da primeira frase: um "oi"
+# no começo não pode levar junto tudo até o último "!" da resposta)
+STRANGE_PATTERNS = [
+    r'como posso ajudar[^.!?\n]*?\?',
+    r'olá[^.!?\n]*?\!',
+    r'oi[^.!?\n]*?\!',
+    r'eu sou[^.!?\n]*?matteo',
+    r'sou o[^.!?\n]*?matteo',
+    r'meu nome é[^.!?\n]*?matteo',
+]
+
+# Frases genéricas/robóticas no início
+GENERIC_PHRASES = [
+    'como posso ajudar',
+    'olá',
+    'oi,',
+    'oi!',
+    'eu sou',
+    'sou o',
+    'meu nome é',
+    'sou uma ia',
+    'eu sou uma ia',
+    'sou o matteo',
+    'eu sou o matteo',
+]
+
+_PREFIX_PATTERN = re.compile('|'.join(re.escape(prefix) for prefix in PREFIXES_TO_REMOVE), re.IGNORECASE)
+_STRANGE_PATTERN = re.compile('|'.join(STRANGE_PATTERNS), re.IGNORECASE)
+# Mesma ordem da lista: vale a primeira frase que casar
+_GENERIC_PATTERN = re.compile('|'.join(re.escape(phrase) for phrase in GENERIC_PHRASES), re.IGNORECASE)
+_FIRST_PUNCT_PATTERN = re.compile(r'[.!?\n]')
+_LEADING_PUNCT = '.,!?:'
+
+# Como cada frase estranha começa (para saber, no streaming, se o começo
+# ainda pode virar uma delas)
+_STRANGE_STARTS = ['como posso ajudar', 'olá', 'oi', 'eu sou', 'sou o', 'meu nome é']
+_SENTENCE_END_PATTERN = re.compile(r'[.!?]')
+
+# Construções que ainda podem ser completadas pelos próximos tokens: um [link]
+# só fecha na mesma linha; #, espaços e emojis no fim podem continuar
+_TRAILING_HOLD_PATTERN = re.compile(f'(#+\\s*|\\s+|[{EMOJI_CHARS}]+)$')
+
+
+def clean_text(text, keep_emoji=True, cap_emojis=True, after_space=True):
+    """
+    Uma passada pelo texto: tira markdown, deixa só a primeira sequência de
+    emojis (nenhuma se keep_emoji=False) e junta espaços em um só.
+    after_space=True descarta o espaço do começo (o texto anterior já terminou
+    em espaço). Retorna (texto limpo, se sobrou algum emoji).
+    """
+    out = []
+    position = 0
+    ends_with_space = after_space
+    emoji_kept = False
+    for match in _TOKEN_PATTERN.finditer(text):
+        start = match.start()
+        if start > position:
+            out.append(text[position:start])
+            ends_with_space = False
+        position = match.end()
+        kind = match.lastgroup
+        if kind == 'space':
+            if not ends_with_space:
+                out.append(' ')
+                ends_with_space = True
+        elif kind == 'emoji':
+            if cap_emojis and (emoji_kept or not keep_emoji):
+                continue
+            out.append(match.group())
+            emoji_kept = True
+            ends_with_space = False
+    if position < len(text):
+        out.append(text[position:])
+    return "".join(out), emoji_kept
+
+
+def _can_become(text, options):
+    """O texto ainda pode crescer até virar uma das opções (começo incompleto)"""
+    text = text.lower()
+    return any(len(text) < len(option) and option.startswith(text) for option in options)
+
+
+def _strip_head(bot_response, final=True):
+    """
+    Remove prefixos, frases estranhas e frases genéricas do começo da resposta (já limpa).
+    Com final=False o texto ainda está chegando: retorna None se o resultado
+    ainda pode mudar com o que falta.
+    """
+    match = _PREFIX_PATTERN.match(bot_response)
+    if match:
+        bot_response = bot_response[match.end():].strip()
+    elif not final and _can_become(bot_response, PREFIXES_TO_REMOVE):
+        return None
+
+    # Uma frase estranha pode vir depois da outra ("Olá! Eu sou o Matteo...")
+    while True:
+        if not final and not _SENTENCE_END_PATTERN.search(bot_response):
+            lower = bot_response.lower()
+            if _can_become(lower, _STRANGE_STARTS) or lower.startswith(tuple(_STRANGE_STARTS)):
+                return None
+        match = _STRANGE_PATTERN.match(bot_response)
+        if not (match and match.end()):
+            break
+        bot_response = bot_response[match.end():].strip()
+
+    # Garantir que não começa com pontuação estranha
+    if bot_response and bot_response[0] in _LEADING_PUNCT:
+        bot_response = bot_response[1:].strip()
+
+    if not final and _can_become(bot_response, GENERIC_PHRASES):
+        return None
+    match = _GENERIC_PATTERN.match(bot_response)
+    if match:
+        phrase = match.group()
+        # Encontrar primeira pontuação e remover até lá
+        punct = _FIRST_PUNCT_PATTERN.search(bot_response, 1)
+        if punct:
+            bot_response = bot_response[punct.end():].strip()
+        elif not final:
+            return None
+        # Se não encontrou pontuação, remover a frase inteira
+        if bot_response.lower().startswith(phrase.lower()):
+            words = bot_response.split()
+            # Remover primeiras palavras que formam a frase genérica
+            phrase_words = phrase.split()
+            if not final and len(words) <= len(phrase_words):
+                return None  # a última palavra da frase ainda pode crescer
+            if len(words) >= len(phrase_words):
+                bot_response = ' '.join(words[len(phrase_words):]).strip()
+        elif not final and _can_become(bot_response, [phrase.lower()]):
+            return None
+
+    return bot_response
+
+
+def _apply_length_limits(bot_response):
+    if len(bot_response) < MIN_RESPONSE_LENGTH:
+        return SHORT_RESPONSE_FALLBACK
+    if len(bot_response) > MAX_RESPONSE_LENGTH:
+        # Truncar se muito longa, mantendo sentido
+        return bot_response[:MAX_RESPONSE_LENGTH - 3] + "..."
+    return bot_response
+
+
+def sanitize_response(bot_response):
+    """Limpa e filtra a resposta completa do modelo"""
+    bot_response, _ = clean_text(bot_response or "")
+    bot_response = _strip_head(bot_response.strip())
+
+    # Validar que temos uma resposta válida do bot
+    if not bot_response or len(bot_response.strip()) < 3:
+        print("⚠️ Resposta do bot vazia ou muito curta")
+        return EMPTY_RESPONSE_FALLBACK
+
+    return _apply_length_limits(bot_response)
+
+
+def _hold_position(text):
+    """Onde começa o pedaço do fim do texto que os próximos tokens ainda podem mudar"""
+    markdown = [match.span() for match in _TOKEN_PATTERN.finditer(text) if match.lastgroup == 'markdown']
+
+    def is_free(index):
+        return not any(start <= index < end for start, end in markdown)
+
+    cut = len(text)
+    # O último * solto ainda pode abrir uma *ação* (que atravessa linhas)
+    star = text.rfind('*')
+    while star >= 0 and not is_free(star):
+        star = text.rfind('*', 0, star)
+    if star >= 0:
+        cut = star
+    # O primeiro [ solto da última linha ainda pode virar um [link](...)
+    bracket = text.find('[', text.rfind('\n') + 1)
+    while bracket >= 0 and not is_free(bracket):
+        bracket = text.find('[', bracket + 1)
+    if bracket >= 0:
+        cut = min(cut, bracket)
+    trailing = _TRAILING_HOLD_PATTERN.search(text)
+    if trailing:
+        cut = min(cut, trailing.start())
+    return cut
+
+
+class StreamingSanitizer:
+    """
+    Limpa a resposta enquanto ela chega do modelo.
+
+        sanitizer = StreamingSanitizer()
+        for token in tokens:
+            enviar(sanitizer.feed(token))
+        enviar(sanitizer.finish())
+        sanitizer.text  # resposta final, igual à do sanitize_response
+
+    Só sai o que o resto da resposta não pode mais mudar: o começo fica
+    retido até dar para decidir sobre "Olá!", "Matteo:" e afins, e um *ação*
+    ou [link](...) aberto fica retido até fechar (ou até o fim). O finish()
+    roda o sanitize_response no texto inteiro, então o que foi enviado é
+    sempre o começo da resposta final, a não ser que ela caia num fallback.
+    """
+
+    def __init__(self):
+        self._raw = []
+        self._pending = ""
+        self._head_done = False
+        self._emitted = []
+        self._emitted_length = 0
+        self._emoji_seen = False
+        self._owes_space = False
+        self._full = False
+        self._final_text = None
+
+    @property
+    def text(self):
+        if self._final_text is not None:
+            return self._final_text
+        return "".join(self._emitted)
+
+    def feed(self, chunk):
+        """Recebe um pedaço do texto e devolve o que já pode ser enviado ('' se nada)"""
+        if not chunk:
+            return ""
+        self._raw.append(chunk)
+        if self._full:
+            return ""
+        self._pending += chunk
+        cut = _hold_position(self._pending)
+        if not self._head_done:
+            return self._release_head(cut)
+        return self._release(cut)
+
+    def finish(self):
+        """Fixa a resposta final (mesmas regras do modo JSON) e devolve o que faltou enviar"""
+        self._final_text = sanitize_response("".join(self._raw))
+        sent = "".join(self._emitted)
+        if not self._final_text.startswith(sent):
+            return ""
+        tail = self._final_text[len(sent):]
+        if tail:
+            self._emitted.append(tail)
+            self._emitted_length += len(tail)
+        return tail
+
+    @property
+    def replaced(self):
+        """A resposta final não é o que foi enviado (caiu num fallback)"""
+        return self._final_text is not None and self._final_text != "".join(self._emitted)
+
+    def _release_head(self, cut):
+        cleaned, emoji_kept = clean_text(self._pending[:cut])
+        head = _strip_head(cleaned.strip(), final=False)
+        if not head:
+            return ""
+        self._head_done = True
+        self._pending = self._pending[cut:]
+        self._emoji_seen = emoji_kept
+        self._owes_space = cleaned.endswith(' ')
+        return self._emit(head)
+
+    def _release(self, cut):
+        segment, self._pending = self._pending[:cut], self._pending[cut:]
+        if not segment:
+            return ""
+        segment, emoji_kept = clean_text(segment, keep_emoji=not self._emoji_seen, after_space=self._owes_space)
+        self._emoji_seen = self._emoji_seen or emoji_kept
+        # Espaço no fim só sai junto com o próximo texto (no fim da resposta ele some)
+        owes_space = segment.endswith(' ')
+        segment = segment.rstrip(' ')
+        if not segment:
+            self._owes_space = self._owes_space or owes_space
+            return ""
+        if self._owes_space:
+            segment = ' ' + segment
+        self._owes_space = owes_space
+        return self._emit(segment)
+
+    def _emit(self, segment):
+        # Os 3 últimos caracteres ficam reservados para o "..." de truncamento;
+        # o que passar disso o finish() resolve
+        room = MAX_RESPONSE_LENGTH - 3 - self._emitted_length
+        if len(segment) >= room:
+            segment = segment[:room]
+            self._full = True
+        if segment:
+            self._emitted.append(segment)
+            self._emitted_length += len(segment)
+        return segment
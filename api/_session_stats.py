@@ -0,0 +1,197 @@
+"""
+Contadores por sessão do chat (session_stats), mantidos a cada mensagem.
+Arquivos com _ no início não se tornam endpoints.
+
+Modo grupo, nível de intimidade, contagem de mensagens da conversa e a
+última vez que a Gehh falou vinham de COUNT(*) sobre chat_history a cada
+mensagem. Agora insert_chat_message grava a mensagem e atualiza a linha da
+sessão no mesmo comando (insert_chat_messages faz o mesmo com várias), e
+quem precisa desses números lê uma linha só pela chave primária:
+
+    insert_chat_message(cur, session_id, 'user', texto)
+    get_session_stats(cur, session_id)['user_messages']
+
+O mesmo comando avisa no canal CHAT_NOTIFY_CHANNEL ("sessão:id") que
+chegou mensagem; o Postgres só entrega o aviso no commit, e é ele que
+acorda quem está esperando em /api/live (ver live.py).
+
+Se alguém apagar mensagens por fora, refresh_session_stats recalcula a
+sessão (ou todas) a partir de chat_history:
+
+    python api/_session_stats.py rebuild
+"""
+import sys
+
+# Canal do NOTIFY de mensagem nova (payload "session_id:id")
+CHAT_NOTIFY_CHANNEL = 'chat_messages'
+
+# Aviso de mensagem nova, para cada linha de um CTE "message"
+CHAT_NOTIFY_SQL = f"pg_notify('{CHAT_NOTIFY_CHANNEL}', session_id || ':' || id)"
+
+# CTEs que gravam as mensagens (na ordem de roles/contents) e somam os
+# contadores da sessão num comando só; quem usa termina com SELECT ... FROM message.
+# clock_timestamp() dá um created_at diferente e crescente para cada mensagem.
+CHAT_MESSAGES_CTE = """
+    message AS (
+        INSERT INTO chat_history (session_id, role, content, created_at)
+        SELECT %(session_id)s, m.role, m.content, clock_timestamp()
+        FROM unnest(%(roles)s::text[], %(contents)s::text[]) WITH ORDINALITY AS m(role, content, position)
+        ORDER BY m.position
+        RETURNING id, session_id, role, created_at
+    ),
+    stats AS (
+        INSERT INTO session_stats AS s (
+            session_id, total_messages, user_messages, admin_present,
+            last_user_message_at, last_assistant_message_at, last_message_id, updated_at
+        )
+        SELECT session_id,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE role = 'user'),
+               BOOL_OR(role = 'admin'),
+               MAX(created_at) FILTER (WHERE role = 'user'),
+               MAX(created_at) FILTER (WHERE role = 'assistant'),
+               MAX(id),
+               MAX(created_at)
+        FROM message
+        GROUP BY session_id
+        ON CONFLICT (session_id) DO UPDATE SET
+            total_messages = s.total_messages + EXCLUDED.total_messages,
+            user_messages = s.user_messages + EXCLUDED.user_messages,
+            admin_present = s.admin_present OR EXCLUDED.admin_present,
+            last_user_message_at = COALESCE(EXCLUDED.last_user_message_at, s.last_user_message_at),
+            last_assistant_message_at = COALESCE(EXCLUDED.last_assistant_message_at, s.last_assistant_message_at),
+            last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+            updated_at = EXCLUDED.updated_at
+    )
+"""
+
+# Mensagens gravadas, contadores da sessão atualizados e aviso no canal num comando só
+INSERT_CHAT_MESSAGES_SQL = f"""
+    WITH {CHAT_MESSAGES_CTE}
+    SELECT id, {CHAT_NOTIFY_SQL} FROM message ORDER BY id
+"""
+
+SESSION_STATS_QUERY = """
+    SELECT total_messages, user_messages, admin_present,
+           last_user_message_at, last_assistant_message_at, last_message_id
+    FROM session_stats WHERE session_id = %s
+"""
+
+# Mesmas colunas calculadas direto de chat_history (migração e rebuild)
+_AGGREGATE_SQL = """
+    SELECT session_id,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE role = 'user'),
+           BOOL_OR(role = 'admin'),
+           MAX(created_at) FILTER (WHERE role = 'user'),
+           MAX(created_at) FILTER (WHERE role = 'assistant'),
+           MAX(id),
+           MAX(created_at)
+    FROM chat_history
+    {where}
+    GROUP BY session_id
+"""
+
+EMPTY_SESSION_STATS = {
+    'total_messages': 0,
+    'user_messages': 0,
+    'admin_present': False,
+    'last_user_message_at': None,
+    'last_assistant_message_at': None,
+    'last_message_id': None,
+}
+
+
+def chat_messages_params(session_id, messages):
+    """Parâmetros de CHAT_MESSAGES_CTE para [(role, content), ...]"""
+    return {
+        'session_id': session_id,
+        'roles': [role for role, _ in messages],
+        'contents': [content for _, content in messages],
+    }
+
+
+def insert_chat_messages(cur, session_id, messages):
+    """Grava [(role, content), ...] em ordem e atualiza session_stats. Retorna os ids."""
+    if not messages:
+        return []
+    cur.execute(INSERT_CHAT_MESSAGES_SQL, chat_messages_params(session_id, messages))
+    return [row['id'] if isinstance(row, dict) else row[0] for row in cur.fetchall()]
+
+
+def insert_chat_message(cur, session_id, role, content):
+    """Grava a mensagem e atualiza session_stats. Retorna o id da mensagem."""
+    ids = insert_chat_messages(cur, session_id, [(role, content)])
+    return ids[0] if ids else None
+
+
+def parse_chat_notify(payload):
+    """Payload do NOTIFY -> (session_id, id da mensagem), ou (None, None) se não reconhecer"""
+    session_id, _, message_id = (payload or '').rpartition(':')
+    try:
+        return session_id, int(message_id)
+    except ValueError:
+        return None, None
+
+
+def get_session_stats(cur, session_id):
+    """Contadores da sessão (zerados se ela ainda não tem mensagens)"""
+    cur.execute(SESSION_STATS_QUERY, (session_id,))
+    row = cur.fetchone()
+    if not row:
+        return dict(EMPTY_SESSION_STATS)
+    if isinstance(row, dict):
+        return dict(row)
+    return dict(zip(EMPTY_SESSION_STATS, row))
+
+
+def refresh_session_stats(cur, session_id=None, session_ids=None):
+    """
+    Recalcula session_stats a partir de chat_history, de uma sessão, de
+    várias (session_ids, ex: depois de uma importação) ou de todas. Também é
+    o passo de migração que preenche a tabela.
+    """
+    columns = """
+        session_id, total_messages, user_messages, admin_present,
+        last_user_message_at, last_assistant_message_at, last_message_id, updated_at
+    """
+    if session_id is None and session_ids is None:
+        # Segura as escritas no chat enquanto recalcula
+        cur.execute("LOCK TABLE chat_history IN SHARE MODE")
+        cur.execute("DELETE FROM session_stats")
+        cur.execute(f"INSERT INTO session_stats ({columns}) {_AGGREGATE_SQL.format(where='')}")
+        return
+
+    session_ids = [session_id] if session_ids is None else list(session_ids)
+    # As linhas travadas seguram o insert_chat_message dessas sessões até o commit
+    cur.execute("SELECT 1 FROM session_stats WHERE session_id = ANY(%s) FOR UPDATE", (session_ids,))
+    cur.execute(f"""
+        INSERT INTO session_stats ({columns})
+        {_AGGREGATE_SQL.format(where='WHERE session_id = ANY(%s)')}
+        ON CONFLICT (session_id) DO UPDATE SET
+            total_messages = EXCLUDED.total_messages,
+            user_messages = EXCLUDED.user_messages,
+            admin_present = EXCLUDED.admin_present,
+            last_user_message_at = EXCLUDED.last_user_message_at,
+            last_assistant_message_at = EXCLUDED.last_assistant_message_at,
+            last_message_id = EXCLUDED.last_message_id,
+            updated_at = EXCLUDED.updated_at
+    """, (session_ids,))
+    # Sessões que ficaram sem mensagem nenhuma
+    cur.execute("""
+        DELETE FROM session_stats s
+        WHERE s.session_id = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM chat_history h WHERE h.session_id = s.session_id)
+    """, (session_ids,))
+
+
+if __name__ == '__main__':
+    from _db import db_cursor
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command != 'rebuild':
+        print("Uso: python api/_session_stats.py rebuild")
+        sys.exit(1)
+    with db_cursor() as cur:
+        refresh_session_stats(cur)
+    print("✅ Contadores das sessões recalculados")
@@ -0,0 +1,161 @@
+"""
+Cache dos resultados das ferramentas que chamam APIs externas (clima, busca).
+Arquivos com _ no início não se tornam endpoints.
+
+Dois níveis:
+1. LRU em memória, limitado em tamanho (some quando a instância é reciclada)
+2. Tabela tool_cache no Postgres (opcional), para o cache sobreviver aos
+   cold starts da Vercel. Desligue com TOOL_CACHE_DB=0.
+
+A chave é o nome da ferramenta + argumentos normalizados (minúsculas, sem
+espaços sobrando), então "São Paulo" e " são  paulo" caem na mesma entrada.
+Só resultados de sucesso são guardados: se a busca levanta exceção ou volta
+vazia, nada é salvo. "Não achei nada" (NoResult) fica só TOOL_CACHE_EMPTY_TTL,
+para uma busca que falhou hoje não responder igual o dia inteiro.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from _db import POSTGRES_URL, DB_AVAILABLE, run_query
+
+# Validade de cada ferramenta, em segundos
+TOOL_CACHE_TTLS = {
+    'get_weather': 15 * 60,
+    'search_web': 24 * 60 * 60,
+}
+# Validade de um NoResult, qualquer que seja a ferramenta
+TOOL_CACHE_EMPTY_TTL = 5 * 60
+TOOL_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_CACHE_MAX_ENTRIES", 256))
+TOOL_CACHE_DB_ENABLED = os.environ.get("TOOL_CACHE_DB", "1") != "0"
+
+
+class NoResult(str):
+    """Texto de "não encontrei nada": vai para o modelo, mas fica pouco tempo no cache"""
+
+
+def normalize_arguments(arguments):
+    normalized = {}
+    for key, value in (arguments or {}).items():
+        if isinstance(value, str):
+            value = " ".join(value.lower().split())
+        normalized[key] = value
+    return normalized
+
+
+def cache_key(tool_name, arguments):
+    payload = json.dumps(normalize_arguments(arguments), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(f"{tool_name}:{payload}".encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """LRU com validade por entrada; seguro entre threads (as ferramentas rodam em paralelo)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_memory = LRUCache(TOOL_CACHE_MAX_ENTRIES)
+stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+
+def _db_enabled():
+    return TOOL_CACHE_DB_ENABLED and DB_AVAILABLE and bool(POSTGRES_URL)
+
+
+def _db_get(key):
+    try:
+        row = run_query(
+            "SELECT result, EXTRACT(EPOCH FROM expires_at) FROM tool_cache WHERE cache_key = %s AND expires_at > NOW()",
+            (key,), fetch='one'
+        )
+    except Exception as e:
+        print(f"⚠️ Erro lendo tool_cache: {e}")
+        return None
+    return (row[0], float(row[1])) if row else None
+
+
+def _db_set(key, tool_name, value, ttl):
+    try:
+        run_query("""
+            INSERT INTO tool_cache (cache_key, tool_name, result, expires_at)
+            VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (cache_key) DO UPDATE
+            SET result = EXCLUDED.result, expires_at = EXCLUDED.expires_at
+        """, (key, tool_name, value, ttl))
+    except Exception as e:
+        print(f"⚠️ Erro salvando tool_cache: {e}")
+
+
+def cached_tool_result(tool_name, arguments, compute):
+    """
+    Devolve o resultado em cache de tool_name(arguments) ou chama compute()
+    e guarda o retorno pelo TTL da ferramenta (NoResult pelo TTL curto, vazio
+    não é guardado). Exceções de compute() passam direto.
+    """
+    ttl = TOOL_CACHE_TTLS.get(tool_name)
+    if not ttl:
+        return compute()
+
+    key = cache_key(tool_name, arguments)
+    value = _memory.get(key)
+    if value is not None:
+        stats['memory_hits'] += 1
+        return value
+
+    if _db_enabled():
+        hit = _db_get(key)
+        if hit:
+            value, expires_at = hit
+            _memory.set(key, value, expires_at)
+            stats['db_hits'] += 1
+            return value
+
+    stats['misses'] += 1
+    value = compute()
+    if not value:
+        return value
+    if isinstance(value, NoResult):
+        ttl = TOOL_CACHE_EMPTY_TTL
+    _memory.set(key, value, time.time() + ttl)
+    if _db_enabled():
+        _db_set(key, tool_name, value, ttl)
+    return value
+
+
+def purge_expired():
+    """Apaga as entradas vencidas do Postgres (chamado pelo cron). Retorna quantas saíram."""
+    if not _db_enabled():
+        return 0
+    try:
+        return run_query("DELETE FROM tool_cache WHERE expires_at <= NOW()")
+    except Exception as e:
+        print(f"⚠️ Erro limpando tool_cache: {e}")
+        return 0
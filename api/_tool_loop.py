@@ -0,0 +1,226 @@
+"""
+Motor de rodadas de function calling do Matteo.
+Arquivos com _ no início não se tornam endpoints.
+
+Uma "rodada" é uma chamada ao modelo; se ele pedir ferramentas, elas são
+executadas e vem a próxima rodada. O loop para quando:
+- o modelo responde sem tool_calls (saída antecipada)
+- acabam as rodadas (a última é sempre com tool_choice="none", só texto)
+- estoura o orçamento de tempo total das chamadas ao modelo
+- o modelo falha e a política de fallback não resolve
+
+    loop = ToolLoop(rounds, execute_tools, fallback_policy=RateLimitFallback(...))
+    result = loop.run(messages)                    # modo JSON
+    result = loop.run(messages, on_text=enviar)    # modo streaming
+
+No modo streaming só a rodada de texto (tool_choice="none") sai token a
+token; as rodadas que podem chamar ferramentas são chamadas normais, porque
+o modelo pode mandar texto e só depois as tool_calls. Se uma delas já
+responder sem ferramentas, o texto sai de uma vez.
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from _llm import LLM_TIMEOUT_SECONDS, chat_completion, stream_chat_completion, is_rate_limit_error
+
+STOP_DONE = 'done'                  # o modelo respondeu sem pedir ferramentas
+STOP_MAX_ROUNDS = 'max_rounds'
+STOP_LATENCY_BUDGET = 'latency_budget'
+STOP_ERROR = 'error'                # falhou e o fallback não resolveu
+
+
+class FallbackPolicy:
+    """Decide o que fazer quando uma chamada ao modelo falha"""
+
+    def fallback_params(self, error, params, round_index):
+        """Parâmetros para tentar de novo, ou None para desistir (o erro é relançado)"""
+        return None
+
+
+class RateLimitFallback(FallbackPolicy):
+    """Em rate limit, tenta a mesma rodada com outro modelo e outros parâmetros"""
+
+    def __init__(self, model, overrides=None):
+        self.model = model
+        # overrides[i]: parâmetros de amostragem do fallback na rodada i (a última vale para as seguintes)
+        self.overrides = overrides or [{}]
+
+    def fallback_params(self, error, params, round_index):
+        if not is_rate_limit_error(error):
+            return None
+        print(f"⚠️ Rate limit na rodada {round_index + 1} com {params.get('model')}, tentando fallback: {self.model}")
+        base = {k: v for k, v in params.items() if k in ('tools', 'tool_choice')}
+        return dict(base, model=self.model, **self.overrides[min(round_index, len(self.overrides) - 1)])
+
+
+@dataclass
+class ToolLoopResult:
+    content: str = ""
+    tools_used: list = field(default_factory=list)
+    rounds: int = 0                    # rodadas que o modelo respondeu com sucesso
+    stop_reason: str = STOP_DONE
+    error: Optional[Exception] = None  # última falha, quando stop_reason == STOP_ERROR
+    elapsed: float = 0.0
+
+
+def stream_completion_round(messages, on_text, **params):
+    """
+    Faz uma chamada ao modelo em streaming. O texto vai para on_text conforme
+    chega, enquanto nenhuma tool_call tiver aparecido; as tool_calls são
+    montadas a partir dos pedaços (deltas).
+    Retorna (content, tool_calls) com tool_calls no formato das mensagens da API.
+    """
+    content_parts = []
+    tool_calls = {}
+
+    for chunk in stream_chat_completion(messages=messages, **params):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+
+        for tc in (delta.tool_calls or []):
+            index = tc.index if tc.index is not None else len(tool_calls)
+            entry = tool_calls.setdefault(index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if tc.id:
+                entry["id"] = tc.id
+            if tc.function:
+                if tc.function.name:
+                    entry["function"]["name"] += tc.function.name
+                if tc.function.arguments:
+                    entry["function"]["arguments"] += tc.function.arguments
+
+        if delta.content:
+            content_parts.append(delta.content)
+            if not tool_calls:
+                on_text(delta.content)
+
+    return "".join(content_parts), [tool_calls[i] for i in sorted(tool_calls)]
+
+
+def completion_round(messages, **params):
+    """Chamada normal (sem streaming), com o mesmo retorno de stream_completion_round"""
+    message = chat_completion(messages=messages, **params).choices[0].message
+    tool_calls = [
+        {
+            "id": tc.id,
+            "type": "function",
+            "function": {
+                "name": tc.function.name,
+                "arguments": tc.function.arguments
+            }
+        } for tc in (message.tool_calls or [])
+    ]
+    return message.content or "", tool_calls
+
+
+class ToolLoop:
+    """
+    rounds: parâmetros da chamada em cada rodada (a última entrada vale para as seguintes)
+    execute_tools(tool_calls) -> mensagens role=tool, na ordem das tool_calls
+    """
+
+    def __init__(self, rounds, execute_tools, fallback_policy=None, max_rounds=None,
+                 max_tokens_per_round=None, latency_budget_seconds=None):
+        self.rounds = rounds
+        self.execute_tools = execute_tools
+        self.fallback_policy = fallback_policy or FallbackPolicy()
+        self.max_rounds = max_rounds or len(rounds)
+        self.max_tokens_per_round = max_tokens_per_round
+        self.latency_budget_seconds = latency_budget_seconds
+
+    def _round_params(self, params, round_index, remaining):
+        params = dict(params)
+        if round_index == self.max_rounds - 1:
+            # Última rodada: forçar resposta em texto
+            params['tool_choice'] = "none"
+        if self.max_tokens_per_round:
+            params['max_tokens'] = min(params.get('max_tokens', self.max_tokens_per_round), self.max_tokens_per_round)
+        if remaining is not None:
+            # Nenhuma chamada pode passar do que sobrou do orçamento
+            params['timeout'] = max(min(remaining, LLM_TIMEOUT_SECONDS), 1)
+        return params
+
+    def run(self, messages, on_text=None, on_tool=None):
+        """
+        Roda as rodadas sobre messages (a lista é estendida com as tool_calls e
+        os resultados). Com on_text, o texto da resposta vai saindo por ele (em
+        streaming na rodada só de texto); on_tool(nome) avisa cada ferramenta executada.
+        """
+        started = time.monotonic()
+        result = ToolLoopResult()
+        streamed_chars = 0
+
+        def forward(text):
+            nonlocal streamed_chars
+            streamed_chars += len(text)
+            on_text(text)
+
+        def streams(params):
+            return on_text is not None and params.get('tool_choice') == "none"
+
+        def call(params):
+            if streams(params):
+                return stream_completion_round(messages, forward, **params)
+            return completion_round(messages, **params)
+
+        for round_index in range(self.max_rounds):
+            remaining = None
+            if self.latency_budget_seconds is not None:
+                remaining = self.latency_budget_seconds - (time.monotonic() - started)
+                if remaining <= 0:
+                    print(f"⏱️ Orçamento de {self.latency_budget_seconds:g}s das chamadas ao modelo esgotado depois de {result.rounds} rodada(s)")
+                    result.stop_reason = STOP_LATENCY_BUDGET
+                    break
+
+            params = self._round_params(self.rounds[min(round_index, len(self.rounds) - 1)], round_index, remaining)
+            chars_before = streamed_chars
+            try:
+                content, tool_calls = call(params)
+                streamed = streams(params)
+            except Exception as api_error:
+                fallback = None
+                # Fallback só se nada dessa rodada já foi enviado
+                if streamed_chars == chars_before:
+                    fallback = self.fallback_policy.fallback_params(api_error, params, round_index)
+                if fallback is None:
+                    raise
+                try:
+                    fallback = self._round_params(fallback, round_index, remaining)
+                    content, tool_calls = call(fallback)
+                    streamed = streams(fallback)
+                    print(f"✅ Usando modelo fallback {fallback.get('model')} com sucesso!")
+                except Exception as fallback_error:
+                    print(f"❌ Fallback também falhou: {fallback_error}")
+                    result.stop_reason = STOP_ERROR
+                    result.error = api_error
+                    break
+
+            result.rounds += 1
+            result.content = content
+
+            if not tool_calls:
+                if on_text and content and not streamed:
+                    forward(content)
+                result.stop_reason = STOP_DONE
+                break
+
+            messages.append({
+                "role": "assistant",
+                "content": content,
+                "tool_calls": tool_calls
+            })
+            for tool_call in tool_calls:
+                result.tools_used.append(tool_call["function"]["name"])
+                if on_tool:
+                    on_tool(tool_call["function"]["name"])
+            messages.extend(self.execute_tools(tool_calls))
+        else:
+            result.stop_reason = STOP_MAX_ROUNDS
+
+        result.elapsed = time.monotonic() - started
+        return result
@@ -0,0 +1,227 @@
+"""
+Estilo de escrita da Gehh, atualizado incrementalmente a cada mensagem dela.
+Arquivos com _ no início não se tornam endpoints.
+
+Antes o estilo era recalculado do zero (últimas 50 mensagens + regex em
+todas) no meio da resposta do chat. Agora cada mensagem só atualiza
+agregados que ficam em user_writing_style.model (JSONB):
+
+- somas com decaimento (cada mensagem nova pesa 1, as antigas vão
+  perdendo peso aos poucos): tamanho, emojis, maiúsculas, gírias, ! e ?
+- um esboço das palavras mais usadas limitado a STYLE_TOP_WORDS entradas
+  (space-saving: palavra nova entra no lugar da menos contada)
+
+O custo por mensagem é proporcional ao tamanho dela, e o estilo cobre o
+histórico inteiro em vez de uma janela. As colunas de sempre
+(avg_message_length, uses_emojis, common_words...) são derivadas do modelo
+e gravadas junto, então quem lê o estilo não muda.
+
+    update_writing_style(cur, session_id, texto)   # na transação do INSERT
+
+Para recalcular a partir do histórico (migração ou ajuste das regras):
+
+    python api/_writing_style.py rebuild
+"""
+import json
+import re
+import sys
+
+# Peso que uma mensagem perde a cada mensagem nova (meia-vida ~35 mensagens)
+STYLE_DECAY = 0.98
+STYLE_TOP_WORDS = 40
+STYLE_COMMON_WORDS = 10
+# Abaixo disso o estilo não vai para o prompt
+STYLE_MIN_MESSAGES = 5
+
+EMOJI_PATTERN = re.compile(r'[😀-🙏🌀-🗿🚀-🛿Ⓜ-🉑]+')
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+STOP_WORDS = frozenset({
+    'a', 'o', 'e', 'de', 'do', 'da', 'em', 'um', 'uma', 'que', 'pra', 'pro', 'com', 'na', 'no', 'é',
+    'tô', 'tá', 'vou', 'vai', 'ser', 'foi', 'são', 'tem', 'ter', 'me', 'te', 'se', 'ele', 'ela',
+    'eles', 'elas', 'eu', 'você', 'vocês', 'meu', 'minha', 'seu', 'sua', 'não', 'sim',
+    'kkk', 'kkkk', 'kkkkk',
+})
+SLANG_WORDS = frozenset({'kkk', 'kkkk', 'né', 'tipo', 'mano', 'véi', 'aí', 'pra', 'pro', 'tô', 'tá', 'vou', 'vai'})
+
+# Somas com decaimento guardadas no modelo
+_SUMS = ('weight', 'length', 'emojis', 'caps', 'chars', 'words', 'slang', 'exclaims', 'questions')
+
+
+def new_style_model():
+    return {'count': 0, **{name: 0.0 for name in _SUMS}, 'top_words': {}}
+
+
+def observe_message(model, content):
+    """Soma uma mensagem ao modelo (no lugar). O(tamanho da mensagem + STYLE_TOP_WORDS)."""
+    content = content or ""
+    words = WORD_PATTERN.findall(content.lower())
+
+    for name in _SUMS:
+        model[name] *= STYLE_DECAY
+    model['count'] += 1
+    model['weight'] += 1
+    model['length'] += len(content)
+    model['emojis'] += len(EMOJI_PATTERN.findall(content))
+    model['caps'] += sum(1 for c in content if c.isupper())
+    model['chars'] += len(content)
+    model['words'] += len(words)
+    model['slang'] += sum(1 for word in words if word in SLANG_WORDS)
+    model['exclaims'] += '!' in content
+    model['questions'] += '?' in content
+
+    top_words = model['top_words']
+    for word in top_words:
+        top_words[word] *= STYLE_DECAY
+    for word in words:
+        if word in STOP_WORDS or len(word) <= 2:
+            continue
+        if word in top_words or len(top_words) < STYLE_TOP_WORDS:
+            top_words[word] = top_words.get(word, 0.0) + 1
+        else:
+            # Space-saving: a menos contada sai e a nova herda a contagem dela
+            weakest = min(top_words, key=top_words.get)
+            top_words[word] = top_words.pop(weakest) + 1
+    return model
+
+
+def describe_style(model):
+    """Colunas de user_writing_style derivadas do modelo (mesmas regras da análise antiga)"""
+    weight = model['weight'] or 1
+    avg_length = int(model['length'] / weight)
+    emoji_freq = model['emojis'] / weight
+    caps_freq = model['caps'] / model['chars'] if model['chars'] else 0
+    slang_usage = model['slang'] / model['words'] if model['words'] else 0
+    uses_emojis = emoji_freq > 0.3
+    uses_caps = caps_freq > 0.1
+
+    common_words = sorted(model['top_words'].items(), key=lambda item: item[1], reverse=True)[:STYLE_COMMON_WORDS]
+
+    if model['questions'] / weight >= 0.2:
+        punct_style = 'curioso'
+    elif model['exclaims'] / weight >= 0.2:
+        punct_style = 'expressivo'
+    else:
+        punct_style = 'neutro'
+
+    # Nível de formalidade (1=muito formal, 5=muito informal)
+    formality = max(1, min(5, 5 - int(slang_usage * 4)))
+
+    if avg_length < 20:
+        response_pattern = 'curto'
+    elif avg_length < 50:
+        response_pattern = 'médio'
+    else:
+        response_pattern = 'longo'
+
+    style_parts = []
+    if uses_emojis:
+        style_parts.append('usa emojis frequentemente')
+    if uses_caps:
+        style_parts.append('usa maiúsculas para ênfase')
+    if formality <= 2:
+        style_parts.append('linguagem mais formal')
+    elif formality >= 4:
+        style_parts.append('linguagem muito informal e descontraída')
+    style_parts.append(f'respostas {response_pattern}s')
+
+    return {
+        'avg_message_length': avg_length,
+        'uses_emojis': uses_emojis,
+        'emoji_frequency': round(emoji_freq, 2),
+        'uses_caps': uses_caps,
+        'caps_frequency': round(caps_freq, 3),
+        'common_words': ', '.join(word for word, _ in common_words),
+        'punctuation_style': punct_style,
+        'formality_level': formality,
+        'slang_usage': round(slang_usage, 3),
+        'response_pattern': response_pattern,
+        'style_summary': ', '.join(style_parts),
+        'message_count': model['count'],
+    }
+
+
+def save_style_model(cur, session_id, model):
+    style = describe_style(model)
+    columns = list(style)
+    cur.execute(f"""
+        INSERT INTO user_writing_style (session_id, model, {', '.join(columns)}, last_analyzed, updated_at)
+        VALUES (%s, %s::jsonb, {', '.join(['%s'] * len(columns))}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT (session_id) DO UPDATE SET
+            model = EXCLUDED.model,
+            {', '.join(f'{column} = EXCLUDED.{column}' for column in columns)},
+            last_analyzed = EXCLUDED.last_analyzed,
+            updated_at = EXCLUDED.updated_at
+    """, [session_id, json.dumps(model, ensure_ascii=False), *style.values()])
+    return style
+
+
+def _load_model(cur, session_id, lock=False):
+    cur.execute(
+        "SELECT model FROM user_writing_style WHERE session_id = %s" + (" FOR UPDATE" if lock else ""),
+        (session_id,)
+    )
+    row = cur.fetchone()
+    model = (row['model'] if isinstance(row, dict) else row[0]) if row else None
+    if isinstance(model, str):
+        model = json.loads(model)
+    return model
+
+
+def update_writing_style(cur, session_id, content):
+    """
+    Soma uma mensagem da Gehh ao estilo da sessão, na transação de quem
+    chamou, depois do INSERT da mensagem (a linha fica travada até o commit,
+    então mensagens simultâneas não se perdem). Retorna as colunas
+    atualizadas, ou None se deu erro.
+    """
+    cur.execute("SAVEPOINT writing_style")
+    try:
+        model = _load_model(cur, session_id, lock=True)
+        if model is None:
+            # Sessão sem modelo ainda: começa pelo histórico (que já inclui esta mensagem)
+            style = rebuild_writing_style(cur, session_id)
+        else:
+            style = save_style_model(cur, session_id, observe_message(model, content))
+        cur.execute("RELEASE SAVEPOINT writing_style")
+        return style
+    except Exception as e:
+        # Estilo nunca derruba a mensagem
+        cur.execute("ROLLBACK TO SAVEPOINT writing_style")
+        print(f"⚠️ Erro ao atualizar estilo de escrita: {e}")
+        return None
+
+
+def rebuild_writing_style(cur, session_id=None):
+    """
+    Recalcula o modelo passando pelo histórico inteiro da Gehh (de uma sessão
+    ou de todas). Também é o passo de migração que preenche os modelos.
+    """
+    if session_id is None:
+        cur.execute("SELECT DISTINCT session_id FROM chat_history WHERE role = 'user'")
+        sessions = [row['session_id'] if isinstance(row, dict) else row[0] for row in cur.fetchall()]
+        for session in sessions:
+            rebuild_writing_style(cur, session)
+        return None
+
+    cur.execute("""
+        SELECT content FROM chat_history
+        WHERE session_id = %s AND role = 'user'
+        ORDER BY created_at, id
+    """, (session_id,))
+    model = new_style_model()
+    for row in cur.fetchall():
+        observe_message(model, row['content'] if isinstance(row, dict) else row[0])
+    return save_style_model(cur, session_id, model)
+
+
+if __name__ == '__main__':
+    from _db import db_cursor
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command != 'rebuild':
+        print("Uso: python api/_writing_style.py rebuild")
+        sys.exit(1)
+    with db_cursor() as cur:
+        rebuild_writing_style(cur)
+    print("✅ Estilos de escrita recalculados")
@@ -7,9 +7,12 @@ from http.server import BaseHTTPRequestHandler
 import json
 import os
 import re
+import sys
 import uuid
+import time
 import urllib.request
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 
 # Tentar importar psycopg2
@@ -21,18 +24,28 @@ except ImportError:
     DB_AVAILABLE = False
     print("psycopg2 não disponível")
 
-# Tentar importar OpenAI (funciona com Mistral!)
-try:
-    from openai import OpenAI
-    from openai import RateLimitError
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    RateLimitError = Exception  # Fallback
-    print("openai não disponível")
-
-# Configuração do Mistral
-MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _db import get_db_connection, db_cursor, save_chat_message
+from _migrations import ensure_schema
+from _chat_context import load_chat_context
+
+# Cliente do Mistral (criado só na primeira chamada, com circuit breaker)
+from _llm import (
+    OPENAI_AVAILABLE, MISTRAL_API_KEY, LLM_MODEL, FALLBACK_MODEL,
+    llm_available, llm_unavailable_reasons,
+)
+from _sanitizer import sanitize_response, StreamingSanitizer
+from _tool_loop import ToolLoop, RateLimitFallback, STOP_ERROR
+from _tool_cache import NoResult, cached_tool_result
+from _memory_search import search_memories
+from _mural_stats import record_post_created
+from _outbox import deliver_after_response, enqueue_email
+from _session_stats import get_session_stats
+from _writing_style import STYLE_MIN_MESSAGES
+from _conversation_index import list_conversations
+from _chat_turn import save_chat_turn
+from _learning import learn_after_response
 
 # Debug: verificar configuração
 if not MISTRAL_API_KEY:
@@ -238,60 +251,64 @@ MATTEO_TOOLS = [
 # 🔨 IMPLEMENTAÇÃO DAS FERRAMENTAS
 # ═══════════════════════════════════════════════════════════════════════════════
 
+def _fetch_web_search(query):
+    # Usar DuckDuckGo Instant Answer API
+    encoded_query = urllib.parse.quote(query)
+    url = f"https://api.duckduckgo.com/?q={encoded_query}&format=json&no_html=1&skip_disambig=1"
+    
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(req, timeout=5) as response:
+        data = json.loads(response.read().decode())
+    
+    results = []
+    
+    # Abstract (resumo principal)
+    if data.get('Abstract'):
+        results.append(f"📖 {data['Abstract']}")
+    
+    # Answer (resposta direta)
+    if data.get('Answer'):
+        results.append(f"✅ {data['Answer']}")
+    
+    # Related Topics
+    for topic in data.get('RelatedTopics', [])[:3]:
+        if isinstance(topic, dict) and topic.get('Text'):
+            results.append(f"• {topic['Text'][:200]}")
+    
+    if results:
+        return "\n\n".join(results)
+    
+    # Fallback: tentar busca alternativa
+    return NoResult(f"Não encontrei informações específicas sobre '{query}'. Posso tentar ajudar de outra forma!")
+
 def tool_search_web(query):
-    """Busca na web usando DuckDuckGo (gratuito)"""
+    """Busca na web usando DuckDuckGo (gratuito), com cache de 24h (5 min quando não acha nada)"""
     try:
-        # Usar DuckDuckGo Instant Answer API
-        encoded_query = urllib.parse.quote(query)
-        url = f"https://api.duckduckgo.com/?q={encoded_query}&format=json&no_html=1&skip_disambig=1"
-        
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req, timeout=5) as response:
-            data = json.loads(response.read().decode())
-        
-        results = []
-        
-        # Abstract (resumo principal)
-        if data.get('Abstract'):
-            results.append(f"📖 {data['Abstract']}")
-        
-        # Answer (resposta direta)
-        if data.get('Answer'):
-            results.append(f"✅ {data['Answer']}")
-        
-        # Related Topics
-        for topic in data.get('RelatedTopics', [])[:3]:
-            if isinstance(topic, dict) and topic.get('Text'):
-                results.append(f"• {topic['Text'][:200]}")
-        
-        if results:
-            return "\n\n".join(results)
-        
-        # Fallback: tentar busca alternativa
-        return f"Não encontrei informações específicas sobre '{query}'. Posso tentar ajudar de outra forma!"
-        
+        return cached_tool_result('search_web', {'query': query}, lambda: _fetch_web_search(query))
     except Exception as e:
         print(f"Erro na busca web: {e}")
         return f"Não consegui buscar agora, mas posso tentar ajudar com o que sei!"
 
+def _fetch_weather(city):
+    encoded_city = urllib.parse.quote(city)
+    url = f"https://wttr.in/{encoded_city}?format=j1"
+    
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(req, timeout=5) as response:
+        data = json.loads(response.read().decode())
+    
+    current = data['current_condition'][0]
+    temp = current['temp_C']
+    feels_like = current['FeelsLikeC']
+    humidity = current['humidity']
+    desc = current.get('lang_pt', [{}])[0].get('value', current['weatherDesc'][0]['value'])
+    
+    return f"🌡️ {city}: {temp}°C (sensação de {feels_like}°C)\n☁️ {desc}\n💧 Umidade: {humidity}%"
+
 def tool_get_weather(city):
-    """Obtém clima usando wttr.in (gratuito)"""
+    """Obtém clima usando wttr.in (gratuito), com cache de 15 minutos"""
     try:
-        encoded_city = urllib.parse.quote(city)
-        url = f"https://wttr.in/{encoded_city}?format=j1"
-        
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req, timeout=5) as response:
-            data = json.loads(response.read().decode())
-        
-        current = data['current_condition'][0]
-        temp = current['temp_C']
-        feels_like = current['FeelsLikeC']
-        humidity = current['humidity']
-        desc = current.get('lang_pt', [{}])[0].get('value', current['weatherDesc'][0]['value'])
-        
-        return f"🌡️ {city}: {temp}°C (sensação de {feels_like}°C)\n☁️ {desc}\n💧 Umidade: {humidity}%"
-        
+        return cached_tool_result('get_weather', {'city': city}, lambda: _fetch_weather(city))
     except Exception as e:
         print(f"Erro ao buscar clima: {e}")
         return f"Não consegui ver o clima de {city} agora, princesa!"
@@ -391,7 +408,7 @@ def tool_get_conversation_stats(session_id):
 def tool_get_random_fact(topic):
     """Busca curiosidade sobre um tópico"""
     try:
-        # Usar busca web para encontrar curiosidades
+        # Usar busca web para encontrar curiosidades (passa pelo cache da busca)
         query = f"curiosidade interessante sobre {topic}"
         fact = tool_search_web(query)
         
@@ -428,14 +445,10 @@ def check_if_group_mode_active(session_id):
         if not conn:
             return False
         cur = conn.cursor()
-        cur.execute("""
-            SELECT COUNT(*) FROM chat_history 
-            WHERE session_id = %s AND role = 'admin'
-        """, (session_id,))
-        count = cur.fetchone()[0]
+        admin_present = get_session_stats(cur, session_id)['admin_present']
         cur.close()
         conn.close()
-        return count > 0
+        return admin_present
     except:
         return False
 
@@ -461,22 +474,18 @@ def get_recent_conversation_context(session_id, limit=5):
         print(f"Erro ao buscar contexto: {e}")
         return "Não foi possível carregar o contexto"
 
-def tool_call_pablo(reason, message, session_id=None):
-    """Chama o Pablo para entrar na conversa (ativa modo grupo) e envia email"""
+def tool_call_pablo(reason, message, session_id=None, turn_messages=None):
+    """
+    Chama o Pablo para entrar na conversa (ativa modo grupo) e envia email.
+    turn_messages: mensagens da rodada em andamento; o aviso "Chamando o
+    Pablo" vai para ela (gravado junto com a rodada) em vez de direto no banco.
+    """
     try:
-        import smtplib
-        from email.mime.text import MIMEText
-        from email.mime.multipart import MIMEMultipart
-        
         # Verificar se já está em modo grupo (evitar emails duplicados)
         if session_id and check_if_group_mode_active(session_id):
             print("ℹ️ Modo grupo já está ativo, não enviando email duplicado")
             return f"✅ O Pablo já está na conversa, princesa! Vocês 3 já podem conversar juntos! 💙"
         
-        SENDER_EMAIL = os.environ.get('SENDER_EMAIL')
-        SENDER_PASSWORD = os.environ.get('SENDER_PASSWORD')
-        RECEIVER_EMAIL = os.environ.get('RECEIVER_EMAIL')
-        
         # Buscar conversation_id se não fornecido
         conversation_id = None
         if session_id:
@@ -526,16 +535,7 @@ def tool_call_pablo(reason, message, session_id=None):
         </html>
         """
         
-        # Enviar email se credenciais estiverem configuradas
-        email_sent = False
-        if all([SENDER_EMAIL, SENDER_PASSWORD, RECEIVER_EMAIL]):
-            try:
-                msg = MIMEMultipart('alternative')
-                msg['Subject'] = f"📞 Matteo te chamou! - {hora_atual}"
-                msg['From'] = SENDER_EMAIL
-                msg['To'] = RECEIVER_EMAIL
-                
-                text_content = f"""O Matteo te chamou para entrar na conversa!
+        text_content = f"""O Matteo te chamou para entrar na conversa!
 
 Motivo: {reason}
 
@@ -552,26 +552,22 @@ Acesse: {link_url}
 Session ID: {session_id or 'N/A'}
 Conversation ID: {conversation_id or 'N/A'}
 """
-                
-                msg.attach(MIMEText(text_content, 'plain', 'utf-8'))
-                msg.attach(MIMEText(html_content, 'html', 'utf-8'))
-                
-                with smtplib.SMTP('smtp.gmail.com', 587) as server:
-                    server.starttls()
-                    server.login(SENDER_EMAIL, SENDER_PASSWORD)
-                    server.sendmail(SENDER_EMAIL, RECEIVER_EMAIL, msg.as_string())
-                
-                email_sent = True
-                print(f"✅ Email enviado para {RECEIVER_EMAIL} - Matteo chamou o Pablo!")
+        
+        # Email vai para a outbox; sai depois da resposta do chat (run_after_reply)
+        email_sent = False
+        try:
+            with db_cursor() as cur:
+                email_sent = enqueue_email(cur, f"📞 Matteo te chamou! - {hora_atual}", text_content, html_content)
+            if email_sent:
+                print(f"✅ Email para o Pablo na fila - Matteo chamou o Pablo!")
                 print(f"   Link: {link_url}")
-            except Exception as e:
-                print(f"⚠️ Erro ao enviar email: {e}")
-                email_sent = False
-        else:
-            print("⚠️ Credenciais de email não configuradas")
+        except Exception as e:
+            print(f"⚠️ Erro ao enfileirar email: {e}")
         
         # Salvar mensagem do Matteo chamando o Pablo no histórico
-        if session_id:
+        if turn_messages is not None:
+            turn_messages.append(('assistant', f"📞 Chamando o Pablo... {message}"))
+        elif session_id:
             try:
                 save_chat_message(session_id, 'assistant', f"📞 Chamando o Pablo... {message}")
             except:
@@ -1089,163 +1085,14 @@ COMO USAR SEU CONHECIMENTO SOBRE PABLO E GEHH:
 Lembre-se: Você é o MATTEO, melhor amigo da Gehh. Seja natural, carinhoso e genuíno. Cada resposta deve ser única e diferente das anteriores. Use seu conhecimento sobre Pablo e Gehh de forma variada, natural e criativa. Fale como um amigo real falaria, não como um robô.
 """
 
-# Prompt para extrair memórias (REFORÇADO)
-MEMORY_EXTRACTION_PROMPT = """Você é um sistema especializado em extrair informações importantes de conversas.
-
-Analise a conversa abaixo e extraia TODAS as informações relevantes sobre a Gehh, mesmo que pareçam pequenas.
-
-CATEGORIAS DE INFORMAÇÕES:
-1. EMOCIONAL: O que a deixa feliz/triste/irritada, como ela reage a situações
-2. ROTINA: Horários, atividades do dia a dia, hábitos
-3. RELACIONAMENTO: Detalhes sobre o Pablo, momentos especiais, preferências do casal
-4. PREFERÊNCIAS: Comidas, músicas, séries, filmes, lugares, cores, estilos
-5. PESSOAS: Amigos, família, pessoas importantes na vida dela
-6. SONHOS/METAS: Planos futuros, desejos, objetivos
-7. PROBLEMAS: Coisas que a incomodam, dificuldades que ela enfrenta
-8. INTERESSES: Hobbies, coisas que ela gosta de fazer, assuntos que ela curte
-
-IMPORTANTE:
-- Extraia informações específicas e detalhadas
-- Inclua contexto quando relevante
-- Mesmo informações pequenas podem ser importantes
-- Prefira múltiplas memórias específicas a uma memória genérica
-
-CONVERSA:
-{conversation}
-
-Responda APENAS com JSON válido:
-{{"memories": ["memória detalhada 1", "memória detalhada 2", "memória detalhada 3"]}}
-
-Se não tiver nada importante:
-{{"memories": []}}"""
-
-# Prompt para resumir conversas longas (REFORÇADO)
-CONVERSATION_SUMMARY_PROMPT = """Você é um sistema especializado em resumir conversas mantendo TODAS as informações importantes.
-
-Resuma esta conversa entre Matteo e Gehh de forma COMPLETA mas concisa (máximo 250 palavras).
-
-MANTENHA TODOS OS DETALHES IMPORTANTES:
-- Humor e estado emocional da Gehh durante a conversa
-- Assuntos principais discutidos
-- Promessas ou compromissos feitos
-- Informações pessoais reveladas
-- Problemas ou preocupações mencionados
-- Momentos especiais ou engraçados
-- Mudanças de humor ou tópico
-- Contexto emocional (ela estava feliz? triste? estressada?)
-- Qualquer informação que possa ser útil em conversas futuras
-
-SEJA ESPECÍFICO:
-- Não use "ela falou sobre trabalho" → use "ela estava estressada com um projeto no trabalho"
-- Não use "ela mencionou o Pablo" → use "ela estava feliz porque o Pablo fez algo especial"
-- Inclua detalhes que ajudem a entender o contexto completo
-
-CONVERSA:
-{conversation}
-
-RESUMO (seja específico e detalhado):"""
-
 # ============== FUNÇÕES DO BANCO ==============
 
-def get_db_connection():
-    if not POSTGRES_URL or not DB_AVAILABLE:
-        return None
-    return psycopg2.connect(POSTGRES_URL)
-
-def init_db():
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        
-        # Tabela de histórico de chat
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id SERIAL PRIMARY KEY,
-                session_id VARCHAR(255) NOT NULL,
-                role VARCHAR(20) NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_chat_history_session 
-            ON chat_history(session_id);
-        """)
-        
-        # Tabela de memórias da Gehh
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS gehh_memories (
-                id SERIAL PRIMARY KEY,
-                memory TEXT NOT NULL,
-                category VARCHAR(50) DEFAULT 'geral',
-                importance INTEGER DEFAULT 5,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_used TIMESTAMP,
-                use_count INTEGER DEFAULT 0
-            );
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_gehh_memories_importance 
-            ON gehh_memories(importance DESC);
-        """)
-        
-        # Tabela de resumos de conversas
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS conversation_summaries (
-                id SERIAL PRIMARY KEY,
-                session_id VARCHAR(255) NOT NULL,
-                summary TEXT NOT NULL,
-                message_count INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        
-        # Tabela de conversas (metadados)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id VARCHAR(255) PRIMARY KEY,
-                session_id VARCHAR(255) NOT NULL UNIQUE,
-                title VARCHAR(255) NOT NULL,
-                last_message TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_conversations_updated 
-            ON conversations(updated_at DESC);
-        """)
-        
-        # Tabela de estilo de escrita do usuário
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS user_writing_style (
-                session_id VARCHAR(255) PRIMARY KEY,
-                avg_message_length INTEGER DEFAULT 0,
-                uses_emojis BOOLEAN DEFAULT FALSE,
-                emoji_frequency REAL DEFAULT 0.0,
-                uses_caps BOOLEAN DEFAULT FALSE,
-                caps_frequency REAL DEFAULT 0.0,
-                common_words TEXT,
-                punctuation_style TEXT,
-                formality_level INTEGER DEFAULT 3,
-                slang_usage REAL DEFAULT 0.0,
-                response_pattern TEXT,
-                style_summary TEXT,
-                message_count INTEGER DEFAULT 0,
-                last_analyzed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro init_db: {e}")
-        return False
+CHAT_HISTORY_QUERY = """
+    SELECT role, content FROM chat_history
+    WHERE session_id = %s
+    ORDER BY created_at DESC
+    LIMIT %s
+"""
 
 def get_chat_history(session_id, limit=30):
     try:
@@ -1253,12 +1100,7 @@ def get_chat_history(session_id, limit=30):
         if not conn:
             return []
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT role, content FROM chat_history 
-            WHERE session_id = %s 
-            ORDER BY created_at DESC 
-            LIMIT %s
-        """, (session_id, limit))
+        cur.execute(CHAT_HISTORY_QUERY, (session_id, limit))
         history = list(reversed(cur.fetchall()))
         cur.close()
         conn.close()
@@ -1267,126 +1109,9 @@ def get_chat_history(session_id, limit=30):
         print(f"Erro get_chat_history: {e}")
         return []
 
-def save_chat_message(session_id, role, content):
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO chat_history (session_id, role, content)
-            VALUES (%s, %s, %s)
-        """, (session_id, role, content))
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        # Se for mensagem do usuário, atualizar análise de estilo periodicamente
-        if role == 'user':
-            try:
-                user_style = get_user_writing_style(session_id)
-                # Re-analisar a cada 10 mensagens novas ou se não existe análise
-                should_analyze = False
-                if not user_style:
-                    should_analyze = True
-                elif user_style.get('message_count', 0) % 10 == 0:
-                    should_analyze = True
-                
-                if should_analyze:
-                    style_data = analyze_user_writing_style(session_id)
-                    if style_data:
-                        save_user_writing_style(session_id, style_data)
-                        print(f"✅ Estilo de escrita atualizado para session {session_id}")
-            except Exception as e:
-                print(f"⚠️ Erro ao atualizar estilo de escrita: {e}")
-        
-        return True
-    except Exception as e:
-        print(f"Erro save_chat_message: {e}")
-        return False
-
-def get_memories(limit=30):
-    """Busca as memórias mais importantes sobre a Gehh"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return []
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT memory, category, importance FROM gehh_memories 
-            ORDER BY importance DESC, last_used DESC NULLS LAST, created_at DESC
-            LIMIT %s
-        """, (limit,))
-        memories = cur.fetchall()
-        cur.close()
-        conn.close()
-        return [m["memory"] for m in memories]
-    except Exception as e:
-        print(f"Erro get_memories: {e}")
-        return []
-
 def search_memories_by_query(query):
-    """Busca memórias que contenham palavras-chave"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return []
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Busca por palavras-chave
-        words = query.lower().split()
-        conditions = " OR ".join(["LOWER(memory) LIKE %s" for _ in words])
-        params = [f"%{word}%" for word in words]
-        
-        cur.execute(f"""
-            SELECT memory FROM gehh_memories 
-            WHERE {conditions}
-            ORDER BY importance DESC
-            LIMIT 10
-        """, params)
-        
-        memories = cur.fetchall()
-        cur.close()
-        conn.close()
-        return [m["memory"] for m in memories]
-    except Exception as e:
-        print(f"Erro search_memories: {e}")
-        return []
-
-def save_memory(memory, category='geral', importance=5):
-    """Salva uma nova memória sobre a Gehh"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        
-        # Verifica se memória similar já existe
-        cur.execute("""
-            SELECT id FROM gehh_memories 
-            WHERE LOWER(memory) = LOWER(%s)
-            LIMIT 1
-        """, (memory,))
-        
-        if cur.fetchone():
-            cur.execute("""
-                UPDATE gehh_memories 
-                SET use_count = use_count + 1, last_used = CURRENT_TIMESTAMP
-                WHERE LOWER(memory) = LOWER(%s)
-            """, (memory,))
-        else:
-            cur.execute("""
-                INSERT INTO gehh_memories (memory, category, importance)
-                VALUES (%s, %s, %s)
-            """, (memory, category, importance))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro save_memory: {e}")
-        return False
+    """Busca as memórias mais relevantes para a consulta (full-text + trigramas, ver _memory_search.py)"""
+    return [m["memory"] for m in search_memories(query, limit=10)]
 
 def save_feedback(message, author='Geovana'):
     """Salva uma mensagem no mural de feedbacks"""
@@ -1396,23 +1121,14 @@ def save_feedback(message, author='Geovana'):
             return False
         cur = conn.cursor()
         
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS feedback (
-                id VARCHAR(36) PRIMARY KEY,
-                author VARCHAR(255) NOT NULL,
-                message TEXT NOT NULL,
-                created_at TIMESTAMP NOT NULL,
-                updated_at TIMESTAMP
-            );
-        """)
-        
         feedback_id = str(uuid.uuid4())
         created_at = datetime.now()
         
         cur.execute(
-            "INSERT INTO feedback (id, author, message, created_at) VALUES (%s, %s, %s, %s)",
+            "INSERT INTO feedback (id, author, message, created_at) VALUES (%s, %s, %s, %s) RETURNING mood",
             (feedback_id, author, message, created_at)
         )
+        record_post_created(cur, created_at, cur.fetchone()[0])
         conn.commit()
         cur.close()
         conn.close()
@@ -1435,132 +1151,10 @@ def read_feedback_board(limit=5):
     except:
         return []
 
-def get_conversation_summary(session_id):
-    """Busca o resumo da conversa anterior"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return None
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT summary FROM conversation_summaries 
-            WHERE session_id = %s 
-            ORDER BY created_at DESC LIMIT 1
-        """, (session_id,))
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        return result['summary'] if result else None
-    except:
-        return None
-
-def save_conversation_summary(session_id, summary, message_count):
-    """Salva um resumo da conversa"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO conversation_summaries (session_id, summary, message_count)
-            VALUES (%s, %s, %s)
-        """, (session_id, summary, message_count))
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro save_summary: {e}")
-        return False
-
-def get_total_messages():
-    """Conta total de mensagens"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return 0
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM chat_history WHERE role = 'user'")
-        count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        return count
-    except:
-        return 0
-
-def get_intimacy_level(session_id):
-    """Calcula nível de intimidade"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return 1
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM chat_history WHERE session_id = %s AND role = 'user'", (session_id,))
-        count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        
-        if count < 10: return 1
-        if count < 30: return 2
-        if count < 100: return 3
-        if count < 300: return 4
-        return 5
-    except:
-        return 1
-
 # ============== CLIENTE MISTRAL ==============
 
-client = None
-LLM_ENABLED = False
-# Modelo principal - PIXTRAL LARGE (MELHOR MODELO MULTIMODAL)
-# Usando o Pixtral Large para máxima qualidade, inteligência e naturalidade
-# Pixtral Large é o modelo multimodal mais avançado da Mistral AI com:
-# - 123 bilhões de parâmetros
-# - 128.000 tokens de contexto (contexto muito longo)
-# - Capacidades multimodais (texto + imagem)
-# - Melhor em raciocínio, matemática e código
-# - Suporte multilíngue avançado (português nativo)
-# - Melhor compreensão de contexto e nuance
-# - Respostas mais naturais e humanas
-# - Melhor em evitar repetições
-# - Arquitetura avançada para máxima qualidade
-# 
-# Opções disponíveis (da melhor para a mais básica):
-#   - "pixtral-large-latest" (MELHOR - multimodal, 128k contexto) ⭐ USANDO
-#   - "mistral-large-latest" (excelente - 32k contexto, estável)
-#   - "mistral-medium-latest" (boa qualidade, balanceado)
-#   - "mistral-small-latest" (rápido, menos tokens)
-# 
-# NOTA: Se pixtral-large-latest não funcionar, tente:
-#   - "pixtral-12x32b-2409" (versão específica do Pixtral)
-#   - "mistral-large-latest" (fallback estável)
-LLM_MODEL = os.environ.get("MISTRAL_MODEL", "pixtral-large-latest")
-# Modelo fallback para quando rate limit for atingido (só em emergência)
-FALLBACK_MODEL = "mistral-large-latest"  # Se Pixtral não disponível, usar Large
-
-if OPENAI_AVAILABLE and MISTRAL_API_KEY:
-    try:
-        client = OpenAI(
-            api_key=MISTRAL_API_KEY,
-            base_url="https://api.mistral.ai/v1"
-        )
-        # Testar conexão
-        test_response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[{"role": "user", "content": "test"}],
-            max_tokens=1,
-            temperature=0
-        )
-        LLM_ENABLED = True
-        print("✅ Matteo IA Completa - Mistral Large conectado e funcionando!")
-        print(f"   Modelo: {LLM_MODEL} (Fallback: {FALLBACK_MODEL})")
-    except Exception as e:
-        print(f"❌ Erro ao configurar/testar Mistral: {e}")
-        print(f"  API Key presente: {bool(MISTRAL_API_KEY)}")
-        print(f"  API Key início: {MISTRAL_API_KEY[:10] if MISTRAL_API_KEY else 'N/A'}")
-        client = None
-        LLM_ENABLED = False
-elif not OPENAI_AVAILABLE:
+# O cliente é criado na primeira chamada real (ver _llm.py), sem chamada de teste no cold start
+if not OPENAI_AVAILABLE:
     print("❌ Biblioteca OpenAI não disponível")
     print("  Execute: pip install openai")
 elif not MISTRAL_API_KEY:
@@ -1569,7 +1163,7 @@ elif not MISTRAL_API_KEY:
 
 # ============== EXECUÇÃO DE FERRAMENTAS ==============
 
-def execute_tool(tool_name, arguments, session_id=None):
+def execute_tool(tool_name, arguments, session_id=None, turn_messages=None):
     """Executa uma ferramenta e retorna o resultado"""
     try:
         if tool_name == "search_web":
@@ -1604,7 +1198,8 @@ def execute_tool(tool_name, arguments, session_id=None):
             return tool_call_pablo(
                 arguments.get("reason", "Gehh pediu"),
                 arguments.get("message", "A Gehh precisa de você!"),
-                session_id=session_id
+                session_id=session_id,
+                turn_messages=turn_messages
             )
         else:
             return f"Ferramenta {tool_name} não encontrada."
@@ -1612,81 +1207,68 @@ def execute_tool(tool_name, arguments, session_id=None):
         print(f"Erro executando ferramenta {tool_name}: {e}")
         return f"Erro ao executar {tool_name}"
 
-# ============== FUNÇÕES DE APRENDIZADO ==============
+# Tempo máximo de cada ferramenta (as de rede usam urllib com timeout=5)
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("TOOL_TIMEOUT_SECONDS", 6))
+TOOL_TIMEOUTS = {
+    'search_web': 6,
+    'get_weather': 6,
+    'get_random_fact': 6,
+    'call_pablo': 10,  # e-mail + push
+}
+# Prazo da rodada inteira: passou disso, o modelo segue sem as ferramentas atrasadas
+TOOL_ROUND_DEADLINE_SECONDS = float(os.environ.get("TOOL_ROUND_DEADLINE_SECONDS", 10))
+TOOL_MAX_WORKERS = 6
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix='matteo-tool')
+
+
+def execute_tool_calls(tool_calls, session_id=None, turn_messages=None):
+    """
+    Executa as tool_calls de uma rodada em paralelo, cada uma com seu timeout
+    e todas dentro do prazo da rodada.
+    tool_calls vem no formato das mensagens da API ({'id', 'function': {'name', 'arguments'}}).
+    Retorna as mensagens role=tool na mesma ordem das tool_calls.
+    turn_messages: mensagens que as ferramentas querem gravar junto com a rodada.
+    """
+    started = time.monotonic()
+    round_deadline = started + TOOL_ROUND_DEADLINE_SECONDS
+
+    pending = []
+    for tool_call in tool_calls:
+        tool_name = tool_call["function"]["name"]
+        try:
+            arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+        except:
+            arguments = {}
 
-def extract_memories_from_conversation(conversation_text):
-    """Usa a IA para extrair memórias da conversa"""
-    if not client or not LLM_ENABLED:
-        return []
-    
-    try:
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": "Você extrai informações importantes de conversas. Responda APENAS em JSON válido."},
-                {"role": "user", "content": MEMORY_EXTRACTION_PROMPT.format(conversation=conversation_text)}
-            ],
-            max_tokens=500,
-            temperature=0.3,
-        )
-        
-        result = response.choices[0].message.content
-        
+        print(f"🔧 Executando ferramenta: {tool_name} com args: {arguments}")
+        future = _tool_executor.submit(execute_tool, tool_name, arguments, session_id, turn_messages)
+        pending.append((tool_call, tool_name, future))
+
+    results = []
+    for tool_call, tool_name, future in pending:
+        deadline = min(started + TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT_SECONDS), round_deadline)
         try:
-            if "{" in result and "}" in result:
-                json_str = result[result.find("{"):result.rfind("}")+1]
-                data = json.loads(json_str)
-                return data.get("memories", [])
-        except json.JSONDecodeError:
-            pass
-        
-        return []
-    except Exception as e:
-        print(f"Erro ao extrair memórias: {e}")
-        return []
+            tool_result = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"⏱️ Ferramenta {tool_name} passou do tempo, seguindo sem ela")
+            tool_result = f"A ferramenta {tool_name} demorou demais pra responder agora."
+        except Exception as e:
+            print(f"Erro executando ferramenta {tool_name}: {e}")
+            tool_result = f"Erro ao executar {tool_name}"
 
-def summarize_conversation(conversation_text):
-    """Cria um resumo da conversa para contexto infinito"""
-    if not client or not LLM_ENABLED:
-        return None
-    
-    try:
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": "Você resume conversas de forma concisa mantendo informações importantes."},
-                {"role": "user", "content": CONVERSATION_SUMMARY_PROMPT.format(conversation=conversation_text)}
-            ],
-            max_tokens=300,
-            temperature=0.3,
-        )
-        
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"Erro ao resumir conversa: {e}")
-        return None
+        results.append({
+            "role": "tool",
+            "tool_call_id": tool_call["id"],
+            "content": tool_result
+        })
 
-# ============== FUNÇÕES DE CONVERSAS ==============
+    if len(pending) > 1:
+        print(f"🔧 {len(pending)} ferramentas em {time.monotonic() - started:.2f}s")
+    return results
 
-def create_conversation(conversation_id, session_id, title='Nova conversa'):
-    """Cria uma nova conversa no banco"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO conversations (id, session_id, title, last_message, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            ON CONFLICT (id) DO NOTHING
-        """, (conversation_id, session_id, title, 'Nova conversa'))
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro create_conversation: {e}")
-        return False
+# ============== FUNÇÕES DE CONVERSAS ==============
 
 def get_conversation_by_session_id(session_id):
     """Busca a conversa mais recente de um session_id"""
@@ -1719,29 +1301,6 @@ def get_conversation_by_session_id(session_id):
         print(f"Erro get_conversation_by_session_id: {e}")
         return None
 
-def get_conversation_message_count(conversation_id):
-    """Conta quantas mensagens tem uma conversa"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return 0
-        cur = conn.cursor()
-        # Buscar session_id da conversa
-        cur.execute("SELECT session_id FROM conversations WHERE id = %s", (conversation_id,))
-        result = cur.fetchone()
-        if not result:
-            return 0
-        session_id = result[0]
-        # Contar mensagens
-        cur.execute("SELECT COUNT(*) FROM chat_history WHERE session_id = %s", (session_id,))
-        count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        return count
-    except Exception as e:
-        print(f"Erro get_conversation_message_count: {e}")
-        return 0
-
 def generate_conversation_title(user_message, bot_response):
     """Gera um título descritivo para a conversa baseado nas mensagens"""
     # Se a mensagem do usuário for muito curta, usar a resposta do bot
@@ -1764,75 +1323,15 @@ def generate_conversation_title(user_message, bot_response):
     
     return title[:50]  # Limitar a 50 caracteres
 
-def cleanup_orphan_conversations():
-    """Remove conversas que não têm mensagens associadas"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return 0
-        cur = conn.cursor()
-        
-        # Buscar todas as conversas
-        cur.execute("SELECT id, session_id FROM conversations")
-        conversations = cur.fetchall()
-        
-        deleted_count = 0
-        for conv_id, session_id in conversations:
-            # Verificar se tem mensagens
-            cur.execute("SELECT COUNT(*) FROM chat_history WHERE session_id = %s", (session_id,))
-            count = cur.fetchone()[0]
-            
-            if count == 0:
-                # Deletar conversa órfã
-                cur.execute("DELETE FROM conversations WHERE id = %s", (conv_id,))
-                deleted_count += 1
-                print(f"🗑️ Conversa órfã removida: {conv_id}")
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        if deleted_count > 0:
-            print(f"✅ {deleted_count} conversa(s) órfã(s) removida(s)")
-        
-        return deleted_count
-    except Exception as e:
-        print(f"Erro cleanup_orphan_conversations: {e}")
-        return 0
-
 def get_all_conversations(limit=50):
-    """Busca todas as conversas ordenadas por data de atualização"""
+    """Busca as conversas com mensagens, ordenadas por data de atualização (uma consulta só)"""
     try:
         conn = get_db_connection()
         if not conn:
             return []
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT id, session_id, title, last_message, created_at, updated_at
-            FROM conversations
-            ORDER BY updated_at DESC
-            LIMIT %s
-        """, (limit,))
-        conversations = cur.fetchall()
-        
-        result = []
-        for c in conversations:
-            # Contar mensagens da conversa
-            message_count = get_conversation_message_count(c['id'])
-            
-            # Só incluir se tiver mensagens (evitar mostrar conversas vazias)
-            if message_count > 0:
-                conv_data = {
-                    'id': c['id'],
-                    'sessionId': c['session_id'],
-                    'title': c['title'],
-                    'lastMessage': c['last_message'] or 'Nova conversa',
-                    'createdAt': c['created_at'].isoformat() if hasattr(c['created_at'], 'isoformat') else str(c['created_at']),
-                    'updatedAt': c['updated_at'].isoformat() if hasattr(c['updated_at'], 'isoformat') else str(c['updated_at']),
-                    'messageCount': message_count
-                }
-                result.append(conv_data)
-        
+        # Só conversas com mensagens (evitar mostrar conversas vazias)
+        result, _ = list_conversations(cur, limit=limit, skip_empty=True)
         cur.close()
         conn.close()
         return result
@@ -1840,72 +1339,6 @@ def get_all_conversations(limit=50):
         print(f"Erro get_all_conversations: {e}")
         return []
 
-def get_conversation_by_id(conversation_id):
-    """Busca uma conversa específica"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return None
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT id, session_id, title, last_message, created_at, updated_at
-            FROM conversations
-            WHERE id = %s
-        """, (conversation_id,))
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        if result:
-            return {
-                'id': result['id'],
-                'sessionId': result['session_id'],
-                'title': result['title'],
-                'lastMessage': result['last_message'] or 'Nova conversa',
-                'createdAt': result['created_at'].isoformat() if hasattr(result['created_at'], 'isoformat') else str(result['created_at']),
-                'updatedAt': result['updated_at'].isoformat() if hasattr(result['updated_at'], 'isoformat') else str(result['updated_at'])
-            }
-        return None
-    except Exception as e:
-        print(f"Erro get_conversation_by_id: {e}")
-        return None
-
-def update_conversation(conversation_id, title=None, last_message=None):
-    """Atualiza uma conversa"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if title:
-            updates.append("title = %s")
-            params.append(title)
-        if last_message:
-            updates.append("last_message = %s")
-            params.append(last_message)
-        
-        if not updates:
-            return True
-        
-        updates.append("updated_at = CURRENT_TIMESTAMP")
-        params.append(conversation_id)
-        
-        cur.execute(f"""
-            UPDATE conversations
-            SET {', '.join(updates)}
-            WHERE id = %s
-        """, params)
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro update_conversation: {e}")
-        return False
-
 def delete_conversation(conversation_id):
     """Deleta uma conversa e todo seu histórico"""
     try:
@@ -1925,6 +1358,7 @@ def delete_conversation(conversation_id):
         # Deletar histórico de mensagens
         if session_id:
             cur.execute("DELETE FROM chat_history WHERE session_id = %s", (session_id,))
+            cur.execute("DELETE FROM session_stats WHERE session_id = %s", (session_id,))
         
         conn.commit()
         cur.close()
@@ -1934,259 +1368,15 @@ def delete_conversation(conversation_id):
         print(f"Erro delete_conversation: {e}")
         return False
 
-def get_conversation_messages(session_id):
-    """Busca todas as mensagens de uma conversa"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return []
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT role, content, created_at
-            FROM chat_history
-            WHERE session_id = %s
-            ORDER BY created_at ASC
-        """, (session_id,))
-        messages = cur.fetchall()
-        cur.close()
-        conn.close()
-        return [
-            {
-                'id': idx,
-                'text': m['content'],
-                'sender': 'pablo' if m['role'] == 'admin' else ('matteo' if m['role'] == 'matteo_admin' else ('user' if m['role'] == 'user' else 'bot')),
-                'timestamp': m['created_at'].isoformat() if hasattr(m['created_at'], 'isoformat') else str(m['created_at'])
-            }
-            for idx, m in enumerate(messages, 1)
-        ]
-    except Exception as e:
-        print(f"Erro get_conversation_messages: {e}")
-        return []
-
-def analyze_user_writing_style(session_id):
-    """Analisa o estilo de escrita do usuário baseado nas mensagens anteriores"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return None
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Buscar últimas 50 mensagens do usuário
-        cur.execute("""
-            SELECT content FROM chat_history 
-            WHERE session_id = %s AND role = 'user'
-            ORDER BY created_at DESC 
-            LIMIT 50
-        """, (session_id,))
-        messages = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        if len(messages) < 5:
-            return None  # Precisa de pelo menos 5 mensagens para análise
-        
-        # Análise básica
-        total_length = 0
-        emoji_count = 0
-        caps_count = 0
-        total_chars = 0
-        word_list = []
-        punctuation_patterns = []
-        
-        # Emojis comuns
-        emoji_pattern = re.compile(r'[😀-🙏🌀-🗿🚀-🛿Ⓜ-🉑]+')
-        
-        for msg in messages:
-            content = msg['content']
-            total_length += len(content)
-            total_chars += len(content)
-            
-            # Contar emojis
-            emojis = emoji_pattern.findall(content)
-            emoji_count += len(emojis)
-            
-            # Contar caps
-            caps = sum(1 for c in content if c.isupper())
-            caps_count += caps
-            
-            # Palavras
-            words = re.findall(r'\b\w+\b', content.lower())
-            word_list.extend(words)
-            
-            # Pontuação
-            punct = re.findall(r'[!?.]+', content)
-            punctuation_patterns.extend(punct)
-        
-        # Calcular métricas
-        avg_length = total_length // len(messages)
-        emoji_freq = emoji_count / len(messages) if messages else 0
-        caps_freq = caps_count / total_chars if total_chars > 0 else 0
-        uses_emojis = emoji_freq > 0.3
-        uses_caps = caps_freq > 0.1
-        
-        # Palavras mais comuns (excluindo stop words)
-        stop_words = {'a', 'o', 'e', 'de', 'do', 'da', 'em', 'um', 'uma', 'que', 'pra', 'pro', 'com', 'na', 'no', 'é', 'tô', 'tá', 'vou', 'vai', 'ser', 'foi', 'são', 'tem', 'ter', 'me', 'te', 'se', 'ele', 'ela', 'eles', 'elas', 'eu', 'você', 'vocês', 'meu', 'minha', 'seu', 'sua', 'não', 'sim', 'kkk', 'kkkk', 'kkkkk'}
-        word_freq = {}
-        for word in word_list:
-            if word not in stop_words and len(word) > 2:
-                word_freq[word] = word_freq.get(word, 0) + 1
-        
-        common_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:10]
-        common_words_str = ', '.join([w[0] for w in common_words])
-        
-        # Estilo de pontuação
-        punct_style = 'expressivo' if '!' in ''.join(punctuation_patterns) else 'neutro'
-        if '?' in ''.join(punctuation_patterns):
-            punct_style = 'curioso'
-        
-        # Nível de formalidade (1=muito formal, 5=muito informal)
-        slang_words = {'kkk', 'kkkk', 'né', 'tipo', 'mano', 'véi', 'aí', 'pra', 'pro', 'tô', 'tá', 'vou', 'vai'}
-        slang_count = sum(1 for word in word_list if word in slang_words)
-        slang_usage = slang_count / len(word_list) if word_list else 0
-        formality = 5 - int(slang_usage * 4)  # Quanto mais gíria, mais informal
-        formality = max(1, min(5, formality))
-        
-        # Padrão de resposta
-        avg_response_length = avg_length
-        if avg_response_length < 20:
-            response_pattern = 'curto'
-        elif avg_response_length < 50:
-            response_pattern = 'médio'
-        else:
-            response_pattern = 'longo'
-        
-        # Criar resumo do estilo
-        style_parts = []
-        if uses_emojis:
-            style_parts.append('usa emojis frequentemente')
-        if uses_caps:
-            style_parts.append('usa maiúsculas para ênfase')
-        if formality <= 2:
-            style_parts.append('linguagem mais formal')
-        elif formality >= 4:
-            style_parts.append('linguagem muito informal e descontraída')
-        style_parts.append(f'respostas {response_pattern}s')
-        style_summary = ', '.join(style_parts)
-        
-        return {
-            'avg_message_length': avg_length,
-            'uses_emojis': uses_emojis,
-            'emoji_frequency': round(emoji_freq, 2),
-            'uses_caps': uses_caps,
-            'caps_frequency': round(caps_freq, 3),
-            'common_words': common_words_str,
-            'punctuation_style': punct_style,
-            'formality_level': formality,
-            'slang_usage': round(slang_usage, 3),
-            'response_pattern': response_pattern,
-            'style_summary': style_summary,
-            'message_count': len(messages)
-        }
-    except Exception as e:
-        print(f"Erro analyze_user_writing_style: {e}")
-        return None
-
-def save_user_writing_style(session_id, style_data):
-    """Salva ou atualiza o estilo de escrita do usuário"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        
-        cur.execute("""
-            INSERT INTO user_writing_style (
-                session_id, avg_message_length, uses_emojis, emoji_frequency,
-                uses_caps, caps_frequency, common_words, punctuation_style,
-                formality_level, slang_usage, response_pattern, style_summary,
-                message_count, last_analyzed, updated_at
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
-            )
-            ON CONFLICT (session_id) DO UPDATE SET
-                avg_message_length = EXCLUDED.avg_message_length,
-                uses_emojis = EXCLUDED.uses_emojis,
-                emoji_frequency = EXCLUDED.emoji_frequency,
-                uses_caps = EXCLUDED.uses_caps,
-                caps_frequency = EXCLUDED.caps_frequency,
-                common_words = EXCLUDED.common_words,
-                punctuation_style = EXCLUDED.punctuation_style,
-                formality_level = EXCLUDED.formality_level,
-                slang_usage = EXCLUDED.slang_usage,
-                response_pattern = EXCLUDED.response_pattern,
-                style_summary = EXCLUDED.style_summary,
-                message_count = EXCLUDED.message_count,
-                last_analyzed = EXCLUDED.last_analyzed,
-                updated_at = CURRENT_TIMESTAMP
-        """, (
-            session_id,
-            style_data['avg_message_length'],
-            style_data['uses_emojis'],
-            style_data['emoji_frequency'],
-            style_data['uses_caps'],
-            style_data['caps_frequency'],
-            style_data['common_words'],
-            style_data['punctuation_style'],
-            style_data['formality_level'],
-            style_data['slang_usage'],
-            style_data['response_pattern'],
-            style_data['style_summary'],
-            style_data['message_count']
-        ))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro save_user_writing_style: {e}")
-        return False
-
-def get_user_writing_style(session_id):
-    """Busca o estilo de escrita salvo do usuário"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return None
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT * FROM user_writing_style WHERE session_id = %s
-        """, (session_id,))
-        style = cur.fetchone()
-        cur.close()
-        conn.close()
-        return dict(style) if style else None
-    except Exception as e:
-        print(f"Erro get_user_writing_style: {e}")
-        return None
-
-def get_recent_responses(session_id, limit=10):
-    """Busca respostas recentes do Matteo para evitar repetições"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return []
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT content FROM chat_history 
-            WHERE session_id = %s AND role = 'assistant'
-            ORDER BY created_at DESC 
-            LIMIT %s
-        """, (session_id, limit))
-        responses = cur.fetchall()
-        cur.close()
-        conn.close()
-        return [r['content'] for r in responses]
-    except Exception as e:
-        print(f"Erro get_recent_responses: {e}")
-        return []
-
-def build_system_prompt_with_context(session_id, tpm_mode=False, is_admin_mode=False):
-    """Constrói o prompt do sistema com todo o contexto"""
-    memories = get_memories(limit=30)
+def build_system_prompt_with_context(session_id, tpm_mode=False, is_admin_mode=False, context=None):
+    """Constrói o prompt do sistema com todo o contexto (snapshot de load_chat_context)"""
+    if context is None:
+        context = load_chat_context(session_id)
+    
+    memories = context.memories
     
-    # Buscar respostas recentes para evitar repetições
-    recent_responses = get_recent_responses(session_id, limit=5)
+    # Respostas recentes para evitar repetições
+    recent_responses = context.recent_responses
     
     # Tempo atual (Brasil)
     now = datetime.now() - timedelta(hours=3)
@@ -2194,7 +1384,7 @@ def build_system_prompt_with_context(session_id, tpm_mode=False, is_admin_mode=F
     current_day = dias[now.weekday()]
     
     # Nível de intimidade
-    intimacy = get_intimacy_level(session_id)
+    intimacy = context.intimacy_level
     intimacy_desc = {
         1: "NOVO AMIGO - Seja acolhedor mas ainda formal",
         2: "AMIGO - Pode usar gírias e ser mais zoeiro",
@@ -2204,7 +1394,7 @@ def build_system_prompt_with_context(session_id, tpm_mode=False, is_admin_mode=F
     }.get(intimacy, "AMIGO")
     
     # Resumo de conversa anterior (se existir)
-    previous_summary = get_conversation_summary(session_id)
+    previous_summary = context.summary
     summary_section = ""
     if previous_summary:
         summary_section = f"""
@@ -2244,7 +1434,7 @@ IMPORTANTE NO MODO GRUPO:
 - Se o Pablo comentar algo, reaja e continue a conversa naturalmente
 """
     
-    context = f"""
+    context_section = f"""
 ════════════════════════════════════════════════════════════════════════════════
 ⏰ CONTEXTO ATUAL
 ════════════════════════════════════════════════════════════════════════════════
@@ -2254,7 +1444,7 @@ NÍVEL DE INTIMIDADE: {intimacy}/5 - {intimacy_desc}
 {admin_section}
 """
     
-    full_prompt = BASE_SYSTEM_PROMPT + context
+    full_prompt = BASE_SYSTEM_PROMPT + context_section
     
     # Modo TPM
     if tpm_mode:
@@ -2262,7 +1452,7 @@ NÍVEL DE INTIMIDADE: {intimacy}/5 - {intimacy_desc}
     
     # Memórias
     if memories:
-        memories_text = "\n".join([f"• {m}" for m in memories])
+        memories_text = "\n".join([f"• {m['memory']}" for m in memories])
         full_prompt += f"""
 ════════════════════════════════════════════════════════════════════════════════
 🧠 MEMÓRIAS SOBRE A GEHH
@@ -2270,21 +1460,10 @@ NÍVEL DE INTIMIDADE: {intimacy}/5 - {intimacy_desc}
 {memories_text}
 """
     
-    # Estilo de escrita do usuário
-    user_style = get_user_writing_style(session_id)
-    if not user_style:
-        # Analisar estilo se não existir
-        style_data = analyze_user_writing_style(session_id)
-        if style_data:
-            save_user_writing_style(session_id, style_data)
-            user_style = style_data
-    else:
-        # Re-analisar a cada 20 mensagens novas
-        if user_style.get('message_count', 0) % 20 == 0:
-            style_data = analyze_user_writing_style(session_id)
-            if style_data:
-                save_user_writing_style(session_id, style_data)
-                user_style = style_data
+    # Estilo de escrita do usuário (atualizado a cada mensagem dela, ver _writing_style.py)
+    user_style = context.writing_style
+    if user_style and user_style.get('message_count', 0) < STYLE_MIN_MESSAGES:
+        user_style = None
     
     if user_style:
         style_section = f"""
@@ -2330,6 +1509,164 @@ CRÍTICO: Use informações DIFERENTES e frases DIFERENTES. Varie completamente
     
     return full_prompt
 
+# ============== RODADAS DO MODELO ==============
+
+# Parâmetros de cada rodada; a última rodada permitida é sempre só texto (tool_choice="none")
+CHAT_ROUNDS = [
+    # 1ª: pode chamar ferramentas
+    dict(model=LLM_MODEL, tools=MATTEO_TOOLS, tool_choice="auto", max_tokens=400,
+         temperature=0.7, top_p=0.9, frequency_penalty=0.5, presence_penalty=0.3),
+    # 2ª: com os resultados das ferramentas, ainda pode chamar mais
+    dict(model=LLM_MODEL, tools=MATTEO_TOOLS, tool_choice="auto", max_tokens=500,
+         temperature=0.9, top_p=0.95, frequency_penalty=0.6, presence_penalty=0.4),
+    # 3ª: resposta final
+    dict(model=LLM_MODEL, tools=MATTEO_TOOLS, tool_choice="none", max_tokens=400,
+         temperature=0.85),
+]
+# Amostragem do modelo fallback (rate limit) em cada rodada
+CHAT_FALLBACK_OVERRIDES = [
+    dict(max_tokens=500, temperature=0.9, top_p=0.95, frequency_penalty=0.6, presence_penalty=0.4),
+    dict(max_tokens=400, temperature=0.85, top_p=0.9),
+    dict(max_tokens=400, temperature=0.85),
+]
+CHAT_MAX_ROUNDS = int(os.environ.get("CHAT_MAX_ROUNDS", len(CHAT_ROUNDS)))
+CHAT_MAX_TOKENS_PER_ROUND = int(os.environ.get("CHAT_MAX_TOKENS_PER_ROUND", 500))
+# Tempo total das chamadas ao modelo por mensagem (ferramentas incluídas); cabe no maxDuration de 60s do vercel.json
+CHAT_LLM_BUDGET_SECONDS = float(os.environ.get("CHAT_LLM_BUDGET_SECONDS", 40))
+
+
+def build_chat_tool_loop(session_id, turn_messages=None):
+    """Motor de rodadas do chat, com as ferramentas executando no contexto da sessão"""
+    return ToolLoop(
+        CHAT_ROUNDS,
+        execute_tools=lambda tool_calls: execute_tool_calls(
+            tool_calls, session_id=session_id, turn_messages=turn_messages,
+        ),
+        fallback_policy=RateLimitFallback(FALLBACK_MODEL, CHAT_FALLBACK_OVERRIDES),
+        max_rounds=CHAT_MAX_ROUNDS,
+        max_tokens_per_round=CHAT_MAX_TOKENS_PER_ROUND,
+        latency_budget_seconds=CHAT_LLM_BUDGET_SECONDS,
+    )
+
+RATE_LIMIT_SHORT_MESSAGE = "Desculpa princesa, tô com limite de uso agora. Tenta de novo em alguns minutos! 💙"
+
+
+def rate_limit_message(api_error):
+    """Mensagem para a Gehh quando o modelo principal e o fallback bateram no rate limit"""
+    error_str = str(api_error)
+    wait_time = "alguns minutos"
+    if "try again in" in error_str:
+        try:
+            match = re.search(r'try again in (\d+)m(\d+)', error_str)
+            if match:
+                wait_time = f"{match.group(1)} minutos"
+        except:
+            pass
+
+    return f"Oi princesa! 💙\n\nTô passando por um limite de uso agora (já usei muitos tokens hoje). O Pablo precisa aumentar o limite da API.\n\nTenta de novo em {wait_time}, tá bom? Ou manda uma mensagem pro Pablo pra ele resolver isso! 😅"
+
+
+def warn_if_repeating(bot_response, recent_responses):
+    """Avisa no log se a resposta repete muito as últimas (não bloqueia)"""
+    if not recent_responses:
+        return
+    # Verificar similaridade com respostas recentes
+    response_lower = bot_response.lower()
+    for recent in recent_responses:
+        recent_lower = recent.lower()
+        # Contar palavras em comum
+        response_words = set(response_lower.split())
+        recent_words = set(recent_lower.split())
+        common_words = response_words.intersection(recent_words)
+        # Se mais de 50% das palavras são iguais, pode ser repetição
+        if len(response_words) > 0 and len(common_words) / len(response_words) > 0.5:
+            print(f"⚠️ Resposta pode estar repetindo muito: {len(common_words)}/{len(response_words)} palavras em comum")
+            # Não bloquear, mas avisar - o modelo deve variar mais
+
+
+def message_preview(text):
+    """Prévia da última mensagem mostrada na lista de conversas"""
+    return text[:50] + ('...' if len(text) > 50 else '')
+
+
+def save_turn_and_conversation(session_id, conversation_id, user_message, bot_response, tool_messages=(),
+                               learn=False, used_memory_ids=(), speaker_role=None):
+    """
+    Grava as mensagens das ferramentas (ex: "Chamando o Pablo") e a resposta
+    do Matteo, cria/atualiza a conversa, marca as memórias usadas no prompt
+    e (se learn) agenda memórias e resumo para depois da resposta, numa transação só
+    (ver _chat_turn.py). A mensagem de quem falou já foi salva antes do
+    modelo; se aquele save falhou, speaker_role faz ela entrar aqui junto.
+    Retorna o conversation_id final (o recebido, se não conseguiu salvar: a
+    resposta ainda vai para a Gehh).
+    """
+    speaker = [(speaker_role, user_message)] if speaker_role else []
+    try:
+        conversation_id, _ = save_chat_turn(
+            session_id,
+            [*speaker, *tool_messages, ('assistant', bot_response)],
+            conversation_id or f"conv_{session_id}_{int(datetime.now().timestamp())}",
+            title=generate_conversation_title(user_message, bot_response),
+            last_message=message_preview(bot_response),
+            learn=learn,
+            used_memory_ids=used_memory_ids,
+        )
+    except Exception as e:
+        print(f"❌ Erro ao salvar a rodada (a resposta segue sem ser salva): {e}")
+        return conversation_id
+    print(f"✅ Rodada salva na conversa {conversation_id}")
+    return conversation_id
+
+
+def run_after_reply(tools_used, learn):
+    """
+    O que fica para depois da resposta já enviada: o e-mail do call_pablo
+    (outbox) e o aprendizado agendado na rodada. O /api/cron pega o que não
+    terminar aqui.
+    """
+    if 'call_pablo' in tools_used:
+        deliver_after_response()
+    if learn:
+        learn_after_response()
+
+
+def build_chat_response_data(bot_response, session_id, conversation_id, tools_used, group_mode,
+                             status='success', pablo_message=None):
+    """Monta o corpo da resposta do chat (o mesmo no JSON e no evento final do streaming)"""
+    # Se foi mensagem do Pablo, retornar também a mensagem dele junto com a resposta do Matteo
+    # Isso permite que o frontend mostre ambas as mensagens
+    if pablo_message:
+        return {
+            'messages': [
+                {
+                    'response': pablo_message,
+                    'sender': 'pablo',
+                    'status': 'admin_message'
+                },
+                {
+                    'response': bot_response,
+                    'sender': 'matteo',
+                    'status': status,
+                    'tools_used': tools_used
+                }
+            ],
+            'session_id': session_id,
+            'conversation_id': conversation_id,
+            'tools_used': tools_used,
+            'group_mode': True,
+            'is_multiple': True  # Indica que são múltiplas mensagens
+        }
+
+    return {
+        'response': bot_response,
+        'session_id': session_id,
+        'conversation_id': conversation_id,
+        'tools_used': tools_used,
+        'status': status,
+        'sender': 'matteo',  # Sempre retorna como Matteo quando é resposta da IA
+        'group_mode': group_mode  # Indica se está em modo grupo
+    }
+
 # ============== HANDLER ==============
 
 class handler(BaseHTTPRequestHandler):
@@ -2342,6 +1679,106 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Max-Age', '3600')
         self.end_headers()
 
+    def _start_event_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.end_headers()
+
+    def _send_event(self, event, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _stream_reply(self, messages, session_id, conversation_id, user_message, chat_context,
+                      group_mode=False, pablo_message=None, speaker_role=None):
+        """
+        Responde em Server-Sent Events. As rodadas de ferramentas acontecem
+        antes; o texto da resposta final sai token a token, já limpo (se o
+        modelo responder numa rodada que ainda podia chamar ferramentas, o
+        texto chega inteiro dessa rodada e sai pelo mesmo caminho).
+
+        Eventos:
+            tool   {"name"}                        ferramenta sendo executada
+            token  {"text"}                        pedaço da resposta
+            done   mesmo corpo do modo JSON        (session_id, conversation_id, tools_used, group_mode...)
+            error  {"error", "message"}
+
+        O "response" do done é a resposta final salva no banco; só difere do
+        que foi enviado nos tokens se a resposta caiu num fallback (vazia/curta).
+        """
+        self._start_event_stream()
+        sanitizer = StreamingSanitizer()
+        status = 'success'
+        turn_messages = []
+        disconnected = []
+
+        def send(event, data):
+            # Cliente que foi embora não interrompe a rodada: a resposta ainda é salva
+            if disconnected:
+                return
+            try:
+                self._send_event(event, data)
+            except (BrokenPipeError, ConnectionResetError, OSError) as e:
+                print(f"⚠️ Cliente desconectou no meio do streaming: {e}")
+                disconnected.append(True)
+
+        def on_text(text):
+            cleaned = sanitizer.feed(text)
+            if cleaned:
+                send('token', {'text': cleaned})
+
+        try:
+            result = build_chat_tool_loop(session_id, turn_messages).run(
+                messages,
+                on_text=on_text,
+                on_tool=lambda tool_name: send('tool', {'name': tool_name}),
+            )
+            tools_used = result.tools_used
+
+            if result.stop_reason == STOP_ERROR and not result.rounds:
+                # Modelo principal e fallback bateram no rate limit
+                status = 'rate_limit_error'
+                bot_response = rate_limit_message(result.error)
+                send('token', {'text': bot_response})
+            else:
+                if result.error and not result.content:
+                    on_text(RATE_LIMIT_SHORT_MESSAGE)
+                tail = sanitizer.finish()
+                if tail:
+                    send('token', {'text': tail})
+                bot_response = sanitizer.text
+                warn_if_repeating(bot_response, chat_context.recent_responses[:3])
+
+            # Memórias e resumo ficam agendados na mesma transação; rodam depois do done (run_after_reply)
+            conversation_id = save_turn_and_conversation(
+                session_id, conversation_id, user_message, bot_response, tool_messages=turn_messages,
+                learn=status == 'success', used_memory_ids=chat_context.used_memory_ids,
+                speaker_role=speaker_role,
+            )
+            send('done', build_chat_response_data(
+                bot_response, session_id, conversation_id, tools_used, group_mode,
+                status=status, pablo_message=pablo_message,
+            ))
+            print(f"✅ Resposta enviada (streaming): {bot_response[:50]}...")
+            run_after_reply(tools_used, learn=status == 'success')
+        except Exception as e:
+            import traceback
+            print(f"❌ Erro no streaming do Matteo: {str(e)}")
+            print(f"📋 Stack trace: {traceback.format_exc()}")
+            try:
+                self._send_event('error', {
+                    'error': str(e),
+                    'status': 'error',
+                    'message': 'Desculpe, tive um probleminha aqui! Tenta de novo? 🥺'
+                })
+            except Exception:
+                pass  # Cliente já desconectou
+            return
+
     def do_POST(self):
         """Processar mensagem do chat"""
         print(f"🔵 POST recebido em: {self.path}")
@@ -2362,6 +1799,8 @@ class handler(BaseHTTPRequestHandler):
             tpm_mode = data.get('tpm_mode', False)
             is_admin = data.get('is_admin', False)
             sender = data.get('sender', 'gehh')  # 'gehh', 'matteo' ou 'pablo' (apenas para admin)
+            # Streaming (SSE) é opcional: pelo header Accept ou por "stream": true no corpo
+            wants_stream = data.get('stream') is True or 'text/event-stream' in self.headers.get('Accept', '')
             
             # Validações
             if not session_id or not isinstance(session_id, str) or len(session_id.strip()) == 0:
@@ -2385,79 +1824,25 @@ class handler(BaseHTTPRequestHandler):
                 }, ensure_ascii=False).encode('utf-8'))
                 return
             
-            # MODO ADMIN - GRUPO: Se admin enviou como Pablo, salvar e processar com IA
-            # Mas primeiro retornar a mensagem do Pablo para o frontend
-            pablo_message_sent = False
-            pablo_message_content = None
-            if is_admin and sender == 'pablo':
-                try:
-                    init_db()
-                    # Salvar mensagem como 'admin' (Pablo)
-                    save_chat_message(session_id, 'admin', user_message)
-                    print(f"✅ Mensagem do Pablo salva: {user_message[:50]}...")
-                    pablo_message_sent = True
-                    pablo_message_content = user_message
-                    
-                    # Atualizar conversa se existir
-                    if conversation_id:
-                        conv = get_conversation_by_id(conversation_id)
-                        if conv:
-                            update_conversation(conversation_id, last_message=user_message[:50] + ('...' if len(user_message) > 50 else ''))
-                    else:
-                        # Buscar conversa existente ou criar nova
-                        existing_conv = get_conversation_by_session_id(session_id)
-                        if existing_conv:
-                            conversation_id = existing_conv['id']
-                            update_conversation(conversation_id, last_message=user_message[:50] + ('...' if len(user_message) > 50 else ''))
-                        else:
-                            conversation_id = f"conv_{session_id}_{int(datetime.now().timestamp())}"
-                            title = generate_conversation_title(user_message, "")
-                            create_conversation(conversation_id, session_id, title)
-                            update_conversation(conversation_id, last_message=user_message[:50] + ('...' if len(user_message) > 50 else ''))
-                    
-                    # Continua o fluxo para processar com IA e gerar resposta do Matteo
-                except Exception as e:
-                    print(f"⚠️ Erro ao salvar mensagem do admin: {e}")
-                    pablo_message_sent = False
-                    pablo_message_content = None
-                    # Continua para processar normalmente se der erro
+            # MODO ADMIN - GRUPO: Se admin enviou como Pablo, processar com IA
+            # A mensagem dele é salva como 'admin' e volta para o frontend junto com a resposta
+            is_pablo_message = is_admin and sender == 'pablo'
+            turn_role = 'admin' if is_pablo_message else 'user'
             
             # MODO ADMIN: Se admin enviou como Matteo, apenas salvar e retornar
             if is_admin and sender == 'matteo':
                 try:
-                    init_db()
-                    # Validar que a mensagem não está vazia
-                    if not user_message or not user_message.strip():
-                        self.send_response(400)
-                        self.send_header('Content-Type', 'application/json; charset=utf-8')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({
-                            'error': 'Mensagem vazia',
-                            'status': 'error'
-                        }, ensure_ascii=False).encode('utf-8'))
-                        return
-                    
+                    ensure_schema()
                     # Salvar mensagem com role especial 'matteo_admin' para identificar que foi o admin
                     # Isso permite distinguir de mensagens reais do Matteo (IA)
-                    save_chat_message(session_id, 'matteo_admin', user_message)
-                    
-                    # Atualizar conversa se existir
-                    if conversation_id:
-                        conv = get_conversation_by_id(conversation_id)
-                        if conv:
-                            update_conversation(conversation_id, last_message=user_message[:50] + ('...' if len(user_message) > 50 else ''))
-                    else:
-                        # Buscar conversa existente ou criar nova
-                        existing_conv = get_conversation_by_session_id(session_id)
-                        if existing_conv:
-                            conversation_id = existing_conv['id']
-                            update_conversation(conversation_id, last_message=user_message[:50] + ('...' if len(user_message) > 50 else ''))
-                        else:
-                            conversation_id = f"conv_{session_id}_{int(datetime.now().timestamp())}"
-                            title = generate_conversation_title(user_message, "")
-                            create_conversation(conversation_id, session_id, title)
-                            update_conversation(conversation_id, last_message=user_message[:50] + ('...' if len(user_message) > 50 else ''))
+                    # Mensagem e conversa numa transação só (ver _chat_turn.py)
+                    conversation_id, _ = save_chat_turn(
+                        session_id,
+                        [('matteo_admin', user_message)],
+                        conversation_id or f"conv_{session_id}_{int(datetime.now().timestamp())}",
+                        title=generate_conversation_title(user_message, ""),
+                        last_message=message_preview(user_message),
+                    )
                     
                     # Retornar resposta imediata (sem processar com IA)
                     self.send_response(200)
@@ -2487,14 +1872,8 @@ class handler(BaseHTTPRequestHandler):
             # O fluxo continua normalmente abaixo para processar com IA
             
             # Verificar se LLM está disponível
-            if not LLM_ENABLED or not client:
-                error_details = []
-                if not OPENAI_AVAILABLE:
-                    error_details.append("Biblioteca OpenAI não instalada")
-                if not MISTRAL_API_KEY:
-                    error_details.append("MISTRAL_API_KEY não configurada")
-                if MISTRAL_API_KEY and not client:
-                    error_details.append("Erro ao conectar com Mistral")
+            if not llm_available():
+                error_details = llm_unavailable_reasons()
                 
                 print(f"⚠️ LLM não disponível: {', '.join(error_details)}")
                 
@@ -2516,26 +1895,29 @@ class handler(BaseHTTPRequestHandler):
                 }, ensure_ascii=False).encode('utf-8'))
                 return
             
-            # Inicializar banco (com tratamento de erro)
-            # Não salvar mensagem do usuário se já foi salva como admin (Pablo)
-            if not (is_admin and sender == 'pablo'):
-                try:
-                    init_db()
-                    # Salvar mensagem do usuário
-                    save_chat_message(session_id, 'user', user_message)
-                except Exception as e:
-                    print(f"⚠️ Erro ao salvar no banco: {e}")
-                    # Continua mesmo sem salvar
+            # Inicializar banco e salvar a mensagem de quem falou antes de chamar o modelo
+            # (numa transação curta: se o modelo falhar ela não se perde, e o NOTIFY já
+            # mostra a mensagem para quem está em /api/live)
+            message_saved = False
+            try:
+                ensure_schema()
+                message_saved = save_chat_message(session_id, turn_role, user_message)
+            except Exception as e:
+                print(f"⚠️ Erro ao salvar no banco: {e}")
+                # Continua mesmo sem salvar
             
-            # Buscar histórico
-            history = get_chat_history(session_id, limit=30)
+            # Buscar todo o contexto da sessão (histórico, modo grupo, estilo...) de uma vez, com as
+            # memórias relevantes para o que ela disse (e as últimas falas) na mesma conexão,
+            # dentro do orçamento de tokens, em vez das 30 mais importantes sempre
+            chat_context = load_chat_context(session_id, history_limit=30, message=user_message)
+            history = chat_context.history
             
             # Detectar modo grupo automaticamente (se já tem mensagens do Pablo)
-            is_group_mode_detected = check_if_group_mode_active(session_id)
+            is_group_mode_detected = chat_context.group_mode_active
             is_group_mode = is_admin or is_group_mode_detected
             
             # Construir prompt com contexto completo
-            system_prompt = build_system_prompt_with_context(session_id, tpm_mode=tpm_mode, is_admin_mode=is_group_mode)
+            system_prompt = build_system_prompt_with_context(session_id, tpm_mode=tpm_mode, is_admin_mode=is_group_mode, context=chat_context)
             
             # Criar mensagens para API
             messages = [{'role': 'system', 'content': system_prompt}]
@@ -2567,511 +1949,53 @@ class handler(BaseHTTPRequestHandler):
                         'content': content
                     })
             
-            # Se a mensagem atual é do Pablo, adicionar ao contexto das mensagens
-            if is_admin and sender == 'pablo':
-                messages.append({
-                    'role': 'user',
-                    'content': f"[Pablo disse]: {user_message}"
-                })
-            elif not (is_admin and sender == 'pablo'):
-                # Adicionar mensagem atual do usuário (Gehh)
+            # A mensagem atual já veio no histórico se foi salva; senão, adicionar ao contexto
+            if not message_saved:
                 messages.append({
                     'role': 'user',
-                    'content': user_message
+                    'content': f"[Pablo disse]: {user_message}" if is_pablo_message else user_message
                 })
             
-            # Primeira chamada - com ferramentas
-            # Reduzir max_tokens para economizar (de 500 para 400)
-            try:
-                response = client.chat.completions.create(
-                    model=LLM_MODEL,
-                    messages=messages,
-                    tools=MATTEO_TOOLS,
-                    tool_choice="auto",
-                    max_tokens=400,  # Balanceado para respostas completas mas não muito longas
-                    temperature=0.7,  # Balanceado - criativo mas consistente
-                    top_p=0.9,  # Boa variedade sem ser muito aleatório
-                    frequency_penalty=0.5,  # Penaliza repetição de tokens
-                    presence_penalty=0.3,  # Penaliza repetição de tópicos
+            if wants_stream:
+                self._stream_reply(
+                    messages, session_id, conversation_id, user_message, chat_context,
+                    group_mode=is_group_mode_detected or is_admin,
+                    pablo_message=user_message if is_pablo_message else None,
+                    speaker_role=None if message_saved else turn_role,
                 )
-            except Exception as api_error:
-                # Tratar rate limit especificamente
-                error_str = str(api_error)
-                if "429" in error_str or "rate_limit" in error_str.lower() or "RateLimitError" in str(type(api_error)):
-                    print(f"⚠️ Rate limit atingido com {LLM_MODEL}, tentando modelo fallback: {FALLBACK_MODEL}")
-                    
-                    # Tentar usar modelo fallback (menor, consome menos tokens)
-                    try:
-                        response = client.chat.completions.create(
-                            model=FALLBACK_MODEL,
-                            messages=messages,
-                            tools=MATTEO_TOOLS,
-                            tool_choice="auto",
-                            max_tokens=500,
-                            temperature=0.9,
-                            top_p=0.95,
-                            frequency_penalty=0.6,
-                            presence_penalty=0.4,
-                        )
-                        print(f"✅ Usando modelo fallback {FALLBACK_MODEL} com sucesso!")
-                    except Exception as fallback_error:
-                        # Se fallback também falhar, retornar mensagem de erro
-                        print(f"❌ Fallback também falhou: {fallback_error}")
-                        wait_time = "alguns minutos"
-                        if "try again in" in error_str:
-                            try:
-                                match = re.search(r'try again in (\d+)m(\d+)', error_str)
-                                if match:
-                                    wait_time = f"{match.group(1)} minutos"
-                            except:
-                                pass
-                        
-                        bot_response = f"Oi princesa! 💙\n\nTô passando por um limite de uso agora (já usei muitos tokens hoje). O Pablo precisa aumentar o limite da API.\n\nTenta de novo em {wait_time}, tá bom? Ou manda uma mensagem pro Pablo pra ele resolver isso! 😅"
-                        
-                        # Salvar mensagem do usuário e resposta mesmo com erro de rate limit
-                        # Não salvar mensagem do usuário se já foi salva antes (admin como Pablo ou já salva anteriormente)
-                        try:
-                            # Verificar se mensagem do usuário já foi salva (não salvar se for admin como Pablo)
-                            if not (is_admin and sender == 'pablo'):
-                                save_chat_message(session_id, 'user', user_message)
-                            save_chat_message(session_id, 'assistant', bot_response)
-                            
-                            # Criar ou atualizar conversa APENAS se o bot respondeu
-                            title = generate_conversation_title(user_message, bot_response)
-                            last_message_preview = bot_response[:50] + ('...' if len(bot_response) > 50 else '')
-                            
-                            if not conversation_id:
-                                # Verificar se já existe conversa para este session_id
-                                existing_conv = get_conversation_by_session_id(session_id)
-                                if existing_conv:
-                                    conversation_id = existing_conv['id']
-                                else:
-                                    conversation_id = f"conv_{session_id}_{int(datetime.now().timestamp())}"
-                            
-                            conv = get_conversation_by_id(conversation_id)
-                            if conv:
-                                update_conversation(conversation_id, last_message=last_message_preview)
-                            else:
-                                create_conversation(conversation_id, session_id, title)
-                                update_conversation(conversation_id, last_message=last_message_preview)
-                        except:
-                            pass
-                        
-                        # Se foi mensagem do Pablo, retornar também ela junto com o erro
-                        if pablo_message_sent and pablo_message_content:
-                            response_data = {
-                                'messages': [
-                                    {
-                                        'response': pablo_message_content,
-                                        'sender': 'pablo',
-                                        'status': 'admin_message'
-                                    },
-                                    {
-                                        'response': bot_response,
-                                        'sender': 'matteo',
-                                        'status': 'rate_limit_error'
-                                    }
-                                ],
-                                'session_id': session_id,
-                                'conversation_id': conversation_id,
-                                'group_mode': True,
-                                'is_multiple': True
-                            }
-                        else:
-                            response_data = {
-                                'response': bot_response,
-                                'session_id': session_id,
-                                'conversation_id': conversation_id,
-                                'status': 'rate_limit_error',
-                                'sender': 'matteo'
-                            }
-                        
-                        # Retornar resposta de rate limit
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json; charset=utf-8')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-                        self.end_headers()
-                        self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
-                        return
-                else:
-                    # Outros erros da API - re-lançar para tratamento geral
-                    raise api_error
-            
-            response_message = response.choices[0].message
-            bot_response = response_message.content or ""
-            
-            # Verificar se precisa executar ferramentas
-            if response_message.tool_calls:
-                # Adicionar resposta do assistente com tool_calls
-                messages.append({
-                    "role": "assistant",
-                    "content": response_message.content,
-                    "tool_calls": [
-                        {
-                            "id": tc.id,
-                            "type": "function",
-                            "function": {
-                                "name": tc.function.name,
-                                "arguments": tc.function.arguments
-                            }
-                        } for tc in response_message.tool_calls
-                    ]
-                })
-                
-                # Executar cada ferramenta
-                for tool_call in response_message.tool_calls:
-                    tool_name = tool_call.function.name
-                    try:
-                        arguments = json.loads(tool_call.function.arguments)
-                    except:
-                        arguments = {}
-                    
-                    print(f"🔧 Executando ferramenta: {tool_name} com args: {arguments}")
-                    tool_result = execute_tool(tool_name, arguments, session_id=session_id)
-                    
-                    # Adicionar resultado da ferramenta
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": tool_result
-                    })
-                
-                # Segunda chamada - com resultados das ferramentas
-                # IMPORTANTE: Precisamos passar tools novamente, mesmo na segunda chamada
-                    try:
-                        final_response = client.chat.completions.create(
-                            model=LLM_MODEL,
-                            messages=messages,
-                            tools=MATTEO_TOOLS,  # Passar tools novamente para evitar erro 400
-                            tool_choice="auto",  # Permitir usar ferramentas novamente se necessário
-                            max_tokens=500,  # Aumentado para respostas mais completas
-                            temperature=0.9,  # Aumentado para mais criatividade
-                            top_p=0.95,  # Aumentado para mais variedade
-                            frequency_penalty=0.6,  # Penaliza repetição de tokens
-                            presence_penalty=0.4,  # Penaliza repetição de tópicos
-                        )
-                        bot_response = final_response.choices[0].message.content or ""
-                    except Exception as api_error:
-                        # Se der rate limit na segunda chamada, tentar fallback
-                        error_str = str(api_error)
-                        if "429" in error_str or "rate_limit" in error_str.lower() or "RateLimitError" in str(type(api_error)):
-                            print(f"⚠️ Rate limit na segunda chamada, tentando fallback")
-                            try:
-                                final_response = client.chat.completions.create(
-                                    model=FALLBACK_MODEL,
-                                    messages=messages,
-                                    tools=MATTEO_TOOLS,
-                                    tool_choice="auto",
-                                    max_tokens=400,
-                                    temperature=0.85,
-                                    top_p=0.9,
-                                )
-                                bot_response = final_response.choices[0].message.content or ""
-                            except:
-                                bot_response = response_message.content or "Desculpa princesa, tô com limite de uso agora. Tenta de novo em alguns minutos! 💙"
-                        else:
-                            raise api_error
-                
-                # Se ainda houver tool_calls na resposta final, executar também
-                if final_response.choices[0].message.tool_calls:
-                    print(f"🔧 Segunda rodada de ferramentas detectada")
-                    # Adicionar resposta do assistente
-                    messages.append({
-                        "role": "assistant",
-                        "content": bot_response,
-                        "tool_calls": [
-                            {
-                                "id": tc.id,
-                                "type": "function",
-                                "function": {
-                                    "name": tc.function.name,
-                                    "arguments": tc.function.arguments
-                                }
-                            } for tc in final_response.choices[0].message.tool_calls
-                        ]
-                    })
-                    
-                    # Executar ferramentas adicionais
-                    for tool_call in final_response.choices[0].message.tool_calls:
-                        tool_name = tool_call.function.name
-                        try:
-                            arguments = json.loads(tool_call.function.arguments)
-                        except:
-                            arguments = {}
-                        
-                        print(f"🔧 Executando ferramenta adicional: {tool_name}")
-                        tool_result = execute_tool(tool_name, arguments, session_id=session_id)
-                        
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": tool_result
-                        })
-                    
-                    # Terceira chamada (se necessário)
-                    try:
-                        third_response = client.chat.completions.create(
-                            model=LLM_MODEL,
-                            messages=messages,
-                            tools=MATTEO_TOOLS,
-                            tool_choice="none",  # Forçar resposta final sem mais ferramentas
-                            max_tokens=400,  # Reduzido para economizar tokens
-                            temperature=0.85,
-                        )
-                        bot_response = third_response.choices[0].message.content or ""
-                    except Exception as api_error:
-                        # Se der rate limit na terceira chamada, tentar fallback
-                        error_str = str(api_error)
-                        if "429" in error_str or "rate_limit" in error_str.lower() or "RateLimitError" in str(type(api_error)):
-                            print(f"⚠️ Rate limit na terceira chamada, tentando fallback")
-                            try:
-                                third_response = client.chat.completions.create(
-                                    model=FALLBACK_MODEL,
-                                    messages=messages,
-                                    tools=MATTEO_TOOLS,
-                                    tool_choice="none",
-                                    max_tokens=400,
-                                    temperature=0.85,
-                                )
-                                bot_response = third_response.choices[0].message.content or ""
-                            except:
-                                # bot_response já está definido da chamada anterior
-                                pass
-                        else:
-                            raise api_error
-            
-            # Limpar e filtrar resposta
-            bot_response = bot_response.strip()
-            
-            # Remover asteriscos e markdown
-            bot_response = re.sub(r'\*[^*]+\*', '', bot_response).strip()
-            bot_response = re.sub(r'\[.*?\]\(.*?\)', '', bot_response).strip()  # Remove markdown links
-            bot_response = re.sub(r'#{1,6}\s+', '', bot_response).strip()  # Remove headers markdown
-            
-            # Remover prefixos comuns que podem aparecer
-            prefixes_to_remove = ['matteo:', 'assistant:', 'ai:', 'bot:']
-            for prefix in prefixes_to_remove:
-                if bot_response.lower().startswith(prefix):
-                    bot_response = bot_response[len(prefix):].strip()
-            
-            # Remover frases estranhas que podem aparecer
-            strange_patterns = [
-                r'^como posso ajudar.*?\?',
-                r'^olá.*?\!',
-                r'^oi.*?\!',
-                r'^eu sou.*?matteo',
-                r'^sou o.*?matteo',
-                r'^meu nome é.*?matteo',
-            ]
-            for pattern in strange_patterns:
-                bot_response = re.sub(pattern, '', bot_response, flags=re.IGNORECASE).strip()
-            
-            # Remover múltiplos espaços
-            bot_response = re.sub(r'\s+', ' ', bot_response).strip()
-            
-            # Remover emojis excessivos (mais de 1)
-            emoji_pattern = re.compile(r'[😀-🙏🌀-🗿🚀-🛿Ⓜ-🉑]+')
-            emojis = emoji_pattern.findall(bot_response)
-            if len(emojis) > 1:
-                # Manter apenas o primeiro emoji
-                for i, emoji in enumerate(emojis):
-                    if i > 0:
-                        bot_response = bot_response.replace(emoji, '', 1)
-                bot_response = re.sub(r'\s+', ' ', bot_response).strip()
-            
-            # Validar que temos uma resposta válida do bot
-            if not bot_response or len(bot_response.strip()) < 3:
-                print("⚠️ Resposta do bot vazia ou muito curta, não criando/atualizando conversa")
-                bot_response = "Desculpa princesa, não consegui processar isso agora. Pode repetir?"
-            
-            # Garantir que não começa com pontuação estranha
-            if bot_response and bot_response[0] in ['.', ',', '!', '?', ':']:
-                bot_response = bot_response[1:].strip()
-            
-            # Remover frases genéricas/robóticas no início
-            generic_phrases = [
-                'como posso ajudar',
-                'olá',
-                'oi,',
-                'oi!',
-                'eu sou',
-                'sou o',
-                'meu nome é',
-                'sou uma ia',
-                'eu sou uma ia',
-                'sou o matteo',
-                'eu sou o matteo',
-            ]
-            for phrase in generic_phrases:
-                if bot_response.lower().startswith(phrase):
-                    # Encontrar primeira pontuação e remover até lá
-                    for punct in ['.', '!', '?', '\n']:
-                        idx = bot_response.find(punct)
-                        if idx > 0:
-                            bot_response = bot_response[idx+1:].strip()
-                            break
-                    # Se não encontrou pontuação, remover a frase inteira
-                    if bot_response.lower().startswith(phrase):
-                        words = bot_response.split()
-                        # Remover primeiras palavras que formam a frase genérica
-                        phrase_words = phrase.split()
-                        if len(words) >= len(phrase_words):
-                            bot_response = ' '.join(words[len(phrase_words):]).strip()
-                    break
-            
-            # Remover múltiplos espaços novamente
-            bot_response = re.sub(r'\s+', ' ', bot_response).strip()
-            
-            # Validar comprimento final
-            if len(bot_response) < 10:
-                bot_response = "Desculpa princesa, não consegui processar isso direito. Pode repetir?"
-            elif len(bot_response) > 500:
-                # Truncar se muito longa, mantendo sentido
-                bot_response = bot_response[:497] + "..."
-            
-            # Verificar se está repetindo muito as últimas respostas
-            recent_responses = get_recent_responses(session_id, limit=3)
-            if recent_responses:
-                # Verificar similaridade com respostas recentes
-                response_lower = bot_response.lower()
-                for recent in recent_responses:
-                    recent_lower = recent.lower()
-                    # Contar palavras em comum
-                    response_words = set(response_lower.split())
-                    recent_words = set(recent_lower.split())
-                    common_words = response_words.intersection(recent_words)
-                    # Se mais de 50% das palavras são iguais, pode ser repetição
-                    if len(response_words) > 0 and len(common_words) / len(response_words) > 0.5:
-                        print(f"⚠️ Resposta pode estar repetindo muito: {len(common_words)}/{len(response_words)} palavras em comum")
-                        # Não bloquear, mas avisar - o modelo deve variar mais
+                return
             
-            # Salvar resposta (com tratamento de erro)
-            try:
-                save_chat_message(session_id, 'assistant', bot_response)
-                
-                # AGORA SIM: Criar ou atualizar conversa APENAS se o bot respondeu com sucesso
-                try:
-                    # Gerar título descritivo
-                    title = generate_conversation_title(user_message, bot_response)
-                    last_message_preview = bot_response[:50] + ('...' if len(bot_response) > 50 else '')
-                    
-                    # Se conversation_id foi fornecido, verificar se existe
-                    if conversation_id:
-                        conv = get_conversation_by_id(conversation_id)
-                        if conv:
-                            # Conversa existe, apenas atualizar
-                            update_conversation(conversation_id, last_message=last_message_preview)
-                            # Atualizar título se for muito genérico ou se a conversa for nova (menos de 3 mensagens)
-                            message_count = get_conversation_message_count(conversation_id)
-                            if message_count <= 2 or conv['title'] == 'Nova conversa' or len(conv['title']) < 10:
-                                update_conversation(conversation_id, title=title)
-                        else:
-                            # Conversa não existe, criar nova
-                            create_conversation(conversation_id, session_id, title)
-                            update_conversation(conversation_id, last_message=last_message_preview)
-                    else:
-                        # Não tem conversation_id, verificar se já existe conversa ativa para este session_id
-                        existing_conv = get_conversation_by_session_id(session_id)
-                        
-                        if existing_conv:
-                            # Usar conversa existente
-                            conversation_id = existing_conv['id']
-                            update_conversation(conversation_id, last_message=last_message_preview)
-                            # Atualizar título se necessário
-                            message_count = get_conversation_message_count(conversation_id)
-                            if message_count <= 2 or existing_conv['title'] == 'Nova conversa' or len(existing_conv['title']) < 10:
-                                update_conversation(conversation_id, title=title)
-                            print(f"✅ Conversa existente atualizada: {conversation_id}")
-                        else:
-                            # Criar nova conversa
-                            conversation_id = f"conv_{session_id}_{int(datetime.now().timestamp())}"
-                            create_conversation(conversation_id, session_id, title)
-                            update_conversation(conversation_id, last_message=last_message_preview)
-                            print(f"✅ Nova conversa criada: {conversation_id} - {title}")
-                except Exception as e:
-                    print(f"⚠️ Erro ao criar/atualizar conversa: {e}")
-                    # Continua mesmo sem salvar conversa
-            except Exception as e:
-                print(f"⚠️ Erro ao salvar resposta: {e}")
-                # Continua mesmo sem salvar
+            # Rodadas com o modelo (ferramentas incluídas), dentro do orçamento de tempo
+            turn_messages = []
+            result = build_chat_tool_loop(session_id, turn_messages).run(messages)
             
-            # Extração de memórias (a cada 5 mensagens) - com tratamento de erro
-            try:
-                total_msgs = get_total_messages()
-            except:
-                total_msgs = 0
-                
-            if total_msgs > 0 and total_msgs % 5 == 0:
-                recent_history = get_chat_history(session_id, limit=10)
-                conversation_text = "\n".join([
-                    f"{'Gehh' if m['role']=='user' else 'Matteo'}: {m['content']}" 
-                    for m in recent_history
-                ])
-                
-                new_memories = extract_memories_from_conversation(conversation_text)
-                for memory in new_memories:
-                    if memory and len(memory) > 5:
-                        save_memory(memory)
-                        print(f"💾 Nova memória: {memory}")
-            
-            # Resumo de conversa (a cada 50 mensagens)
-            if total_msgs > 0 and total_msgs % 50 == 0:
-                recent_history = get_chat_history(session_id, limit=50)
-                conversation_text = "\n".join([
-                    f"{'Gehh' if m['role']=='user' else 'Matteo'}: {m['content']}" 
-                    for m in recent_history
-                ])
+            status = 'success'
+            if result.stop_reason == STOP_ERROR and not result.rounds:
+                # Modelo principal e fallback bateram no rate limit
+                status = 'rate_limit_error'
+                bot_response = rate_limit_message(result.error)
+            else:
+                # Limpar e filtrar resposta
+                bot_response = sanitize_response(result.content or (RATE_LIMIT_SHORT_MESSAGE if result.error else ""))
                 
-                summary = summarize_conversation(conversation_text)
-                if summary:
-                    save_conversation_summary(session_id, summary, total_msgs)
-                    print(f"📝 Resumo salvo: {summary[:100]}...")
-            
-            # Limpar conversas órfãs periodicamente (a cada 100 mensagens)
-            if total_msgs > 0 and total_msgs % 100 == 0:
-                try:
-                    cleanup_orphan_conversations()
-                except Exception as e:
-                    print(f"⚠️ Erro ao limpar conversas órfãs: {e}")
+                # Verificar se está repetindo muito as últimas respostas
+                warn_if_repeating(bot_response, chat_context.recent_responses[:3])
             
-            # Detectar modo grupo para retornar na resposta
-            is_group_mode_detected = check_if_group_mode_active(session_id)
+            # Salvar resposta, criar/atualizar a conversa e agendar memórias e resumo
+            # para depois da resposta (se o banco falhar, a resposta vai do mesmo jeito)
+            conversation_id = save_turn_and_conversation(
+                session_id, conversation_id, user_message, bot_response, tool_messages=turn_messages,
+                learn=status == 'success', used_memory_ids=chat_context.used_memory_ids,
+                speaker_role=None if message_saved else turn_role,
+            )
             
-            # Se foi mensagem do Pablo, retornar também a mensagem dele junto com a resposta do Matteo
-            # Isso permite que o frontend mostre ambas as mensagens
-            if pablo_message_sent and pablo_message_content:
-                # Retornar array com mensagem do Pablo e resposta do Matteo
-                response_data = {
-                    'messages': [
-                        {
-                            'response': user_message,
-                            'sender': 'pablo',
-                            'status': 'admin_message'
-                        },
-                        {
-                            'response': bot_response,
-                            'sender': 'matteo',
-                            'status': 'success',
-                            'tools_used': [tc.function.name for tc in response_message.tool_calls] if response_message.tool_calls else []
-                        }
-                    ],
-                    'session_id': session_id,
-                    'conversation_id': conversation_id,
-                    'group_mode': True,
-                    'is_multiple': True  # Indica que são múltiplas mensagens
-                }
-            else:
-                # Preparar resposta normal
-                response_data = {
-                    'response': bot_response,
-                    'session_id': session_id,
-                    'conversation_id': conversation_id,
-                    'tools_used': [tc.function.name for tc in response_message.tool_calls] if response_message.tool_calls else [],
-                    'status': 'success',
-                    'sender': 'matteo',  # Sempre retorna como Matteo quando é resposta da IA
-                    'group_mode': is_group_mode_detected or is_admin  # Indica se está em modo grupo
-                }
+            response_data = build_chat_response_data(
+                bot_response, session_id, conversation_id,
+                tools_used=result.tools_used,
+                group_mode=is_group_mode_detected or is_admin,
+                status=status,
+                pablo_message=user_message if is_pablo_message else None,
+            )
             
             # Enviar resposta
             self.send_response(200)
@@ -3082,6 +2006,7 @@ class handler(BaseHTTPRequestHandler):
             
             self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
             print(f"✅ Resposta enviada: {bot_response[:50]}...")
+            run_after_reply(result.tools_used, learn=status == 'success')
             
         except Exception as e:
             import traceback
@@ -5,6 +5,7 @@ CRUD completo de conversas integrado com banco de dados
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
 from urllib.parse import urlparse, parse_qs
 
 # Tentar importar psycopg2
@@ -16,83 +17,31 @@ except ImportError:
     DB_AVAILABLE = False
     print("psycopg2 não disponível")
 
-POSTGRES_URL = os.environ.get("POSTGRES_URL") or os.environ.get("DATABASE_URL")
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _db import get_db_connection
+from _migrations import ensure_schema
+from _conversation_index import (
+    CONVERSATION_DEFAULT_PAGE_SIZE, CONVERSATION_MAX_PAGE_SIZE, MESSAGE_DEFAULT_PAGE_SIZE, MESSAGE_MAX_PAGE_SIZE,
+    MESSAGES_FULL, MESSAGES_MODES, MESSAGES_NONE,
+    InvalidCursorError, get_conversation_header, list_conversations, list_messages,
+)
 
-def get_db_connection():
-    if not POSTGRES_URL or not DB_AVAILABLE:
-        return None
-    return psycopg2.connect(POSTGRES_URL)
-
-def init_db():
-    """Garante que a tabela de conversas existe"""
+def get_all_conversations(limit=50, cursor=None, messages=MESSAGES_NONE):
+    """
+    Busca as conversas ordenadas por data de atualização, numa consulta só
+    (ver _conversation_index.py). Retorna (conversas, próximo_cursor).
+    """
+    conn = get_db_connection()
+    if not conn:
+        return [], None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id VARCHAR(255) PRIMARY KEY,
-                session_id VARCHAR(255) NOT NULL UNIQUE,
-                title VARCHAR(255) NOT NULL,
-                last_message TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_conversations_updated 
-            ON conversations(updated_at DESC);
-        """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro init_db: {e}")
-        return False
-
-def get_all_conversations(limit=50, include_messages=False):
-    """Busca todas as conversas ordenadas por data de atualização"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return []
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT id, session_id, title, last_message, created_at, updated_at
-            FROM conversations
-            ORDER BY updated_at DESC
-            LIMIT %s
-        """, (limit,))
-        conversations = cur.fetchall()
-        
-        result = []
-        for c in conversations:
-            conv_data = {
-                'id': c['id'],
-                'sessionId': c['session_id'],
-                'title': c['title'],
-                'lastMessage': c['last_message'] or 'Nova conversa',
-                'createdAt': c['created_at'].isoformat() if hasattr(c['created_at'], 'isoformat') else str(c['created_at']),
-                'updatedAt': c['updated_at'].isoformat() if hasattr(c['updated_at'], 'isoformat') else str(c['updated_at'])
-            }
-            
-            if include_messages:
-                messages = get_conversation_messages(c['session_id'])
-                conv_data['messages'] = messages
-                conv_data['messageCount'] = len(messages)
-            
-            result.append(conv_data)
-        
+        result = list_conversations(cur, limit=limit, cursor=cursor, messages=messages)
         cur.close()
-        conn.close()
         return result
-    except Exception as e:
-        print(f"Erro get_all_conversations: {e}")
-        return []
+    finally:
+        conn.close()
 
 def get_conversation_by_id(conversation_id):
     """Busca uma conversa específica"""
@@ -199,6 +148,7 @@ def delete_conversation(conversation_id):
         # Deletar histórico de mensagens
         if session_id:
             cur.execute("DELETE FROM chat_history WHERE session_id = %s", (session_id,))
+            cur.execute("DELETE FROM session_stats WHERE session_id = %s", (session_id,))
         
         conn.commit()
         cur.close()
@@ -208,46 +158,57 @@ def delete_conversation(conversation_id):
         print(f"Erro delete_conversation: {e}")
         return False
 
-def get_conversation_messages(session_id):
-    """Busca todas as mensagens de uma conversa"""
+def get_conversation_feed(conversation_id, if_none_match=None, after_id=None, before_id=None, limit=None):
+    """
+    Conversa e mensagens (ver list_messages) numa conexão só. Retorna
+    (conversa, etag): conversa é None se não existe, e vem sem 'messages' se
+    o ETag bateu com if_none_match (nada mudou desde a última busca).
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None, None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return []
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT role, content, created_at
-            FROM chat_history
-            WHERE session_id = %s
-            ORDER BY created_at ASC
-        """, (session_id,))
-        messages = cur.fetchall()
+        conv, etag = get_conversation_header(cur, conversation_id)
+        if conv and etag != if_none_match:
+            conv['messages'], conv['hasMore'] = list_messages(
+                cur, conv['sessionId'], after_id=after_id, before_id=before_id, limit=limit
+            )
         cur.close()
+        return conv, etag
+    finally:
         conn.close()
-        return [
-            {
-                'id': idx,
-                'text': m['content'],
-                'sender': 'pablo' if m['role'] == 'admin' else ('matteo' if m['role'] == 'matteo_admin' else ('user' if m['role'] == 'user' else 'bot')),
-                'timestamp': m['created_at'].isoformat() if hasattr(m['created_at'], 'isoformat') else str(m['created_at'])
-            }
-            for idx, m in enumerate(messages, 1)
-        ]
-    except Exception as e:
-        print(f"Erro get_conversation_messages: {e}")
-        return []
+
+def _int_param(query_params, *names):
+    """Primeiro parâmetro inteiro presente entre names (None se nenhum); ValueError se inválido"""
+    for name in names:
+        if name in query_params:
+            return int(query_params[name][0])
+    return None
 
 class handler(BaseHTTPRequestHandler):
-    def _send_json(self, status, data):
+    def _send_cors_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept, Origin, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+
+    def _send_json(self, status, data, headers=None):
         """Helper para enviar resposta JSON"""
         self.send_response(status)
         self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept, Origin')
+        self._send_cors_headers()
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(json.dumps(data, default=str, ensure_ascii=False).encode('utf-8'))
 
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self._send_cors_headers()
+        self.end_headers()
+
     def _get_conversation_id(self):
         """Extrai o ID da conversa da URL"""
         parsed = urlparse(self.path)
@@ -266,7 +227,7 @@ class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Buscar conversas ou uma conversa específica"""
         try:
-            init_db()
+            ensure_schema()
             conversation_id = self._get_conversation_id()
             
             # Verificar se é requisição de admin
@@ -275,27 +236,68 @@ class handler(BaseHTTPRequestHandler):
             is_admin = query_params.get('admin', [''])[0] == 'true'
             
             if conversation_id:
-                # Buscar conversa específica
-                print(f"🔍 Buscando conversa: {conversation_id}")
-                conv = get_conversation_by_id(conversation_id)
+                # GET /api/conversations/:id - Conversa com todas as mensagens
+                # ?after_id=N (ou since=N) - Só as mensagens com id > N (polling)
+                # ?before_id=N - As mensagens anteriores a N (carregar mais antigas)
+                # limit=M limita a página (padrão 100 com cursor); ETag/If-None-Match -> 304
+                try:
+                    after_id = _int_param(query_params, 'after_id', 'since')
+                    before_id = _int_param(query_params, 'before_id')
+                    limit = _int_param(query_params, 'limit')
+                except ValueError:
+                    self._send_json(400, {'error': 'after_id, since, before_id e limit devem ser números'})
+                    return
+                if limit is None and (after_id is not None or before_id is not None):
+                    limit = MESSAGE_DEFAULT_PAGE_SIZE
+                if limit is not None:
+                    limit = max(1, min(limit, MESSAGE_MAX_PAGE_SIZE))
+                
+                if_none_match = self.headers.get('If-None-Match')
+                conv, etag = get_conversation_feed(
+                    conversation_id, if_none_match=if_none_match,
+                    after_id=after_id, before_id=before_id, limit=limit
+                )
                 if not conv:
                     print(f"⚠️ Conversa {conversation_id} não encontrada")
                     self._send_json(404, {'error': 'Conversa não encontrada'})
                     return
+                if 'messages' not in conv:
+                    self._send_not_modified(etag)
+                    return
                 
-                # Buscar mensagens da conversa
-                messages = get_conversation_messages(conv['sessionId'])
-                conv['messages'] = messages
-                print(f"✅ Conversa {conversation_id} encontrada com {len(messages)} mensagens")
-                
-                self._send_json(200, conv)
+                print(f"✅ Conversa {conversation_id}: {len(conv['messages'])} mensagem(ns)")
+                self._send_json(200, conv, headers={'ETag': etag})
             else:
-                # Listar todas as conversas
-                print(f"📋 Listando todas as conversas (admin={is_admin})")
-                include_messages = is_admin  # Admin vê mensagens, usuário normal não
-                conversations = get_all_conversations(limit=100, include_messages=include_messages)
+                # GET /api/conversations - Lista (array, até 100)
+                # GET /api/conversations?limit=20&cursor=... - Paginado: {items, next_cursor}
+                # messages=none|preview|full escolhe quanto das mensagens vem junto
+                # (padrão: full para o admin, none para o resto)
+                messages = query_params.get('messages', [MESSAGES_FULL if is_admin else MESSAGES_NONE])[0]
+                if messages not in MESSAGES_MODES:
+                    self._send_json(400, {'error': f"messages deve ser um de: {', '.join(MESSAGES_MODES)}"})
+                    return
+                paginated = 'limit' in query_params or 'cursor' in query_params
+                limit = CONVERSATION_MAX_PAGE_SIZE
+                if paginated:
+                    try:
+                        limit = int(query_params.get('limit', [CONVERSATION_DEFAULT_PAGE_SIZE])[0])
+                    except ValueError:
+                        limit = CONVERSATION_DEFAULT_PAGE_SIZE
+                    limit = max(1, min(limit, CONVERSATION_MAX_PAGE_SIZE))
+                
+                print(f"📋 Listando conversas (admin={is_admin}, messages={messages})")
+                try:
+                    conversations, next_cursor = get_all_conversations(
+                        limit=limit, cursor=query_params.get('cursor', [None])[0], messages=messages
+                    )
+                except InvalidCursorError as e:
+                    self._send_json(400, {'error': str(e)})
+                    return
                 print(f"✅ Encontradas {len(conversations)} conversas")
-                self._send_json(200, conversations)
+                if paginated:
+                    self._send_json(200, {'items': conversations, 'next_cursor': next_cursor})
+                else:
+                    self._send_json(200, conversations)
                 
         except Exception as e:
             import traceback
@@ -310,7 +312,7 @@ class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         """Criar nova conversa"""
         try:
-            init_db()
+            ensure_schema()
             
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length == 0:
@@ -353,7 +355,7 @@ class handler(BaseHTTPRequestHandler):
     def do_PUT(self):
         """Atualizar conversa existente"""
         try:
-            init_db()
+            ensure_schema()
             conversation_id = self._get_conversation_id()
             
             if not conversation_id:
@@ -391,7 +393,7 @@ class handler(BaseHTTPRequestHandler):
     def do_DELETE(self):
         """Deletar conversa"""
         try:
-            init_db()
+            ensure_schema()
             conversation_id = self._get_conversation_id()
             
             if not conversation_id:
@@ -5,34 +5,29 @@ Roda periodicamente para verificar se precisa mandar mensagem
 from http.server import BaseHTTPRequestHandler
 import json
 import os
-import psycopg2
+import sys
 from datetime import datetime, timedelta
-from pywebpush import webpush, WebPushException
-from openai import OpenAI
 
-# ============== CONFIGURAÇÕES ==============
-POSTGRES_URL = os.environ.get("POSTGRES_URL") or os.environ.get("DATABASE_URL")
-MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
-VAPID_PRIVATE_KEY = os.environ.get("VAPID_PRIVATE_KEY")
-VAPID_PUBLIC_KEY = "BJg... (Preencheremos via ENV)" 
-# O e-mail de contato para o VAPID
-VAPID_CLAIMS = {"sub": "mailto:pablo@example.com"}
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _db import get_db_connection
+from _migrations import ensure_schema
+from _llm import FALLBACK_MODEL, chat_completion, llm_available
+from _tool_cache import purge_expired as purge_expired_tool_cache
+from _outbox import drain_outbox, purge_delivered
+from _learning import process_learning_jobs, purge_finished_jobs, cleanup_orphan_conversations
+from _push import push_configured, send_push_to_all
 
-def get_db_connection():
-    if not POSTGRES_URL:
-        return None
-    return psycopg2.connect(POSTGRES_URL)
+LAST_USER_INTERACTION_QUERY = "SELECT MAX(last_user_message_at) FROM session_stats"
+# Tempo de cada repescagem (outbox e aprendizado); cabe no maxDuration do vercel.json
+CRON_DRAIN_BUDGET_SECONDS = 20
 
 def get_last_user_interaction():
     try:
         conn = get_db_connection()
         if not conn: return None
         cur = conn.cursor()
-        cur.execute("""
-            SELECT created_at FROM chat_history 
-            WHERE role = 'user' 
-            ORDER BY created_at DESC LIMIT 1
-        """)
+        cur.execute(LAST_USER_INTERACTION_QUERY)
         result = cur.fetchone()
         cur.close()
         conn.close()
@@ -40,26 +35,11 @@ def get_last_user_interaction():
     except:
         return None
 
-def get_subscriptions():
-    try:
-        conn = get_db_connection()
-        if not conn: return []
-        cur = conn.cursor()
-        cur.execute("SELECT endpoint, p256dh, auth FROM push_subscriptions")
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return [{'endpoint': r[0], 'keys': {'p256dh': r[1], 'auth': r[2]}} for r in result]
-    except:
-        return []
-
 def generate_proactive_message(hours_since):
-    if not MISTRAL_API_KEY:
+    if not llm_available():
         return "Oi princesa! Saudade de você... 💙"
 
     try:
-        client = OpenAI(api_key=MISTRAL_API_KEY, base_url="https://api.mistral.ai/v1")
-        
         context = "Ela sumiu por 24 horas." if hours_since > 24 else "É de manhã, hora de dar bom dia."
         if hours_since > 72: context = "Ela sumiu por 3 dias!"
 
@@ -69,8 +49,8 @@ Gere uma mensagem CURTA (máx 1 frase) e CARINHOSA de notificação para o celul
 Exemplos: "Bom dia princesa! ☀️", "Sumiu hein? Saudade... 💙", "Tudo bem por aí, princesa?"
 NÃO use aspas. Seja natural e carinhoso."""
 
-        response = client.chat.completions.create(
-            model="mistral-large-latest",
+        response = chat_completion(
+            model=FALLBACK_MODEL,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=50
         )
@@ -78,30 +58,22 @@ NÃO use aspas. Seja natural e carinhoso."""
     except:
         return "Oii princesa! Tudo bem? 💙"
 
-def send_push_notification(subscription, message):
-    try:
-        # Tenta pegar a chave pública do ENV ou usar uma padrão (não recomendado em prod)
-        public_key = os.environ.get("VAPID_PUBLIC_KEY")
-        private_key = os.environ.get("VAPID_PRIVATE_KEY")
-        
-        if not private_key or not public_key:
-            print("VAPID Keys não configuradas")
-            return
-
-        webpush(
-            subscription_info=subscription,
-            data=json.dumps({"title": "Matteo", "body": message, "url": "/"}),
-            vapid_private_key=private_key,
-            vapid_claims=VAPID_CLAIMS
-        )
-        print(f"Push enviado: {message}")
-    except WebPushException as ex:
-        print(f"Erro Push: {ex}")
-
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         # Verificação de segurança (pode adicionar um token secreto na URL se quiser)
         try:
+            ensure_schema()
+            # Repescagem: o que os endpoints não conseguiram entregar/processar depois de responder
+            try:
+                notifications = drain_outbox(budget_seconds=CRON_DRAIN_BUDGET_SECONDS)
+                learning = process_learning_jobs(budget_seconds=CRON_DRAIN_BUDGET_SECONDS)
+                print(f"📬 Outbox: {notifications['sent']} enviada(s); 🧠 aprendizado: {learning['done']} job(s)")
+            except Exception as e:
+                print(f"⚠️ Erro na repescagem da outbox/aprendizado: {e}")
+            purge_expired_tool_cache()
+            purge_delivered()
+            purge_finished_jobs()
+            cleanup_orphan_conversations()
             last_interaction = get_last_user_interaction()
             if not last_interaction:
                 self.send_response(200)
@@ -138,12 +110,13 @@ class handler(BaseHTTPRequestHandler):
             
             if hours_since > 12:
                 message = generate_proactive_message(hours_since)
-                subscriptions = get_subscriptions()
                 
                 count = 0
-                for sub in subscriptions:
-                    send_push_notification(sub, message)
-                    count += 1
+                if push_configured():
+                    # Todos os aparelhos em paralelo (ver _push.py)
+                    count, _ = send_push_to_all(json.dumps({"title": "Matteo", "body": message, "url": "/"}))
+                else:
+                    print("VAPID Keys não configuradas")
                 
                 self.send_response(200)
                 self.end_headers()
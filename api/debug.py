@@ -58,9 +58,9 @@ class handler(BaseHTTPRequestHandler):
         db_test = {'status': 'not_tested'}
         if imports['psycopg2'] and (env_vars['POSTGRES_URL']['exists'] or env_vars['DATABASE_URL']['exists']):
             try:
-                import psycopg2
-                conn_str = os.environ.get('POSTGRES_URL') or os.environ.get('DATABASE_URL')
-                conn = psycopg2.connect(conn_str)
+                sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+                from _db import get_db_connection
+                conn = get_db_connection()
                 cur = conn.cursor()
                 
                 # Verificar tabelas
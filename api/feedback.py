@@ -3,14 +3,13 @@ Endpoint de Feedback (CRUD) - Vercel Serverless Function
 Com suporte a: Respostas, Fixar, Humor, Conquistas, Status de Leitura
 """
 from http.server import BaseHTTPRequestHandler
+import base64
 import json
 import os
+import sys
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
 from urllib.parse import urlparse, parse_qs
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 # Tentar importar psycopg2
 try:
@@ -21,19 +20,15 @@ except ImportError:
     DB_AVAILABLE = False
     print("psycopg2 não disponível")
 
-# Tentar importar pywebpush para notificações
-try:
-    from pywebpush import webpush, WebPushException
-    PUSH_AVAILABLE = True
-except ImportError:
-    PUSH_AVAILABLE = False
-
-# ============== CONFIGURAÇÕES ==============
-
-POSTGRES_URL = os.environ.get("POSTGRES_URL") or os.environ.get("DATABASE_URL")
-VAPID_PRIVATE_KEY = os.environ.get("VAPID_PRIVATE_KEY")
-VAPID_PUBLIC_KEY = os.environ.get("VAPID_PUBLIC_KEY")
-VAPID_CLAIMS = {"sub": "mailto:pablo@example.com"}
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _db import get_db_connection
+from _migrations import ensure_schema
+from _mural_stats import (
+    get_statistics, get_stats_version, stats_etag,
+    record_post_created, record_post_deleted, record_mood_changed, record_read_changed, record_replies,
+)
+from _outbox import deliver_after_response, enqueue_email, enqueue_push
 
 # ============== CONQUISTAS ==============
 
@@ -51,6 +46,46 @@ ACHIEVEMENTS = {
     "first_poke": {"name": "Cutucadora", "emoji": "👉", "description": "Cutucou o Pablo pela primeira vez"},
 }
 
+ALL_MOODS = ['happy', 'sad', 'angry', 'love', 'neutral']
+
+# Regras: conquista -> (métrica, mínimo). As métricas saem de ACHIEVEMENT_INPUTS_QUERY.
+# Conquistas sem regra (first_poke) são desbloqueadas direto pela ação.
+ACHIEVEMENT_RULES = {
+    "first_post": ("posts", 1),
+    "posts_5": ("posts", 5),
+    "posts_10": ("posts", 10),
+    "posts_25": ("posts", 25),
+    "posts_50": ("posts", 50),
+    "streak_3": ("streak", 3),
+    "streak_7": ("streak", 7),
+    "first_reply": ("replies", 1),
+    "love_letter": ("letters", 1),
+    "all_moods": ("moods_used", len(ALL_MOODS)),
+}
+
+# Todas as entradas das regras numa consulta só (a sequência usa as 7 datas mais recentes)
+ACHIEVEMENT_INPUTS_QUERY = """
+    SELECT
+        COUNT(*) AS posts,
+        COUNT(*) FILTER (WHERE is_letter = TRUE) AS letters,
+        COUNT(DISTINCT mood) FILTER (WHERE mood = ANY(%(moods)s)) AS moods_used,
+        EXISTS (
+            SELECT 1 FROM feedback_replies fr
+            JOIN feedback f ON fr.feedback_id = f.id
+            WHERE f.author = 'Geovana'
+        )::int AS replies,
+        ARRAY(
+            SELECT DISTINCT DATE(created_at) AS post_date
+            FROM feedback
+            WHERE author = 'Geovana'
+            ORDER BY post_date DESC
+            LIMIT 7
+        ) AS recent_dates,
+        ARRAY(SELECT achievement_key FROM achievements WHERE user_id = %(user_id)s) AS unlocked
+    FROM feedback
+    WHERE author = 'Geovana'
+"""
+
 # ============== MENSAGENS DE CUTUCADA ==============
 import random
 
@@ -69,178 +104,67 @@ POKE_MESSAGES = [
     "🎯 Gehh mandou avisar: RESPONDE! 👊",
 ]
 
-# ============== FUNÇÕES DO BANCO ==============
-
-def get_db_connection():
-    if not POSTGRES_URL or not DB_AVAILABLE:
-        return None
-    return psycopg2.connect(POSTGRES_URL)
-
-def init_db():
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        cur = conn.cursor()
-        
-        # Tabela principal de feedback (atualizada)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS feedback (
-                id VARCHAR(36) PRIMARY KEY,
-                author VARCHAR(255) NOT NULL,
-                message TEXT NOT NULL,
-                mood VARCHAR(20) DEFAULT 'neutral',
-                is_pinned BOOLEAN DEFAULT FALSE,
-                is_letter BOOLEAN DEFAULT FALSE,
-                is_read BOOLEAN DEFAULT FALSE,
-                read_at TIMESTAMP,
-                created_at TIMESTAMP NOT NULL,
-                updated_at TIMESTAMP
-            );
-        """)
-        
-        # Tabela de respostas do Pablo
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS feedback_replies (
-                id VARCHAR(36) PRIMARY KEY,
-                feedback_id VARCHAR(36) REFERENCES feedback(id) ON DELETE CASCADE,
-                message TEXT NOT NULL,
-                created_at TIMESTAMP NOT NULL
-            );
-        """)
-        
-        # Tabela de conquistas
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS achievements (
-                id VARCHAR(36) PRIMARY KEY,
-                user_id VARCHAR(255) DEFAULT 'gehh',
-                achievement_key VARCHAR(50) NOT NULL,
-                unlocked_at TIMESTAMP NOT NULL,
-                UNIQUE(user_id, achievement_key)
-            );
-        """)
-        
-        # Tabela de estatísticas
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS mural_stats (
-                id VARCHAR(36) PRIMARY KEY,
-                stat_date DATE NOT NULL UNIQUE,
-                mood VARCHAR(20),
-                post_count INTEGER DEFAULT 0
-            );
-        """)
-        
-        # Adicionar colunas novas se não existirem (migração)
-        try:
-            cur.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS mood VARCHAR(20) DEFAULT 'neutral';")
-            cur.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS is_pinned BOOLEAN DEFAULT FALSE;")
-            cur.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS is_letter BOOLEAN DEFAULT FALSE;")
-            cur.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS is_read BOOLEAN DEFAULT FALSE;")
-            cur.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS read_at TIMESTAMP;")
-        except:
-            pass
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Erro init_db: {e}")
-        return False
-
 # ============== FUNÇÕES DE CONQUISTAS ==============
 
-def check_and_unlock_achievements(conn, user_id='gehh'):
-    """Verifica e desbloqueia conquistas baseadas nas ações"""
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    unlocked = []
-    
-    # Contar posts
-    cur.execute("SELECT COUNT(*) as count FROM feedback WHERE author = 'Geovana'")
-    post_count = cur.fetchone()['count']
-    
-    # Conquistas por quantidade de posts
-    achievement_thresholds = [
-        (1, "first_post"),
-        (5, "posts_5"),
-        (10, "posts_10"),
-        (25, "posts_25"),
-        (50, "posts_50"),
-    ]
-    
-    for threshold, key in achievement_thresholds:
-        if post_count >= threshold:
-            if unlock_achievement(conn, user_id, key):
-                unlocked.append(ACHIEVEMENTS[key])
-    
-    # Verificar streak (dias seguidos)
-    cur.execute("""
-        SELECT DISTINCT DATE(created_at) as post_date 
-        FROM feedback 
-        WHERE author = 'Geovana'
-        ORDER BY post_date DESC 
-        LIMIT 7
-    """)
-    dates = [row['post_date'] for row in cur.fetchall()]
-    
-    if len(dates) >= 3:
-        # Verificar se são consecutivos
-        streak = 1
-        for i in range(1, len(dates)):
-            if (dates[i-1] - dates[i]).days == 1:
-                streak += 1
-            else:
-                break
-        
-        if streak >= 3:
-            if unlock_achievement(conn, user_id, "streak_3"):
-                unlocked.append(ACHIEVEMENTS["streak_3"])
-        if streak >= 7:
-            if unlock_achievement(conn, user_id, "streak_7"):
-                unlocked.append(ACHIEVEMENTS["streak_7"])
-    
-    # Verificar se usou todos os moods
-    cur.execute("SELECT DISTINCT mood FROM feedback WHERE author = 'Geovana' AND mood IS NOT NULL")
-    moods_used = [row['mood'] for row in cur.fetchall()]
-    all_moods = ['happy', 'sad', 'angry', 'love', 'neutral']
-    if all(m in moods_used for m in all_moods):
-        if unlock_achievement(conn, user_id, "all_moods"):
-            unlocked.append(ACHIEVEMENTS["all_moods"])
-    
-    # Verificar se tem carta
-    cur.execute("SELECT COUNT(*) as count FROM feedback WHERE author = 'Geovana' AND is_letter = TRUE")
-    if cur.fetchone()['count'] > 0:
-        if unlock_achievement(conn, user_id, "love_letter"):
-            unlocked.append(ACHIEVEMENTS["love_letter"])
-    
-    # Verificar se tem resposta
-    cur.execute("""
-        SELECT COUNT(*) as count FROM feedback_replies fr
-        JOIN feedback f ON fr.feedback_id = f.id
-        WHERE f.author = 'Geovana'
-    """)
-    if cur.fetchone()['count'] > 0:
-        if unlock_achievement(conn, user_id, "first_reply"):
-            unlocked.append(ACHIEVEMENTS["first_reply"])
-    
-    cur.close()
-    return unlocked
-
-def unlock_achievement(conn, user_id, achievement_key):
-    """Tenta desbloquear uma conquista, retorna True se foi nova"""
+def check_and_unlock_achievements(cur, user_id='gehh'):
+    """
+    Avalia ACHIEVEMENT_RULES e desbloqueia as conquistas novas. Roda na
+    transação de quem chamou (o commit é do chamador); retorna as desbloqueadas agora.
+    """
+    cur.execute("SAVEPOINT check_achievements")
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO achievements (id, user_id, achievement_key, unlocked_at)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (user_id, achievement_key) DO NOTHING
-        """, (str(uuid.uuid4()), user_id, achievement_key, datetime.now()))
-        conn.commit()
-        was_new = cur.rowcount > 0
-        cur.close()
-        return was_new
-    except:
-        return False
+        cur.execute(ACHIEVEMENT_INPUTS_QUERY, {'user_id': user_id, 'moods': ALL_MOODS})
+        posts, letters, moods_used, replies, recent_dates, unlocked = cur.fetchone()
+
+        metrics = {
+            'posts': posts,
+            'letters': letters,
+            'moods_used': moods_used,
+            'replies': replies,
+            'streak': _streak_from_dates(recent_dates or []),
+        }
+        already = set(unlocked or [])
+        satisfied = [
+            key for key, (metric, threshold) in ACHIEVEMENT_RULES.items()
+            if key not in already and metrics[metric] >= threshold
+        ]
+        new_keys = unlock_achievements(cur, user_id, satisfied)
+        cur.execute("RELEASE SAVEPOINT check_achievements")
+    except Exception as e:
+        # Conquista nunca derruba o post
+        cur.execute("ROLLBACK TO SAVEPOINT check_achievements")
+        print(f"Erro ao verificar conquistas: {e}")
+        return []
+
+    return [ACHIEVEMENTS[key] for key in ACHIEVEMENTS if key in new_keys]
+
+def _streak_from_dates(dates):
+    """Dias seguidos a partir da data mais recente (datas em ordem decrescente)"""
+    if not dates:
+        return 0
+    streak = 1
+    for i in range(1, len(dates)):
+        if (dates[i-1] - dates[i]).days == 1:
+            streak += 1
+        else:
+            break
+    return streak
+
+def unlock_achievements(cur, user_id, achievement_keys):
+    """Desbloqueia várias conquistas num INSERT só; retorna o conjunto das que eram novas"""
+    if not achievement_keys:
+        return set()
+    now = datetime.now()
+    values = []
+    for key in achievement_keys:
+        values.extend([str(uuid.uuid4()), user_id, key, now])
+    cur.execute(f"""
+        INSERT INTO achievements (id, user_id, achievement_key, unlocked_at)
+        VALUES {', '.join(['(%s, %s, %s, %s)'] * len(achievement_keys))}
+        ON CONFLICT (user_id, achievement_key) DO NOTHING
+        RETURNING achievement_key
+    """, values)
+    return {row['achievement_key'] if isinstance(row, dict) else row[0] for row in cur.fetchall()}
 
 def get_all_achievements(conn, user_id='gehh'):
     """Retorna todas as conquistas com status de desbloqueio"""
@@ -261,31 +185,21 @@ def get_all_achievements(conn, user_id='gehh'):
 
 # ============== FUNÇÃO DE CUTUCADA ==============
 
-def send_poke_notification(feedback_id, feedback_message):
-    """Envia uma cutucada (poke) para o Pablo"""
+def enqueue_poke_notification(cur, feedback_message):
+    """Coloca a cutucada (push + email) para o Pablo na outbox; True se algum canal aceitou"""
     poke_message = random.choice(POKE_MESSAGES)
     
     # Adiciona um trecho da mensagem original
     preview = feedback_message[:50] + "..." if len(feedback_message) > 50 else feedback_message
     full_message = f"{poke_message}\n\n📝 \"{preview}\""
     
-    # Enviar push notification
-    push_sent = send_push_to_pablo(full_message)
+    push_queued = enqueue_push(cur, full_message)
+    email_queued = enqueue_email(cur, *build_poke_email(feedback_message, poke_message))
     
-    # Enviar email também
-    email_sent = send_poke_email(feedback_message, poke_message)
-    
-    return push_sent or email_sent
-
-def send_poke_email(original_message, poke_message):
-    """Envia email de cutucada"""
-    SENDER_EMAIL = os.environ.get('SENDER_EMAIL')
-    SENDER_PASSWORD = os.environ.get('SENDER_PASSWORD')
-    RECEIVER_EMAIL = os.environ.get('RECEIVER_EMAIL')
-
-    if not all([SENDER_EMAIL, SENDER_PASSWORD, RECEIVER_EMAIL]):
-        return False
+    return push_queued or email_queued
 
+def build_poke_email(original_message, poke_message):
+    """Assunto, texto e HTML do email de cutucada"""
     hora_atual = datetime.now().strftime("%d/%m/%Y às %H:%M")
 
     html_content = f"""
@@ -307,153 +221,99 @@ def send_poke_email(original_message, poke_message):
     </html>
     """
 
+    subject = "👉 CUTUCADA! Gehh quer resposta AGORA! 😤"
+    text = f"CUTUCADA DA GEHH!\n\n{poke_message}\n\nMensagem original: {original_message}\n\nCutucada em: {hora_atual}"
+    return subject, text, html_content
+
+# ============== LISTAGEM DO MURAL ==============
+
+FEED_DEFAULT_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+# Um SELECT só: as respostas de cada post vêm agregadas em JSON (LATERAL usa o
+# índice de feedback_replies(feedback_id, created_at)), sem uma consulta por post
+FEED_LIST_QUERY = """
+    SELECT f.id, f.author, f.message, f.mood, f.is_pinned, f.is_letter,
+           f.is_read, f.read_at, f.created_at, f.updated_at,
+           COALESCE(r.reply_count, 0) AS reply_count,
+           COALESCE(r.replies, '[]'::json) AS replies
+    FROM feedback f
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*) AS reply_count,
+               json_agg(json_build_object('id', fr.id, 'message', fr.message, 'created_at', fr.created_at)
+                        ORDER BY fr.created_at ASC) AS replies
+        FROM feedback_replies fr
+        WHERE fr.feedback_id = f.id
+    ) r ON TRUE
+    {where}
+    ORDER BY f.is_pinned DESC, f.created_at DESC, f.id DESC
+    {limit}
+"""
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_feed_cursor(item):
+    """Cursor opaco com a chave de ordenação (is_pinned, created_at, id) do último item da página"""
+    key = json.dumps([bool(item['is_pinned']), item['created_at'], item['id']])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_feed_cursor(cursor):
     try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = f"👉 CUTUCADA! Gehh quer resposta AGORA! 😤"
-        msg['From'] = SENDER_EMAIL
-        msg['To'] = RECEIVER_EMAIL
-        
-        msg.attach(MIMEText(f"CUTUCADA DA GEHH!\n\n{poke_message}\n\nMensagem original: {original_message}\n\nCutucada em: {hora_atual}", 'plain', 'utf-8'))
-        msg.attach(MIMEText(html_content, 'html', 'utf-8'))
-
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
-            server.sendmail(SENDER_EMAIL, RECEIVER_EMAIL, msg.as_string())
-        
-        return True
-        
-    except Exception as e:
-        print(f"[EMAIL POKE] ERRO: {e}")
-        return False
+        padded = cursor + '=' * (-len(cursor) % 4)
+        is_pinned, created_at, feedback_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return bool(is_pinned), datetime.fromisoformat(created_at), str(feedback_id)
+    except Exception:
+        raise InvalidCursorError("Cursor inválido")
+
+
+def list_feedback(conn, limit=None, cursor=None):
+    """
+    Lista os posts do mural com as respostas, fixados primeiro e depois do mais novo
+    para o mais antigo. Sem limit/cursor devolve tudo; com eles, uma página por
+    keyset em (is_pinned, created_at, id). Retorna (itens, próximo_cursor).
+    """
+    where = ""
+    params = []
+    if cursor:
+        where = "WHERE (f.is_pinned, f.created_at, f.id) < (%s, %s, %s)"
+        params.extend(decode_feed_cursor(cursor))
 
-# ============== FUNÇÕES DE ESTATÍSTICAS ==============
+    limit_sql = ""
+    if limit is not None:
+        limit_sql = "LIMIT %s"
+        params.append(limit + 1)  # Um a mais para saber se tem próxima página
 
-def get_statistics(conn):
-    """Retorna estatísticas do mural"""
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    # Total de posts
-    cur.execute("SELECT COUNT(*) as total FROM feedback")
-    total_posts = cur.fetchone()['total']
-    
-    # Posts este mês
-    cur.execute("""
-        SELECT COUNT(*) as count FROM feedback 
-        WHERE DATE_TRUNC('month', created_at) = DATE_TRUNC('month', CURRENT_DATE)
-    """)
-    posts_this_month = cur.fetchone()['count']
-    
-    # Humor mais frequente
-    cur.execute("""
-        SELECT mood, COUNT(*) as count FROM feedback 
-        WHERE mood IS NOT NULL 
-        GROUP BY mood ORDER BY count DESC LIMIT 1
-    """)
-    most_common_mood = cur.fetchone()
-    
-    # Streak atual
-    cur.execute("""
-        SELECT DISTINCT DATE(created_at) as post_date 
-        FROM feedback 
-        ORDER BY post_date DESC 
-        LIMIT 30
-    """)
-    dates = [row['post_date'] for row in cur.fetchall()]
-    
-    current_streak = 0
-    if dates:
-        today = datetime.now().date()
-        if dates[0] == today or dates[0] == today - timedelta(days=1):
-            current_streak = 1
-            for i in range(1, len(dates)):
-                if (dates[i-1] - dates[i]).days == 1:
-                    current_streak += 1
-                else:
-                    break
-    
-    # Respostas do Pablo
-    cur.execute("SELECT COUNT(*) as count FROM feedback_replies")
-    total_replies = cur.fetchone()['count']
-    
-    # Mensagens não lidas pelo Pablo
-    cur.execute("SELECT COUNT(*) as count FROM feedback WHERE is_read = FALSE")
-    unread_count = cur.fetchone()['count']
-    
-    # Humor por mês (últimos 6 meses)
-    cur.execute("""
-        SELECT 
-            DATE_TRUNC('month', created_at) as month,
-            mood,
-            COUNT(*) as count
-        FROM feedback 
-        WHERE created_at > NOW() - INTERVAL '6 months' AND mood IS NOT NULL
-        GROUP BY DATE_TRUNC('month', created_at), mood
-        ORDER BY month
-    """)
-    mood_history = cur.fetchall()
-    
+    cur.execute(FEED_LIST_QUERY.format(where=where, limit=limit_sql), params)
+    rows = cur.fetchall()
     cur.close()
-    
-    return {
-        "total_posts": total_posts,
-        "posts_this_month": posts_this_month,
-        "most_common_mood": most_common_mood['mood'] if most_common_mood else 'neutral',
-        "current_streak": current_streak,
-        "total_replies": total_replies,
-        "unread_count": unread_count,
-        "mood_history": [dict(r) for r in mood_history] if mood_history else []
-    }
-
-# ============== FUNÇÃO DE NOTIFICAÇÃO PUSH ==============
-
-def send_push_to_pablo(message):
-    """Envia push notification para o Pablo"""
-    if not PUSH_AVAILABLE or not VAPID_PRIVATE_KEY:
-        print("[PUSH] Push não disponível")
-        return False
-    
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT endpoint, p256dh, auth FROM push_subscriptions")
-        subscriptions = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        for sub in subscriptions:
-            try:
-                webpush(
-                    subscription_info={
-                        "endpoint": sub['endpoint'],
-                        "keys": {"p256dh": sub['p256dh'], "auth": sub['auth']}
-                    },
-                    data=message,
-                    vapid_private_key=VAPID_PRIVATE_KEY,
-                    vapid_claims=VAPID_CLAIMS
-                )
-                print(f"[PUSH] Notificação enviada!")
-            except WebPushException as e:
-                print(f"[PUSH] Erro: {e}")
-        
-        return True
-    except Exception as e:
-        print(f"[PUSH] Erro geral: {e}")
-        return False
 
-# ============== FUNÇÃO DE E-MAIL (GMAIL SMTP) ==============
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+
+    feedback_list = []
+    for row in rows:
+        item = dict(row)
 
-def send_email_notification(author, message, mood=None):
-    SENDER_EMAIL = os.environ.get('SENDER_EMAIL')
-    SENDER_PASSWORD = os.environ.get('SENDER_PASSWORD')
-    RECEIVER_EMAIL = os.environ.get('RECEIVER_EMAIL')
+        # Formatar datas (as das respostas já vêm em ISO do json_build_object)
+        for date_field in ['created_at', 'updated_at', 'read_at']:
+            if item.get(date_field):
+                item[date_field] = item[date_field].isoformat() if hasattr(item[date_field], 'isoformat') else str(item[date_field])
 
-    if not all([SENDER_EMAIL, SENDER_PASSWORD, RECEIVER_EMAIL]):
-        return False
+        feedback_list.append(item)
 
+    next_cursor = encode_feed_cursor(feedback_list[-1]) if has_more else None
+    return feedback_list, next_cursor
+
+# ============== E-MAIL DE NOVO POST ==============
+
+def build_new_post_email(author, message, mood=None):
+    """Assunto, texto e HTML do email de post novo no mural"""
     hora_atual = datetime.now().strftime("%d/%m/%Y às %H:%M")
     
     mood_emoji = {
@@ -482,38 +342,34 @@ def send_email_notification(author, message, mood=None):
     </html>
     """
 
-    try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = f"💌 Gehh está {mood_emoji} - Nova mensagem!"
-        msg['From'] = SENDER_EMAIL
-        msg['To'] = RECEIVER_EMAIL
-        
-        msg.attach(MIMEText(f"Nova mensagem da Gehh:\n\n{message}\n\nHumor: {mood}\nData: {hora_atual}", 'plain', 'utf-8'))
-        msg.attach(MIMEText(html_content, 'html', 'utf-8'))
-
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
-            server.sendmail(SENDER_EMAIL, RECEIVER_EMAIL, msg.as_string())
-        
-        return True
-        
-    except Exception as e:
-        print(f"[EMAIL] ERRO: {e}")
-        return False
+    subject = f"💌 Gehh está {mood_emoji} - Nova mensagem!"
+    text = f"Nova mensagem da Gehh:\n\n{message}\n\nHumor: {mood}\nData: {hora_atual}"
+    return subject, text, html_content
 
 # ============== HANDLER ==============
 
 class handler(BaseHTTPRequestHandler):
-    def _send_json(self, status, data):
-        self.send_response(status)
-        self.send_header('Content-Type', 'application/json')
+    def _send_cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, PATCH, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+
+    def _send_json(self, status, data, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self._send_cors_headers()
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(json.dumps(data, default=str).encode())
 
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self._send_cors_headers()
+        self.end_headers()
+
     def _get_path_parts(self):
         parsed = urlparse(self.path)
         path_parts = parsed.path.strip('/').split('/')
@@ -525,7 +381,7 @@ class handler(BaseHTTPRequestHandler):
 
     def do_GET(self):
         try:
-            init_db()
+            ensure_schema()
             path_parts, query_params = self._get_path_parts()
             
             conn = get_db_connection()
@@ -533,11 +389,19 @@ class handler(BaseHTTPRequestHandler):
                 self._send_json(500, {'error': 'Banco de dados não configurado'})
                 return
             
-            # GET /api/feedback/stats - Estatísticas
+            # GET /api/feedback/stats - Estatísticas (pré-calculadas, com ETag)
             if len(path_parts) >= 2 and path_parts[-1] == 'stats':
-                stats = get_statistics(conn)
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                etag = stats_etag(get_stats_version(cur))
+                if self.headers.get('If-None-Match') == etag:
+                    cur.close()
+                    conn.close()
+                    self._send_not_modified(etag)
+                    return
+                stats = get_statistics(cur)
+                cur.close()
                 conn.close()
-                self._send_json(200, stats)
+                self._send_json(200, stats, {'ETag': etag, 'Cache-Control': 'no-cache'})
                 return
             
             # GET /api/feedback/achievements - Conquistas
@@ -547,42 +411,28 @@ class handler(BaseHTTPRequestHandler):
                 self._send_json(200, achievements)
                 return
             
-            # GET /api/feedback - Lista todos
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("""
-                SELECT f.id, f.author, f.message, f.mood, f.is_pinned, f.is_letter, 
-                       f.is_read, f.read_at, f.created_at, f.updated_at,
-                       (SELECT COUNT(*) FROM feedback_replies fr WHERE fr.feedback_id = f.id) as reply_count
-                FROM feedback f
-                ORDER BY f.is_pinned DESC, f.created_at DESC
-            """)
-            rows = cur.fetchall()
-            
-            feedback_list = []
-            for row in rows:
-                item = dict(row)
-                
-                # Buscar respostas
-                cur.execute("""
-                    SELECT id, message, created_at FROM feedback_replies 
-                    WHERE feedback_id = %s ORDER BY created_at ASC
-                """, (item['id'],))
-                item['replies'] = [dict(r) for r in cur.fetchall()]
-                
-                # Formatar datas
-                for date_field in ['created_at', 'updated_at', 'read_at']:
-                    if item.get(date_field):
-                        item[date_field] = item[date_field].isoformat() if hasattr(item[date_field], 'isoformat') else str(item[date_field])
-                
-                for reply in item['replies']:
-                    if reply.get('created_at'):
-                        reply['created_at'] = reply['created_at'].isoformat() if hasattr(reply['created_at'], 'isoformat') else str(reply['created_at'])
-                
-                feedback_list.append(item)
+            # GET /api/feedback - Lista todos (array)
+            # GET /api/feedback?limit=20&cursor=... - Paginado: {items, next_cursor}
+            if 'limit' not in query_params and 'cursor' not in query_params:
+                feedback_list, _ = list_feedback(conn)
+                conn.close()
+                self._send_json(200, feedback_list)
+                return
             
-            cur.close()
+            try:
+                limit = int(query_params.get('limit', [FEED_DEFAULT_PAGE_SIZE])[0])
+            except ValueError:
+                limit = FEED_DEFAULT_PAGE_SIZE
+            limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+            
+            try:
+                feedback_list, next_cursor = list_feedback(conn, limit=limit, cursor=query_params.get('cursor', [None])[0])
+            except InvalidCursorError as e:
+                conn.close()
+                self._send_json(400, {'error': str(e)})
+                return
             conn.close()
-            self._send_json(200, feedback_list)
+            self._send_json(200, {'items': feedback_list, 'next_cursor': next_cursor})
             
         except Exception as e:
             import traceback
@@ -591,7 +441,7 @@ class handler(BaseHTTPRequestHandler):
 
     def do_POST(self):
         try:
-            init_db()
+            ensure_schema()
             path_parts, _ = self._get_path_parts()
             
             content_length = int(self.headers.get('Content-Length', 0))
@@ -618,11 +468,10 @@ class handler(BaseHTTPRequestHandler):
                     INSERT INTO feedback_replies (id, feedback_id, message, created_at)
                     VALUES (%s, %s, %s, %s)
                 """, (reply_id, feedback_id, message, datetime.now()))
+                record_replies(cur, 1)
+                check_and_unlock_achievements(cur)
                 conn.commit()
                 cur.close()
-                
-                # Verificar conquistas
-                check_and_unlock_achievements(conn)
                 conn.close()
                 
                 self._send_json(201, {'message': 'Resposta adicionada!', 'id': reply_id})
@@ -646,18 +495,18 @@ class handler(BaseHTTPRequestHandler):
                 INSERT INTO feedback (id, author, message, mood, is_letter, created_at)
                 VALUES (%s, %s, %s, %s, %s, %s)
             """, (feedback_id, author, message, mood, is_letter, created_at))
-            conn.commit()
-            cur.close()
-            
-            # Verificar conquistas
-            new_achievements = check_and_unlock_achievements(conn)
-            conn.close()
+            record_post_created(cur, created_at, mood)
+            new_achievements = check_and_unlock_achievements(cur)
             
-            # Notificar Pablo
+            # Notificar Pablo (vai para a outbox; entregue depois da resposta)
             mood_emoji = {'happy': '😊', 'sad': '😢', 'angry': '😤', 'love': '😍', 'neutral': '😐'}.get(mood, '💭')
             push_message = f"💌 Gehh postou no mural! {mood_emoji}"
-            send_push_to_pablo(push_message)
-            send_email_notification(author, message, mood)
+            notified = enqueue_push(cur, push_message)
+            notified = enqueue_email(cur, *build_new_post_email(author, message, mood)) or notified
+            
+            conn.commit()
+            cur.close()
+            conn.close()
             
             self._send_json(201, {
                 'message': 'Feedback salvo com sucesso!',
@@ -665,6 +514,9 @@ class handler(BaseHTTPRequestHandler):
                 'created_at': created_at.isoformat(),
                 'new_achievements': new_achievements
             })
+            # Entrega depois da resposta (o que falhar fica para o cron)
+            if notified:
+                deliver_after_response()
             
         except Exception as e:
             print(f"Erro ao criar feedback: {str(e)}")
@@ -679,7 +531,7 @@ class handler(BaseHTTPRequestHandler):
                 return
             
             feedback_id = path_parts[-1]
-            init_db()
+            ensure_schema()
             
             content_length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(content_length)
@@ -693,6 +545,12 @@ class handler(BaseHTTPRequestHandler):
             cur = conn.cursor()
             updated_at = datetime.now()
             
+            old = None
+            if 'mood' in data:
+                # Humor antigo, para mover o post no rollup das estatísticas
+                cur.execute("SELECT mood, created_at FROM feedback WHERE id = %s FOR UPDATE", (feedback_id,))
+                old = cur.fetchone()
+            
             # Campos que podem ser atualizados
             updates = []
             values = []
@@ -714,6 +572,8 @@ class handler(BaseHTTPRequestHandler):
             cur.execute(f"UPDATE feedback SET {', '.join(updates)} WHERE id = %s", values)
             
             row_count = cur.rowcount
+            if row_count and old:
+                record_mood_changed(cur, old[1], old[0], data['mood'])
             conn.commit()
             cur.close()
             conn.close()
@@ -740,7 +600,7 @@ class handler(BaseHTTPRequestHandler):
             feedback_id = path_parts[-2]
             action = path_parts[-1]
             
-            init_db()
+            ensure_schema()
             conn = get_db_connection()
             if not conn:
                 self._send_json(500, {'error': 'Banco de dados não configurado'})
@@ -751,12 +611,18 @@ class handler(BaseHTTPRequestHandler):
             if action == 'pin':
                 # Toggle pin
                 cur.execute("UPDATE feedback SET is_pinned = NOT is_pinned WHERE id = %s", (feedback_id,))
-            elif action == 'read':
-                # Marcar como lido
-                cur.execute("UPDATE feedback SET is_read = TRUE, read_at = %s WHERE id = %s", (datetime.now(), feedback_id))
-            elif action == 'unread':
-                # Marcar como não lido
-                cur.execute("UPDATE feedback SET is_read = FALSE, read_at = NULL WHERE id = %s", (feedback_id,))
+            elif action in ('read', 'unread'):
+                # Marcar como lido / não lido (o estado antigo acerta o contador de não lidas)
+                is_read = action == 'read'
+                cur.execute("""
+                    UPDATE feedback f SET is_read = %s, read_at = %s
+                    FROM (SELECT id, is_read FROM feedback WHERE id = %s FOR UPDATE) old
+                    WHERE f.id = old.id
+                    RETURNING old.is_read AS was_read
+                """, (is_read, datetime.now() if is_read else None, feedback_id))
+                row = cur.fetchone()
+                if row:
+                    record_read_changed(cur, row['was_read'], is_read)
             elif action == 'poke':
                 # CUTUCADA! 👉
                 # Buscar a mensagem original
@@ -769,11 +635,11 @@ class handler(BaseHTTPRequestHandler):
                 
                 original_message = result['message']
                 
-                # Enviar cutucada
-                poke_sent = send_poke_notification(feedback_id, original_message)
+                # Enfileirar cutucada (entregue depois da resposta)
+                poke_sent = enqueue_poke_notification(cur, original_message)
                 
                 # Desbloquear conquista de cutucada
-                unlock_achievement(conn, 'gehh', 'first_poke')
+                unlock_achievements(cur, 'gehh', ['first_poke'])
                 
                 conn.commit()
                 cur.close()
@@ -784,6 +650,7 @@ class handler(BaseHTTPRequestHandler):
                         'message': 'Cutucada enviada! 👉 Pablo vai receber a notificação!',
                         'poke_sent': True
                     })
+                    deliver_after_response()
                 else:
                     self._send_json(200, {
                         'message': 'Cutucada registrada! (notificação pode ter falhado)',
@@ -815,7 +682,7 @@ class handler(BaseHTTPRequestHandler):
             # Verificar se é para deletar uma resposta
             if len(path_parts) >= 3 and path_parts[-2] == 'reply':
                 reply_id = path_parts[-1]
-                init_db()
+                ensure_schema()
                 conn = get_db_connection()
                 if not conn:
                     self._send_json(500, {'error': 'Banco de dados não configurado'})
@@ -823,6 +690,7 @@ class handler(BaseHTTPRequestHandler):
                 
                 cur = conn.cursor()
                 cur.execute("DELETE FROM feedback_replies WHERE id = %s", (reply_id,))
+                record_replies(cur, -cur.rowcount)
                 conn.commit()
                 cur.close()
                 conn.close()
@@ -831,7 +699,7 @@ class handler(BaseHTTPRequestHandler):
                 return
             
             feedback_id = path_parts[-1]
-            init_db()
+            ensure_schema()
             
             conn = get_db_connection()
             if not conn:
@@ -839,9 +707,17 @@ class handler(BaseHTTPRequestHandler):
                 return
             
             cur = conn.cursor()
-            cur.execute("DELETE FROM feedback WHERE id = %s", (feedback_id,))
+            # As respostas são contadas antes do CASCADE apagá-las (snapshot do comando)
+            cur.execute("""
+                DELETE FROM feedback WHERE id = %s
+                RETURNING created_at, mood, is_read,
+                          (SELECT COUNT(*) FROM feedback_replies WHERE feedback_id = feedback.id)
+            """, (feedback_id,))
+            deleted = cur.fetchone()
             
             row_count = cur.rowcount
+            if deleted:
+                record_post_deleted(cur, *deleted)
             conn.commit()
             cur.close()
             conn.close()
@@ -5,8 +5,13 @@ Verifica o status da API e suas dependências
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
 from datetime import datetime
 
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _db import get_db_connection
+
 # Tentar importar dependências
 try:
     import psycopg2
@@ -40,8 +45,7 @@ class handler(BaseHTTPRequestHandler):
         db_status = 'not_configured'
         if db_configured and DB_AVAILABLE:
             try:
-                conn_str = os.environ.get('POSTGRES_URL') or os.environ.get('DATABASE_URL')
-                conn = psycopg2.connect(conn_str)
+                conn = get_db_connection()
                 # Testar query simples
                 cur = conn.cursor()
                 cur.execute("SELECT 1")
@@ -0,0 +1,236 @@
+"""
+Canal ao vivo das mensagens de uma sessão - Vercel Serverless Function
+No modo grupo (Pablo entrou pelo link do tool_call_pablo) cada participante
+precisa ver as mensagens dos outros sem ficar refazendo GET em
+/api/conversations/:id.
+
+Cada mensagem gravada (insert_chat_message ou a rodada de _chat_turn.py)
+faz um NOTIFY no canal CHAT_NOTIFY_CHANNEL (ver _session_stats.py). Este
+endpoint faz LISTEN numa conexão própria e fica parado até chegar mensagem
+da sessão (ou acabar o tempo), então devolve só as mensagens novas:
+
+    GET /api/live?session_id=X&after_id=N        long-poll (até LIVE_POLL_SECONDS)
+        -> {session_id, messages: [...], lastMessageId, hasMore}
+           messages vazio = acabou o tempo, é só chamar de novo com o mesmo after_id
+
+    GET /api/live?session_id=X&after_id=N  com Accept: text/event-stream (ou ?stream=1)
+        -> Server-Sent Events: "message" a cada mensagem (id: = id da mensagem),
+           comentário de ping a cada LIVE_HEARTBEAT_SECONDS e fecha depois de
+           LIVE_STREAM_SECONDS; o EventSource reconecta sozinho mandando
+           Last-Event-ID, que vale como after_id
+
+Sem after_id, começa da última mensagem que já existe (só as que chegarem
+depois). As mensagens têm o mesmo formato de /api/conversations/:id.
+
+Custo: LISTEN não funciona pelo pool (nem por pooler em modo transação),
+então cada cliente esperando segura uma conexão própria com o Postgres
+(open_listen_connection) durante toda a espera. O número de abas abertas
+em /api/live conta direto no max_connections do banco; os tempos ficam
+limitados a LIVE_MAX_SECONDS para caber no maxDuration da função
+(vercel.json) e a conexão ser sempre fechada pelo próprio handler.
+"""
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+import select
+import sys
+import time
+from urllib.parse import urlparse, parse_qs
+
+# Tentar importar psycopg2
+try:
+    from psycopg2.extras import RealDictCursor
+    DB_AVAILABLE = True
+except ImportError:
+    DB_AVAILABLE = False
+    print("psycopg2 não disponível")
+
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _db import open_listen_connection
+from _migrations import ensure_schema
+from _conversation_index import MESSAGE_MAX_PAGE_SIZE, list_messages
+from _session_stats import CHAT_NOTIFY_CHANNEL, get_session_stats, parse_chat_notify
+
+# Teto das esperas: abaixo do maxDuration de 60s do api/live.py no vercel.json
+LIVE_MAX_SECONDS = 50
+# Quanto tempo um long-poll fica esperando antes de responder vazio (segundos)
+LIVE_POLL_SECONDS = min(float(os.environ.get("LIVE_POLL_SECONDS", 25)), LIVE_MAX_SECONDS)
+# Duração de uma conexão SSE antes de fechar e deixar o EventSource reconectar
+LIVE_STREAM_SECONDS = min(float(os.environ.get("LIVE_STREAM_SECONDS", 50)), LIVE_MAX_SECONDS)
+# Intervalo dos pings no SSE (mantém proxies sem derrubar a conexão ociosa)
+LIVE_HEARTBEAT_SECONDS = 15
+# Quanto o cliente espera antes de reconectar o EventSource (ms)
+LIVE_RETRY_MS = 1000
+
+
+def fetch_new_messages(conn, session_id, after_id):
+    """Mensagens da sessão com id > after_id. Retorna (mensagens, has_more)."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        return list_messages(cur, session_id, after_id=after_id, limit=MESSAGE_MAX_PAGE_SIZE)
+    finally:
+        cur.close()
+
+
+def last_message_id(conn, session_id):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        return get_session_stats(cur, session_id)['last_message_id'] or 0
+    finally:
+        cur.close()
+
+
+def wait_for_notify(conn, session_id, after_id, timeout):
+    """
+    Espera até timeout segundos por um NOTIFY de mensagem da sessão mais
+    nova que after_id. Retorna True se chegou, False se acabou o tempo.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if select.select([conn], [], [], remaining) == ([], [], []):
+            return False
+        conn.poll()
+        arrived = False
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            notified_session, message_id = parse_chat_notify(notify.payload)
+            if notified_session == session_id and message_id > after_id:
+                arrived = True
+        if arrived:
+            return True
+
+
+def wait_for_messages(conn, session_id, after_id, timeout):
+    """
+    Devolve as mensagens novas da sessão assim que existirem, esperando no
+    máximo timeout segundos. A conexão já precisa estar em LISTEN: assim uma
+    mensagem gravada entre a consulta e a espera não se perde.
+    Retorna (mensagens, has_more); ([], False) se acabou o tempo.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        messages, has_more = fetch_new_messages(conn, session_id, after_id)
+        if messages:
+            return messages, has_more
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not wait_for_notify(conn, session_id, after_id, remaining):
+            return [], False
+
+
+def _float_param(query_params, name, default, maximum):
+    try:
+        value = float(query_params[name][0]) if name in query_params else default
+    except ValueError:
+        return default
+    return max(0.0, min(value, maximum))
+
+
+class handler(BaseHTTPRequestHandler):
+    def _send_cors_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept, Origin, Last-Event-ID')
+
+    def _send_json(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Cache-Control', 'no-store')
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(json.dumps(data, default=str, ensure_ascii=False).encode('utf-8'))
+
+    def _start_event_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(f"retry: {LIVE_RETRY_MS}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_message_event(self, message):
+        payload = json.dumps(message, default=str, ensure_ascii=False)
+        self.wfile.write(f"id: {message['id']}\nevent: message\ndata: {payload}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_ping(self):
+        self.wfile.write(b": ping\n\n")
+        self.wfile.flush()
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self._send_cors_headers()
+        self.end_headers()
+
+    def do_GET(self):
+        query_params = parse_qs(urlparse(self.path).query)
+        session_id = query_params.get('session_id', [''])[0]
+        if not session_id:
+            self._send_json(400, {'error': 'session_id é obrigatório'})
+            return
+        try:
+            after_id = query_params.get('after_id', [None])[0] or self.headers.get('Last-Event-ID')
+            after_id = int(after_id) if after_id else None
+        except ValueError:
+            self._send_json(400, {'error': 'after_id deve ser um número'})
+            return
+        stream = (
+            'text/event-stream' in (self.headers.get('Accept') or '')
+            or query_params.get('stream', [''])[0] in ('1', 'true')
+        )
+
+        conn = None
+        try:
+            ensure_schema()
+            conn = open_listen_connection() if DB_AVAILABLE else None
+            if not conn:
+                self._send_json(503, {'error': 'Banco de dados não configurado'})
+                return
+            # LISTEN antes da primeira consulta: nada gravado depois dela escapa
+            conn.cursor().execute(f"LISTEN {CHAT_NOTIFY_CHANNEL}")
+            if after_id is None:
+                after_id = last_message_id(conn, session_id)
+
+            if stream:
+                self._stream(conn, session_id, after_id)
+                return
+
+            timeout = _float_param(query_params, 'timeout', LIVE_POLL_SECONDS, LIVE_POLL_SECONDS)
+            messages, has_more = wait_for_messages(conn, session_id, after_id, timeout)
+            self._send_json(200, {
+                'session_id': session_id,
+                'messages': messages,
+                'lastMessageId': messages[-1]['id'] if messages else after_id,
+                'hasMore': has_more,
+            })
+        except (BrokenPipeError, ConnectionResetError):
+            # Cliente foi embora no meio da espera
+            pass
+        except Exception as e:
+            print(f"❌ Erro no canal ao vivo: {e}")
+            if not stream:
+                self._send_json(500, {'error': str(e)})
+        finally:
+            if conn:
+                conn.close()
+
+    def _stream(self, conn, session_id, after_id):
+        """SSE: manda cada mensagem nova assim que o NOTIFY chega, até LIVE_STREAM_SECONDS"""
+        self._start_event_stream()
+        deadline = time.monotonic() + LIVE_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            messages, _ = wait_for_messages(conn, session_id, after_id, min(LIVE_HEARTBEAT_SECONDS, remaining))
+            if not messages:
+                self._send_ping()
+                continue
+            for message in messages:
+                self._send_message_event(message)
+            after_id = messages[-1]['id']
@@ -4,16 +4,13 @@ Endpoint para salvar inscrições de Push Notification
 from http.server import BaseHTTPRequestHandler
 import json
 import os
-import psycopg2
+import sys
 from datetime import datetime
 
-# ============== CONFIGURAÇÕES ==============
-POSTGRES_URL = os.environ.get("POSTGRES_URL") or os.environ.get("DATABASE_URL")
-
-def get_db_connection():
-    if not POSTGRES_URL:
-        return None
-    return psycopg2.connect(POSTGRES_URL)
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _db import get_db_connection
+from _migrations import ensure_schema
 
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
@@ -45,20 +42,10 @@ class handler(BaseHTTPRequestHandler):
                 self.end_headers()
                 return
 
+            ensure_schema()
             conn = get_db_connection()
             if conn:
                 cur = conn.cursor()
-                # Criar tabela se não existir
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS push_subscriptions (
-                        id SERIAL PRIMARY KEY,
-                        endpoint TEXT NOT NULL UNIQUE,
-                        p256dh TEXT NOT NULL,
-                        auth TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                
                 # Inserir ou Atualizar
                 cur.execute("""
                     INSERT INTO push_subscriptions (endpoint, p256dh, auth)
@@ -0,0 +1,60 @@
+"""
+Worker de tarefas em segundo plano - Vercel Serverless Function
+Entrega os e-mails e pushes pendentes (ver _outbox.py) e processa os jobs
+de aprendizado do Matteo (ver _learning.py). Os endpoints já fazem isso
+depois de responder e o /api/cron pega o que sobrar duas vezes por dia;
+este endpoint é para rodar à mão ou por um cron mais frequente, em plano
+da Vercel que aceite cron a cada minuto ("* * * * *").
+"""
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+import sys
+import time
+
+# Helpers compartilhados (arquivos com _ na mesma pasta)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _migrations import ensure_schema
+from _outbox import drain_outbox
+from _learning import process_learning_jobs
+
+# Tempo total de uma chamada do worker; o aprendizado fica com o que sobrar das notificações
+WORKER_BUDGET_SECONDS = 50
+
+
+class handler(BaseHTTPRequestHandler):
+    def _send_json(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(data).encode())
+
+    def _authorized(self):
+        # Com CRON_SECRET configurado, só a Vercel (cron) e quem tem o segredo chamam o worker
+        secret = os.environ.get("CRON_SECRET")
+        return not secret or self.headers.get('Authorization') == f"Bearer {secret}"
+
+    def _drain(self):
+        if not self._authorized():
+            self._send_json(401, {'error': 'Não autorizado'})
+            return
+        try:
+            ensure_schema()
+            started = time.monotonic()
+            # Notificações primeiro: são rápidas e alguém está esperando por elas
+            notifications = drain_outbox()
+            if any(notifications.values()):
+                print(f"📬 Outbox: {notifications['sent']} enviada(s), {notifications['retry']} para tentar de novo, {notifications['failed']} desistida(s)")
+            learning = process_learning_jobs(budget_seconds=WORKER_BUDGET_SECONDS - (time.monotonic() - started))
+            if any(learning.values()):
+                print(f"🧠 Aprendizado: {learning['done']} job(s), {learning['retry']} para tentar de novo, {learning['failed']} desistido(s)")
+            self._send_json(200, {'notifications': notifications, 'learning': learning})
+        except Exception as e:
+            print(f"Erro no worker da outbox: {e}")
+            self._send_json(500, {'error': str(e)})
+
+    def do_GET(self):
+        self._drain()
+
+    def do_POST(self):
+        self._drain()
@@ -0,0 +1,154 @@
+"""
+Micro-benchmark da limpeza das respostas do Matteo (api/_sanitizer.py).
+
+Roda sanitize_response e o StreamingSanitizer (tokens de ~4 caracteres,
+como chegam do modelo) sobre o corpus de respostas em replies.jsonl, e
+compara com a limpeza antiga em várias passadas (copiada aqui tal como
+estava no handler, como referência de velocidade e de saída):
+
+    python benchmarks/sanitizer_bench.py
+    python benchmarks/sanitizer_bench.py --diff   # mostra onde a saída mudou
+"""
+import json
+import os
+import re
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'api'))
+
+from _sanitizer import (  # noqa: E402
+    EMPTY_RESPONSE_FALLBACK, MAX_RESPONSE_LENGTH, MIN_RESPONSE_LENGTH, SHORT_RESPONSE_FALLBACK,
+    StreamingSanitizer, sanitize_response,
+)
+
+REPEAT = 5
+TOKEN_SIZE = 4
+
+
+def load_corpus(path=os.path.join(HERE, 'replies.jsonl')):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['reply'] for line in f if line.strip()]
+
+
+def legacy_sanitize(bot_response):
+    """
+    Limpeza antiga, copiada do handler de api/chat.py de antes do _sanitizer.py
+    (mesma ordem das regras; só o print do fallback ficou de fora): uma passada
+    de regex por regra, padrões compilados a cada chamada
+    """
+    bot_response = bot_response.strip()
+
+    bot_response = re.sub(r'\*[^*]+\*', '', bot_response).strip()
+    bot_response = re.sub(r'\[.*?\]\(.*?\)', '', bot_response).strip()
+    bot_response = re.sub(r'#{1,6}\s+', '', bot_response).strip()
+
+    prefixes_to_remove = ['matteo:', 'assistant:', 'ai:', 'bot:']
+    for prefix in prefixes_to_remove:
+        if bot_response.lower().startswith(prefix):
+            bot_response = bot_response[len(prefix):].strip()
+
+    strange_patterns = [
+        r'^como posso ajudar.*?\?',
+        r'^olá.*?\!',
+        r'^oi.*?\!',
+        r'^eu sou.*?matteo',
+        r'^sou o.*?matteo',
+        r'^meu nome é.*?matteo',
+    ]
+    for pattern in strange_patterns:
+        bot_response = re.sub(pattern, '', bot_response, flags=re.IGNORECASE).strip()
+
+    bot_response = re.sub(r'\s+', ' ', bot_response).strip()
+
+    emoji_pattern = re.compile(r'[😀-🙏🌀-🗿🚀-🛿Ⓜ-🉑]+')
+    emojis = emoji_pattern.findall(bot_response)
+    if len(emojis) > 1:
+        for i, emoji in enumerate(emojis):
+            if i > 0:
+                bot_response = bot_response.replace(emoji, '', 1)
+        bot_response = re.sub(r'\s+', ' ', bot_response).strip()
+
+    if not bot_response or len(bot_response.strip()) < 3:
+        bot_response = EMPTY_RESPONSE_FALLBACK
+
+    if bot_response and bot_response[0] in ['.', ',', '!', '?', ':']:
+        bot_response = bot_response[1:].strip()
+
+    generic_phrases = [
+        'como posso ajudar',
+        'olá',
+        'oi,',
+        'oi!',
+        'eu sou',
+        'sou o',
+        'meu nome é',
+        'sou uma ia',
+        'eu sou uma ia',
+        'sou o matteo',
+        'eu sou o matteo',
+    ]
+    for phrase in generic_phrases:
+        if bot_response.lower().startswith(phrase):
+            for punct in ['.', '!', '?', '\n']:
+                idx = bot_response.find(punct)
+                if idx > 0:
+                    bot_response = bot_response[idx+1:].strip()
+                    break
+            if bot_response.lower().startswith(phrase):
+                words = bot_response.split()
+                phrase_words = phrase.split()
+                if len(words) >= len(phrase_words):
+                    bot_response = ' '.join(words[len(phrase_words):]).strip()
+            break
+
+    bot_response = re.sub(r'\s+', ' ', bot_response).strip()
+
+    if len(bot_response) < 10:
+        bot_response = SHORT_RESPONSE_FALLBACK
+    elif len(bot_response) > 500:
+        bot_response = bot_response[:497] + "..."
+    return bot_response
+
+
+def stream_sanitize(reply):
+    """Texto que o cliente recebe no streaming (tokens + finish), ou o fallback"""
+    sanitizer = StreamingSanitizer()
+    sent = [sanitizer.feed(reply[i:i + TOKEN_SIZE]) for i in range(0, len(reply), TOKEN_SIZE)]
+    sent.append(sanitizer.finish())
+    return sanitizer.text if sanitizer.replaced else "".join(sent)
+
+
+def bench(name, function, corpus):
+    run = lambda: [function(reply) for reply in corpus]  # noqa: E731
+    number = max(1, 2000 // len(corpus))
+    best = min(timeit.repeat(run, number=number, repeat=REPEAT)) / number
+    print(f"{name:<22} {best * 1e6 / len(corpus):8.1f} µs/resposta")
+    return best
+
+
+def main():
+    corpus = load_corpus()
+    print(f"Corpus: {len(corpus)} respostas, {sum(map(len, corpus))} caracteres\n")
+
+    # Primeira chamada fora da medição (compila os padrões do legado no cache do re)
+    for reply in corpus:
+        legacy_sanitize(reply)
+
+    legacy = bench("legado (várias passadas)", legacy_sanitize, corpus)
+    current = bench("sanitize_response", sanitize_response, corpus)
+    bench("StreamingSanitizer", stream_sanitize, corpus)
+    print(f"\nsanitize_response: {legacy / current:.1f}x o legado")
+
+    changed = [(reply, legacy_sanitize(reply), sanitize_response(reply)) for reply in corpus]
+    changed = [item for item in changed if item[1] != item[2]]
+    streamed = sum(1 for reply in corpus if stream_sanitize(reply) != sanitize_response(reply))
+    print(f"Saídas diferentes do legado: {len(changed)}; stream diferente do JSON: {streamed}")
+    if '--diff' in sys.argv[1:]:
+        for reply, old, new in changed:
+            print(f"\n  entrada: {reply!r}\n  legado:  {old!r}\n  agora:   {new!r}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Confere que o streaming manda exatamente a mesma resposta do modo JSON.
+
+Quebra cada resposta em pedaços de vários tamanhos, passa pelo
+StreamingSanitizer e compara o texto enviado (tokens + finish) com o
+sanitize_response da resposta inteira. Usa o corpus de replies.jsonl, os
+casos abaixo e respostas sorteadas a partir de pedaços "difíceis"
+(links, *ações*, cabeçalhos, prefixos, frases genéricas, emojis):
+
+    python benchmarks/streaming_parity.py             # sai com 1 se alguma diferir
+    python benchmarks/streaming_parity.py -n 20000    # mais respostas sorteadas
+"""
+import json
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'api'))
+
+from _sanitizer import (  # noqa: E402
+    EMPTY_RESPONSE_FALLBACK, SHORT_RESPONSE_FALLBACK, StreamingSanitizer, sanitize_response,
+)
+
+CHUNK_SIZES = (1, 2, 3, 4, 7, 20)
+RANDOM_REPLIES = 2000
+SEED = 42
+
+CASES = [
+    "Que legal, princesa! Dá uma olhada: [link](https://a.b/c) muito bom",
+    "Matteo: Matteo: oi, tudo bem?",
+    "Olá! Eu sou o Matteo, e você? Bora conversar 😀😀 🚀",
+    "oi, tudo bem. oi, legal demais isso aí",
+    "*sorri* ## Título\nVamos nessa, [texto](url) e *abraça* mais [x] (y) aqui",
+    ": , mas então né princesa",
+    "Como posso ajudar você hoje? Fala comigo!",
+    "texto *sem fechar e [link sem fechar também",
+]
+
+FRAGMENTS = [
+    "Que legal", "princesa", "Matteo:", "matteo: ", "Olá!", "oi,", "Oi!", "oi amor!",
+    "eu sou o Matteo", "sou o matteo.", "como posso ajudar?", "meu nome é Matteo!", "bot:",
+    "*sorri*", "*abraça", "[link](https://a.b/c)", "[x]", "(y)", "# ", "## Título",
+    "😀", "🚀🚀", "💙", " ", "  ", "\n", ".", ",", "!", "?", ":",
+    "Dá uma olhada", "muito bom", "Tudo bem", "hoje",
+]
+
+
+def load_corpus(path=os.path.join(HERE, 'replies.jsonl')):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['reply'] for line in f if line.strip()]
+
+
+def random_replies(count, seed=SEED):
+    rng = random.Random(seed)
+    for _ in range(count):
+        parts = rng.randint(1, 30)
+        yield "".join(rng.choice(FRAGMENTS) + rng.choice(["", " "]) for _ in range(parts))
+
+
+def stream(reply, size):
+    """Texto que o cliente recebe (tokens + finish) e a resposta final do sanitizer"""
+    sanitizer = StreamingSanitizer()
+    sent = [sanitizer.feed(reply[i:i + size]) for i in range(0, len(reply), size)]
+    sent.append(sanitizer.finish())
+    return "".join(sent), sanitizer.text
+
+
+def check(reply):
+    """Retorna (tamanho do pedaço, enviado, esperado) da primeira diferença, ou None"""
+    expected = sanitize_response(reply)
+    for size in CHUNK_SIZES:
+        sent, final = stream(reply, size)
+        if final != expected:
+            return size, final, expected
+        # Fallback (vazia/curta) não tem como ser enviado aos poucos: vai no done
+        if sent != expected and expected not in (EMPTY_RESPONSE_FALLBACK, SHORT_RESPONSE_FALLBACK):
+            return size, sent, expected
+    return None
+
+
+def main():
+    count = RANDOM_REPLIES
+    if '-n' in sys.argv[1:]:
+        count = int(sys.argv[sys.argv.index('-n') + 1])
+
+    replies = load_corpus() + CASES + list(random_replies(count))
+    # O "⚠️ Resposta do bot vazia" do sanitize_response não interessa aqui
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        failures = [(reply, diff) for reply in replies for diff in [check(reply)] if diff]
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    for reply, (size, sent, expected) in failures[:10]:
+        print(f"\n  entrada:  {reply!r}\n  pedaços de {size}: {sent!r}\n  JSON:     {expected!r}")
+    if failures:
+        print(f"\n❌ {len(failures)} de {len(replies)} respostas saem diferentes no streaming")
+        sys.exit(1)
+    print(f"✅ {len(replies)} respostas iguais no streaming e no JSON (pedaços de {CHUNK_SIZES})")
+
+
+if __name__ == '__main__':
+    main()